@@ -1,12 +1,42 @@
+import os
+import sys
+import logging
 import pymongo
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# módulos de processing_scripts importados pelo mesmo caminho dos scripts de lá (import direto),
+# para que instrumentation e os demais sejam um único módulo no processo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processing_scripts'))
 
 from recommender import SimilarBugReportsRecommendationSystem
 from data_loader import EnhancedMongoDataLoader
+from arc_graph import ArcGraph, ArcGraphRecommender
+from recommendation_cache import CachedRecommender
+from metrics import AssigneeEncoder, build_relevance_matrix, calculate_metrics_all_k
+from result_sink import open_result_sink
+from instrumentation import configure_logging, configure_instrumentation, debug_enabled, stage, count, log_debug, print_summary, write_summary, pop_stats, merge_stats
 
 from time import time
 
 DATABASE_URL = "mongodb://localhost:27017/"
 DATABASE_NAME = 'bug_report_colab'
+EVALUATION_WORKERS = os.cpu_count() # 1 = sequencial
+EVALUATION_BACKEND = 'process' # 'process' (cada worker recria o recomendador, usa todos os núcleos) ou 'thread' (mesma memória, limitado pelo GIL)
+ARC_GRAPH_PATH = None # ex: 'processing_scripts/arc_graph.npz' responde as recomendações direto do grafo top-N
+RESULTS_OUTPUT_PATH = None # None salva na collection result; ex: 'results.npz' salva localmente
+RUN_SUMMARY_PATH = 'evaluation_run_summary.json'
+PROFILE = None # 'cprofile' ou 'pyinstrument' salva o profile dos estágios em PROFILE_DIR
+PROFILE_STAGES = None # ex: ['run_queries']; None perfila qualquer estágio (só o mais externo)
+PROFILE_DIR = 'profiles'
+# cache LRU dos rankings por (bg_number, versão); None desliga. Desligado por padrão: a
+# varredura de execute_evaluation_all_k faz uma única query (fundida, K=max_k) por bug, então
+# o cache nunca acerta e só custa hash/cópia. Vale ligar quando as mesmas queries se repetem
+# no processo, ex: execute_evaluation chamado para vários K. Só é usado no processo que
+# atende as queries (workers=1 ou backend 'thread'); no backend 'process' fica desligado
+RECOMMENDATION_CACHE_BYTES = None # ex: 256 * 1024 * 1024
+RECOMMENDATION_CACHE_MIN_K = 20 # um miss pede pelo menos este K, e os Ks menores saem do cache
 
 # CONEXÃO COM MONGODB
 
@@ -97,74 +127,310 @@ def print_results_resumee(results):
     print(f'[RESULT] ID={results["query"]} - fb={results["feedback"]} prc={results["precision"]} lkh={results["likelihood"]}')
     #for x in results["recommendations"]
 
-def instanciate_recommender():
-    data_loader = EnhancedMongoDataLoader(database=DATABASE_NAME, host='localhost', port=27017)
-    recommender = SimilarBugReportsRecommendationSystem(data_loader=data_loader)
+# classe do recomendador que instanciate_recommender cria, sem instanciar (ex: para saber
+# se ele tem get_recommendations_all_versions quando só os workers o criam)
+def recommender_class():
+    return ArcGraphRecommender if ARC_GRAPH_PATH is not None else SimilarBugReportsRecommendationSystem
+
+def instanciate_recommender(use_cache=True):
+    if ARC_GRAPH_PATH is not None:
+        db = get_mongo_conn(MONGO_URL=DATABASE_URL, MONGO_DATABASE=DATABASE_NAME)
+        recommender = ArcGraphRecommender(ArcGraph.load(ARC_GRAPH_PATH), db)
+    else:
+        data_loader = EnhancedMongoDataLoader(database=DATABASE_NAME, host='localhost', port=27017)
+        recommender = SimilarBugReportsRecommendationSystem(data_loader=data_loader)
+
+    if use_cache and RECOMMENDATION_CACHE_BYTES is not None:
+        recommender = CachedRecommender(recommender, max_bytes=RECOMMENDATION_CACHE_BYTES, min_k=RECOMMENDATION_CACHE_MIN_K)
 
     return recommender
 
-def execute_evaluation(db, k, evaluation_version, simi_score_type, save_results=False):
+# o recomendador (e o cache na frente dele) é reaproveitado entre execuções no mesmo processo,
+# ex: execute_evaluation chamado para vários K
+recommender_instances = {}
+
+def shared_recommender(use_cache=True):
+    if use_cache not in recommender_instances:
+        recommender_instances[use_cache] = instanciate_recommender(use_cache=use_cache)
+    return recommender_instances[use_cache]
+
+# com o backend 'process' as queries rodam só nos workers, que criam o próprio recomendador
+def runs_in_workers(workers, backend):
+    return workers is not None and workers > 1 and backend == 'process'
+
+# o cache só atende as queries quando elas rodam neste processo
+def uses_recommendation_cache(workers, backend):
+    return not runs_in_workers(workers, backend)
+
+# recomendador do processo pai; None quando só os workers precisam de um
+def evaluation_recommender(workers, backend):
+    if runs_in_workers(workers, backend):
+        return None
+    return shared_recommender(use_cache=uses_recommendation_cache(workers, backend))
+
+# hits/misses já somados aos contadores, por recomendador: cada chamada soma só a diferença
+reported_cache_stats = {}
+
+def report_cache_stats(recommender):
+    if isinstance(recommender, CachedRecommender):
+        recommender.print_stats()
+        stats = recommender.stats()
+        hits, misses = reported_cache_stats.get(id(recommender), (0, 0))
+        count('recommendation_cache_hits', stats["hits"] - hits)
+        count('recommendation_cache_misses', stats["misses"] - misses)
+        reported_cache_stats[id(recommender)] = (stats["hits"], stats["misses"])
+
+def build_result(sample_bug, recommendations, evaluation_version, k):
+    return {
+        "version": evaluation_version,
+        "query": sample_bug["bg_number"],
+        "feedback": calculate_feedback(query=sample_bug, results=recommendations, K=k),
+        "precision": calculate_precision(query=sample_bug, results=recommendations),
+        "likelihood": calculate_likelihood(query=sample_bug, results=recommendations),
+        "recommendations": [
+            {
+                "bg_number": rec["item"]["bg_number"],
+                "summary": rec["item"]["summary"],
+                "product": rec["item"]["product"],
+                "component": rec["item"]["component"],
+                "score": rec["score"],
+                "cos_similarity_tfidf": rec["cos_similarity_tfidf"],
+                "cos_similarity_word_embeddings": rec["cos_similarity_word_embeddings"],
+                "relevant": positive_result(sample_bug, rec["item"]),
+            } for rec in recommendations
+        ],
+        "k": k
+    }
+
+def print_metrics_resumee(results):
+    avg_feedback   = calculate_avg_metric(results=[ r["feedback"] for r in results ])
+    avg_precision  = calculate_avg_metric(results=[ r["precision"] for r in results ])
+    avg_likelihood = calculate_avg_metric(results=[ r["likelihood"] for r in results ])
+
+    print('-'*50)
+
+    print(f'Metrics resumee of the evaluation were:')
+    print(f'Avg feedback: {avg_feedback}')
+    print(f'Avg precision: {avg_precision}')
+    print(f'Avg likelihood: {avg_likelihood}')
+
+# EXECUÇÃO CONCORRENTE DAS QUERIES
+# 'thread': todas as threads usam o mesmo recomendador (mesma memória).
+# 'process': o MongoClient do recomendador não é fork-safe, então o pool usa spawn e
+# cada worker cria o próprio recomendador com instanciate_recommender no initializer;
+# o pool é reaproveitado entre as versões e fechado no fim da avaliação.
+# executor.map mantém a ordem da amostra, então os resultados são determinísticos.
+# O recomendador das threads é passado com functools.partial, e não por uma variável do
+# módulo, para que duas avaliações no mesmo processo não troquem de recomendador;
+# worker_recommender só existe dentro de cada processo do pool.
+
+worker_recommender = None
+process_pool = None
+
+def init_evaluation_worker():
+    global worker_recommender
+    worker_recommender = instanciate_recommender(use_cache=False)
+
+def get_process_pool(workers):
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_evaluation_worker)
+    return process_pool
+
+def close_process_pool():
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown()
+        process_pool = None
+
+# simi_score_type em lista: um dict versão -> recomendações, de uma única chamada get_recommendations_all_versions
+def request_recommendations(recommender, sample_bug, k, simi_score_type, verbose=False):
+    if verbose:
+        log_debug(lambda: f'[REQUEST]Requesting recommendations for ID={sample_bug["bg_number"]}, Summary={sample_bug["summary"]}')
+    if isinstance(simi_score_type, list):
+        return recommender.get_recommendations_all_versions(query=sample_bug, K=k, similarity_score_types=simi_score_type)
+    return recommender.get_recommendations(query=sample_bug, K=k, similarity_score_type=simi_score_type)
+
+def request_recommendations_args(recommender, args):
+    return request_recommendations(recommender, *args)
+
+# executado nos processos do pool, com o recomendador criado em init_evaluation_worker;
+# contadores e estágios do worker voltam junto com as recomendações
+def request_recommendations_in_worker(args):
+    return request_recommendations(worker_recommender, *args), pop_stats()
+
+def merge_worker_results(worker_results):
+    all_recommendations = []
+    for recommendations, worker_stats in worker_results:
+        merge_stats(worker_stats)
+        all_recommendations.append(recommendations)
+    return all_recommendations
+
+# no backend 'process' o recommender não é usado (pode ser None), os workers têm o seu
+def run_queries(recommender, sample, k, simi_score_type, workers=EVALUATION_WORKERS, backend=EVALUATION_BACKEND, verbose=False):
+    args = [ (sample_bug, k, simi_score_type, verbose) for sample_bug in sample ]
+
+    if workers is None or workers <= 1:
+        return [ request_recommendations_args(recommender, a) for a in args ]
+    if backend == 'thread':
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(functools.partial(request_recommendations_args, recommender), args))
+    if backend == 'process':
+        chunksize = max(1, len(args) // (workers * 4))
+        return merge_worker_results(get_process_pool(workers).map(request_recommendations_in_worker, args, chunksize=chunksize))
+    raise ValueError(f"backend must be 'thread' or 'process', got {backend}")
+
+def execute_evaluation(db, k, evaluation_version, simi_score_type, save_results=False, workers=EVALUATION_WORKERS, backend=EVALUATION_BACKEND, verbose=True):
     print('instanciating recommender...')
-    recommender = instanciate_recommender()
+    recommender = evaluation_recommender(workers, backend)
 
     print('retrieving sample...')
     sample = retrieve_sample(db)
 
     results = []
 
-    for sample_bug in sample:
-        print(f'[REQUEST]Requesting recommendations for ID={sample_bug["bg_number"]}, Summary={sample_bug["summary"]}')
-        recommendations = recommender.get_recommendations(query=sample_bug, K=k, similarity_score_type=simi_score_type)
-        result = {
-            "version": evaluation_version,
-            "query": sample_bug["bg_number"],
-            "feedback": calculate_feedback(query=sample_bug, results=recommendations, K=k),
-            "precision": calculate_precision(query=sample_bug, results=recommendations),
-            "likelihood": calculate_likelihood(query=sample_bug, results=recommendations),
-            "recommendations": [
-                {
-                    "bg_number": rec["item"]["bg_number"],
-                    "summary": rec["item"]["summary"],
-                    "product": rec["item"]["product"],
-                    "component": rec["item"]["component"],
-                    "score": rec["score"],
-                    "cos_similarity_tfidf": rec["cos_similarity_tfidf"],
-                    "cos_similarity_word_embeddings": rec["cos_similarity_word_embeddings"],
-                    "relevant": positive_result(sample_bug, rec["item"]),
-                } for rec in recommendations
-            ],
-            "k": k
-        }
+    all_recommendations = run_queries(recommender, sample, k, simi_score_type, workers=workers, backend=backend, verbose=verbose)
+
+    result_sink = open_result_sink(db, RESULTS_OUTPUT_PATH) if save_results else None
+
+    for sample_bug, recommendations in zip(sample, all_recommendations):
+        result = build_result(sample_bug, recommendations, evaluation_version, k)
 
         if save_results:
-            print(f'saving result row for ID={sample_bug["bg_number"]}')
-            save_result_row(db, result)
-        else:
+            result_sink.add(result)
+        elif verbose:
             print_recommendations_resumee(result["recommendations"])
             #print_results_resumee(result)
 
         results.append(result)
+
+    if result_sink is not None:
+        result_sink.close()
     
-    avg_feedback   = calculate_avg_metric(results=[ r["feedback"] for r in results ])
-    avg_precision  = calculate_avg_metric(results=[ r["precision"] for r in results ])
-    avg_likelihood = calculate_avg_metric(results=[ r["likelihood"] for r in results ])
+    print_metrics_resumee(results)
+    close_process_pool()
+    report_cache_stats(recommender)
 
+def print_metrics_all_k_resumee(version, metrics):
     print('-'*50)
+    print(f'Metrics resumee of the evaluation for {version} were:')
+    for i in range(len(metrics["feedback"])):
+        print(f'K={i+1} fb={metrics["feedback"][i]:.4f} prc={metrics["precision"][i]:.4f} lkh={metrics["likelihood"][i]:.4f} mrr={metrics["mrr"][i]:.4f} ndcg={metrics["ndcg"][i]:.4f}')
 
-    print(f'Metrics resumee of the evaluation were:')
-    print(f'Avg feedback: {avg_feedback}')
-    print(f'Avg precision: {avg_precision}')
-    print(f'Avg likelihood: {avg_likelihood}')
+# AVALIAÇÃO EM UMA PASSADA
+# recomendador e amostra são carregados uma vez; para cada query e versão o ranking
+# é pedido com K=max_k e as métricas de cada K <= max_k saem dos prefixos dessa lista,
+# calculadas de uma vez sobre a matriz de relevância (metrics.py).
+# Recomendadores com get_recommendations_all_versions respondem todas as versões de
+# uma query em uma chamada (scores base calculados uma vez, ScoreFusion do arc_graph)
+
+# recommender=None usa o recomendador compartilhado do processo; qualquer objeto com
+# get_recommendations(query, K, similarity_score_type) pode ser avaliado no lugar dele
+
+def execute_evaluation_all_k(db, max_k, versions, save_results=False, workers=EVALUATION_WORKERS, backend=EVALUATION_BACKEND, verbose=False, recommender=None):
+    if recommender is not None and backend == 'process' and workers is not None and workers > 1:
+        raise ValueError("backend 'process' recreates the recommender in each worker, use 'thread' to evaluate a given recommender")
+
+    print('instanciating recommender...')
+    with stage('instanciate_recommender'):
+        recommender = recommender if recommender is not None else evaluation_recommender(workers, backend)
+
+    print('retrieving sample...')
+    with stage('retrieve_sample'):
+        sample = retrieve_sample(db)
+
+    assignees = AssigneeEncoder()
+    queries_ids = assignees.encode_many([ sample_bug["assigned_to"] for sample_bug in sample ])
+
+    all_metrics = {}
+
+    result_sink = open_result_sink(db, RESULTS_OUTPUT_PATH) if save_results else None
+
+    # no backend 'process' o pai não cria o recomendador; a classe diz se há a chamada fundida
+    fused = hasattr(recommender if recommender is not None else recommender_class(), 'get_recommendations_all_versions')
+
+    fused_recommendations = None
+    if fused:
+        time_a = time()
+        with stage('run_queries'):
+            fused_recommendations = run_queries(recommender, sample, max_k, list(versions), workers=workers, backend=backend, verbose=verbose)
+        count('queries_evaluated', len(sample))
+        print(f'total recommendation time: {time() - time_a}s : {len(versions)} versions fused : K={max_k}')
+
+    for version in versions:
+        time_a = time()
+        recommendations_ids = []
+        if fused_recommendations is not None:
+            all_recommendations = [ recommendations[version] for recommendations in fused_recommendations ]
+        else:
+            with stage('run_queries'):
+                all_recommendations = run_queries(recommender, sample, max_k, version, workers=workers, backend=backend, verbose=verbose)
+            count('queries_evaluated', len(sample))
+
+        with stage('build_results'):
+            for sample_bug, recommendations in zip(sample, all_recommendations):
+                recommendations_ids.append(assignees.encode_many([ rec["item"]["assigned_to"] for rec in recommendations ]))
+
+                if save_results:
+                    for k in range(1, max_k + 1):
+                        result_sink.add(build_result(sample_bug, recommendations[:k], version, k))
+
+        with stage('metrics'):
+            relevance, lengths = build_relevance_matrix(queries_ids, recommendations_ids, max_k)
+            all_metrics[version] = calculate_metrics_all_k(relevance, lengths)
+
+        print_metrics_all_k_resumee(version, all_metrics[version])
+        print(f'total evaluation time: {time() - time_a}s : {version} : K=1..{max_k}')
+
+    if result_sink is not None:
+        with stage('save_results'):
+            result_sink.close()
+
+    close_process_pool()
+    report_cache_stats(recommender)
+    return all_metrics
+
+# COMPARAÇÃO ENTRE AVALIAÇÕES
+# diferença de feedback/precision/likelihood de uma avaliação (ex: embeddings em int8)
+# contra uma de referência (ex: float32), nos Ks pedidos
+
+COMPARISON_METRICS = { 'feedback': 'fb', 'precision': 'prc', 'likelihood': 'lkh' }
+
+def compare_metrics_all_k(baseline_metrics, metrics, ks):
+    comparison = {}
+    for version in metrics:
+        comparison[version] = {
+            metric: {
+                k: {
+                    "baseline": float(baseline_metrics[version][metric][k - 1]),
+                    "value": float(metrics[version][metric][k - 1]),
+                    "delta": float(metrics[version][metric][k - 1] - baseline_metrics[version][metric][k - 1])
+                } for k in ks
+            } for metric in COMPARISON_METRICS
+        }
+    return comparison
+
+def print_metrics_comparison(name, comparison):
+    print('-'*50)
+    print(f'Metrics of {name} against the baseline:')
+    for version, metrics in comparison.items():
+        for k in next(iter(metrics.values())):
+            print(f'{version} K={k} ' + ' '.join(
+                f'{short}={metrics[metric][k]["value"]:.4f} ({metrics[metric][k]["delta"]:+.4f})' for metric, short in COMPARISON_METRICS.items()
+            ))
     
 if __name__ == '__main__':
+    configure_logging(logging.INFO) # logging.DEBUG mostra cada [REQUEST]
+    configure_instrumentation(profile=PROFILE, profile_stages=PROFILE_STAGES, profile_dir=PROFILE_DIR)
     print('creating db connection...')
     db = get_mongo_conn(MONGO_URL=DATABASE_URL,
                         MONGO_DATABASE=DATABASE_NAME)
 
-    for version in ['categoric_tfidf_we', 'categoric_tfidf', 'categoric_we']:
-        for i in [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20]:
-            time_a = time()
-            execute_evaluation(db=db, k=i, evaluation_version=version, simi_score_type=version, save_results=False)
+    time_a = time()
+    execute_evaluation_all_k(db=db, max_k=20, versions=['categoric_tfidf_we', 'categoric_tfidf', 'categoric_we'], save_results=False, verbose=debug_enabled())
+
+    final_time = time() - time_a
+    print(f'total evaluation time: {final_time}s')
 
-            final_time = time() - time_a
-            print(f'total evaluation time: {final_time}s : {version} : K={i}')
\ No newline at end of file
+    print_summary()
+    write_summary(RUN_SUMMARY_PATH)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import numpy as np
+
+# MÉTRICAS VETORIZADAS
+# cada execução de avaliação vira uma matriz de relevância (queries x K): a posição
+# [q, i] é True se a (i+1)-ésima recomendação da query q tem o mesmo assigned_to da
+# query. lengths[q] é o número de recomendações devolvidas (<= max_k).
+# Todas as métricas saem para todo K = 1..max_k de uma vez, com as mesmas definições
+# de calculate_feedback/calculate_precision/calculate_likelihood em evaluate.py.
+
+MISSING = -1
+
+class AssigneeEncoder():
+    # assigned_to -> id inteiro, para comparar relevância como igualdade de inteiros
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, assigned_to):
+        if assigned_to not in self.ids:
+            self.ids[assigned_to] = len(self.ids)
+        return self.ids[assigned_to]
+
+    def encode_many(self, assignees):
+        return np.asarray([ self.encode(a) for a in assignees ], dtype=np.int64)
+
+# queries_ids: (Q,) ids dos assigned_to das queries
+# recommendations_ids: lista de Q listas com os ids dos assigned_to recomendados, em ordem
+def build_relevance_matrix(queries_ids, recommendations_ids, max_k):
+    n_queries = len(queries_ids)
+    recommended = np.full((n_queries, max_k), MISSING, dtype=np.int64)
+    lengths = np.zeros(n_queries, dtype=np.int64)
+    for q, ids in enumerate(recommendations_ids):
+        ids = ids[:max_k]
+        recommended[q, :len(ids)] = ids
+        lengths[q] = len(ids)
+
+    relevance = (recommended == np.asarray(queries_ids, dtype=np.int64)[:, None]) & (recommended != MISSING)
+    return relevance, lengths
+
+# devolve, para cada métrica, um array (max_k,) com a média sobre as queries em cada K
+def calculate_metrics_all_k(relevance, lengths):
+    n_queries, max_k = relevance.shape
+    if n_queries == 0:
+        zeros = np.zeros(max_k)
+        return { "feedback": zeros, "precision": zeros, "likelihood": zeros, "mrr": zeros, "ndcg": zeros }
+
+    ks = np.arange(1, max_k + 1)
+    relevance = relevance.astype(np.float64)
+    returned = np.minimum(ks[None, :], lengths[:, None])
+
+    # feedback@K: devolveu pelo menos K recomendações
+    feedback = (lengths[:, None] >= ks[None, :]).astype(np.float64)
+
+    # precision@K: relevantes entre as recomendações devolvidas até K
+    hits = np.cumsum(relevance, axis=1)
+    precision = np.divide(hits, returned, out=np.zeros_like(hits), where=returned > 0)
+
+    # likelihood@K: pelo menos uma relevante até K
+    likelihood = (hits > 0).astype(np.float64)
+
+    # MRR@K: inverso da posição da primeira relevante até K
+    first_relevant = np.where(relevance.any(axis=1), relevance.argmax(axis=1) + 1, max_k + 1)
+    mrr = np.where(first_relevant[:, None] <= ks[None, :], 1.0 / first_relevant[:, None], 0.0)
+
+    # nDCG@K: ganho descontado normalizado pelo ideal (relevantes da própria lista no topo)
+    discounts = 1.0 / np.log2(ks + 1)
+    dcg = np.cumsum(relevance * discounts[None, :], axis=1)
+    ideal = -np.sort(-relevance, axis=1)
+    idcg = np.cumsum(ideal * discounts[None, :], axis=1)
+    ndcg = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+
+    return {
+        "feedback": feedback.mean(axis=0),
+        "precision": precision.mean(axis=0),
+        "likelihood": likelihood.mean(axis=0),
+        "mrr": mrr.mean(axis=0),
+        "ndcg": ndcg.mean(axis=0)
+    }
@@ -0,0 +1,198 @@
+import os
+import numpy as np
+from time import time
+
+# ÍNDICE APROXIMADO (IVF) SOBRE OS EMBEDDINGS
+# k-means esférico divide as linhas de embeddings_vector em n_lists listas invertidas;
+# a busca pontua só as linhas das n_probe listas mais próximas da query.
+# allowed_rows aplica o filtro de produto/componente/janela de tempo (ex: linhas de
+# CandidateIndex.candidate_rows); se as listas sondadas não tiverem K linhas permitidas,
+# mais listas são sondadas. As linhas sondadas são filtradas por busca binária nas linhas
+# permitidas ordenadas, sem máscara do tamanho do índice, então o custo por query depende
+# só das listas sondadas e do filtro. Com exact=True a busca é exata, para medir o recall@K.
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+# linhas de rows que estão em sorted_rows (ordenado, sem repetição)
+def rows_in(rows, sorted_rows):
+    positions = np.searchsorted(sorted_rows, rows)
+    positions[positions == len(sorted_rows)] = 0
+    return rows[sorted_rows[positions] == rows]
+
+def top_k(rows, scores, k):
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[best], scores[best]
+    order = np.argsort(-scores, kind='stable')
+    return rows[order], scores[order]
+
+ANN_ARRAYS = ['embeddings', 'ids', 'centroids', 'list_offsets', 'list_rows']
+
+class IVFIndex():
+    def __init__(self, n_lists=256, n_probe=8, brute_force_threshold=2048, seed=42):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        # abaixo dessa quantidade de linhas permitidas a busca exata é mais barata
+        self.brute_force_threshold = brute_force_threshold
+        self.seed = seed
+
+        self.embeddings   = None
+        self.ids          = None
+        self.centroids    = None
+        self.list_offsets = None
+        self.list_rows    = None
+
+    def __len__(self):
+        return 0 if self.embeddings is None else len(self.embeddings)
+
+    # ids (opcional) identifica cada linha, ex: bg_number, para conferir o alinhamento ao carregar
+    def build(self, embeddings, ids=None, n_iter=10, sample_size=100000, block_size=16384):
+        time_a = time()
+        self.embeddings = normalize_rows(embeddings)
+        self.ids = None if ids is None else np.asarray(ids)
+        n_rows = len(self.embeddings)
+        n_lists = max(1, min(self.n_lists, n_rows))
+        rng = np.random.default_rng(self.seed)
+
+        # k-means esférico sobre uma amostra
+        sample = self.embeddings
+        if n_rows > sample_size:
+            sample = self.embeddings[rng.choice(n_rows, sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_lists)
+            empty = counts == 0
+            # lista vazia recebe um ponto aleatório da amostra
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        self.centroids = centroids
+
+        # listas invertidas em formato CSR: list_rows[list_offsets[l]:list_offsets[l+1]]
+        assignments = np.empty(n_rows, dtype=np.int64)
+        for start in range(0, n_rows, block_size):
+            block = self.embeddings[start:start + block_size]
+            assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+        self.list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=self.list_offsets[1:])
+
+        print(f'ann index built: {n_rows} vectors, {n_lists} lists in {time() - time_a:.2f}s')
+        return self
+
+    def save(self, path):
+        np.savez(
+            path,
+            embeddings=self.embeddings,
+            ids=self.ids if self.ids is not None else np.empty(0, dtype=np.int64),
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+            params=np.array([self.n_lists, self.n_probe, self.brute_force_threshold, self.seed], dtype=np.int64)
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            n_lists, n_probe, brute_force_threshold, seed = saved["params"].tolist()
+            index = cls(n_lists=n_lists, n_probe=n_probe, brute_force_threshold=brute_force_threshold, seed=seed)
+            index.embeddings   = saved["embeddings"]
+            index.ids          = saved["ids"] if len(saved["ids"]) > 0 else None
+            index.centroids    = saved["centroids"]
+            index.list_offsets = saved["list_offsets"]
+            index.list_rows    = saved["list_rows"]
+        return index
+
+    # mesmos arrays em .npy soltos dentro de um diretório, para serem lidos com mmap
+    # (ex: pelos workers do cálculo de arcos, sem uma cópia por processo)
+    def save_arrays(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'ann_params.npy'), np.array([self.n_lists, self.n_probe, self.brute_force_threshold, self.seed], dtype=np.int64))
+        for name in ANN_ARRAYS:
+            value = getattr(self, name)
+            np.save(os.path.join(path, f'ann_{name}.npy'), value if value is not None else np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def load_arrays(cls, path, mmap_mode='r'):
+        n_lists, n_probe, brute_force_threshold, seed = np.load(os.path.join(path, 'ann_params.npy')).tolist()
+        index = cls(n_lists=n_lists, n_probe=n_probe, brute_force_threshold=brute_force_threshold, seed=seed)
+        for name in ANN_ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f'ann_{name}.npy'), mmap_mode=mmap_mode))
+        if len(index.ids) == 0:
+            index.ids = None
+        return index
+
+    def exact_search(self, query_vector, k, allowed_rows=None):
+        query_vector = normalize_rows(query_vector).ravel()
+        rows = np.arange(len(self.embeddings), dtype=np.int64) if allowed_rows is None else np.asarray(allowed_rows, dtype=np.int64)
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        return top_k(rows, self.embeddings[rows] @ query_vector, k)
+
+    # devolve (linhas, scores de cosseno) dos k vizinhos, em ordem decrescente de score
+    def search(self, query_vector, k, allowed_rows=None, exact=False, n_probe=None):
+        if exact or (allowed_rows is not None and len(allowed_rows) <= self.brute_force_threshold):
+            return self.exact_search(query_vector, k, allowed_rows)
+
+        query_vector = normalize_rows(query_vector).ravel()
+        n_probe = n_probe or self.n_probe
+
+        allowed = None
+        if allowed_rows is not None:
+            allowed = np.sort(np.asarray(allowed_rows, dtype=np.int64))
+
+        lists_order = np.argsort(-(self.centroids @ query_vector))
+        candidates = []
+        found = 0
+        for start in range(0, len(lists_order), n_probe):
+            for l in lists_order[start:start + n_probe]:
+                rows = self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]]
+                if allowed is not None:
+                    rows = rows_in(rows, allowed)
+                candidates.append(rows)
+                found += len(rows)
+            if found >= k:
+                break
+
+        rows = np.concatenate(candidates) if len(candidates) > 0 else np.empty(0, dtype=np.int64)
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        return top_k(rows, self.embeddings[rows] @ query_vector, k)
+
+# MEDIÇÃO DE RECALL@K E LATÊNCIA CONTRA A BUSCA EXATA
+
+def measure_recall_at_k(ann_index, query_vectors, k, allowed_rows_list=None, n_probe=None):
+    recalls, ann_times, exact_times = [], [], []
+    for i, query_vector in enumerate(query_vectors):
+        allowed_rows = None if allowed_rows_list is None else allowed_rows_list[i]
+
+        time_a = time()
+        exact_rows, _ = ann_index.search(query_vector, k, allowed_rows, exact=True)
+        exact_times.append(time() - time_a)
+
+        time_a = time()
+        ann_rows, _ = ann_index.search(query_vector, k, allowed_rows, n_probe=n_probe)
+        ann_times.append(time() - time_a)
+
+        if len(exact_rows) > 0:
+            recalls.append(len(np.intersect1d(exact_rows, ann_rows)) / len(exact_rows))
+
+    report = {
+        "k": k,
+        "queries": len(query_vectors),
+        "recall_at_k": float(np.mean(recalls)) if len(recalls) > 0 else 1.0,
+        "ann_p50_ms": float(np.percentile(ann_times, 50) * 1000),
+        "ann_p99_ms": float(np.percentile(ann_times, 99) * 1000),
+        "exact_p50_ms": float(np.percentile(exact_times, 50) * 1000),
+        "exact_p99_ms": float(np.percentile(exact_times, 99) * 1000)
+    }
+    print(f'recall@{k}={report["recall_at_k"]:.4f} ann p50={report["ann_p50_ms"]:.2f}ms p99={report["ann_p99_ms"]:.2f}ms | exact p50={report["exact_p50_ms"]:.2f}ms p99={report["exact_p99_ms"]:.2f}ms')
+    return report
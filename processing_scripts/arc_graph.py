@@ -0,0 +1,210 @@
+import numpy as np
+import pymongo
+
+# GRAFO TOP-N DE ARCOS
+# para cada bug "from" guarda só os top_n vizinhos de cada tipo de score, em uma
+# adjacência CSR por versão: indptr (n_from + 1), to (bg_number do vizinho) e o
+# score da versão em float32, além dos três scores base da aresta.
+# A recomendação de um bug da amostra vira um slice O(K) em vez de um novo cálculo.
+
+# pesos de (tfidf, word embeddings, categórico) de cada versão usada em simi_score_type
+SCORE_VERSIONS = {
+    "tfidf":              (1.0, 0.0, 0.0),
+    "word_embeddings":    (0.0, 1.0, 0.0),
+    "categoric":          (0.0, 0.0, 1.0),
+    "categoric_tfidf":    (1.0, 0.0, 1.0),
+    "categoric_we":       (0.0, 1.0, 1.0),
+    "categoric_tfidf_we": (1.0, 1.0, 1.0)
+}
+
+BASE_SCORES = ["tfidf", "word_embeddings", "categoric"]
+
+ARC_FIELDS = {
+    "_id": False,
+    "from": True,
+    "to": True,
+    "cos_similarity_tfidf": True,
+    "cos_similarity_word_embeddings": True,
+    "categoric_similarity": True
+}
+
+# ordem (score decrescente, estável) dos top_n candidatos de cada linha de uma matriz (versões, candidatos)
+def top_n_orders(scores, top_n):
+    if scores.shape[1] > top_n:
+        best = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    else:
+        best = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    return np.take_along_axis(best, np.argsort(-best_scores, axis=1, kind='stable'), axis=1)
+
+# FUSÃO DOS SCORES DE TODAS AS VERSÕES
+# os três scores base dos candidatos de uma query são empilhados uma vez em uma
+# matriz (3, n); os scores de todas as versões saem de um único produto
+# pesos (versões, 3) @ base e o top-N de cada versão de um argpartition por linha,
+# então pedir todas as versões custa quase o mesmo que pedir uma
+
+class ScoreFusion():
+    # versions: nome -> pesos de (tfidf, word embeddings, categórico), como SCORE_VERSIONS
+    def __init__(self, versions=SCORE_VERSIONS):
+        self.versions = versions
+        self.names    = list(versions)
+        self.weights  = np.asarray([ versions[name] for name in self.names ], dtype=np.float64).reshape(len(self.names), len(BASE_SCORES))
+        self.row_by_name = { name: row for row, name in enumerate(self.names) }
+
+    def check_versions(self, names=None):
+        names = self.names if names is None else list(names)
+        for name in names:
+            if name not in self.row_by_name:
+                raise ValueError(f'similarity_score_type must be one of {self.names}, got {name}')
+        return names
+
+    # matriz (len(names), n) com o score combinado de cada versão
+    def scores(self, tfidf_scores, we_scores, categoric_scores, names=None):
+        names = self.check_versions(names)
+        base = np.vstack([ tfidf_scores, we_scores, categoric_scores ])
+        weights = self.weights[[ self.row_by_name[name] for name in names ]]
+        return weights.astype(base.dtype, copy=False) @ base
+
+    # versão -> (ordem dos top_n candidatos, scores combinados de todos os candidatos)
+    def top_n(self, tfidf_scores, we_scores, categoric_scores, top_n, names=None):
+        names = self.check_versions(names)
+        scores = self.scores(tfidf_scores, we_scores, categoric_scores, names)
+        orders = top_n_orders(scores, top_n)
+        return { name: (orders[i], scores[i]) for i, name in enumerate(names) }
+
+class ArcGraphBuilder():
+    def __init__(self, top_n=100, versions=SCORE_VERSIONS):
+        self.top_n    = top_n
+        self.versions = versions
+        self.fusion   = ScoreFusion(versions)
+        self.from_bg_numbers = []
+        self.edges = { version: { "to": [], "counts": [], "tfidf": [], "word_embeddings": [], "categoric": [], "score": [] } for version in versions }
+
+    # recebe todos os arcos de um mesmo "from"
+    def add(self, from_bg_number, to_bg_numbers, tfidf_scores, we_scores, categoric_scores):
+        to_bg_numbers    = np.asarray(to_bg_numbers, dtype=np.int64)
+        tfidf_scores     = np.asarray(tfidf_scores, dtype=np.float32)
+        we_scores        = np.asarray(we_scores, dtype=np.float32)
+        categoric_scores = np.asarray(categoric_scores, dtype=np.float32)
+
+        self.from_bg_numbers.append(from_bg_number)
+        ranked = self.fusion.top_n(tfidf_scores, we_scores, categoric_scores, self.top_n)
+        for version, (order, scores) in ranked.items():
+            edges = self.edges[version]
+            edges["to"].append(to_bg_numbers[order])
+            edges["counts"].append(len(order))
+            edges["tfidf"].append(tfidf_scores[order])
+            edges["word_embeddings"].append(we_scores[order])
+            edges["categoric"].append(categoric_scores[order])
+            edges["score"].append(scores[order])
+
+    def add_arcs(self, from_bg_number, arcs):
+        self.add(
+            from_bg_number,
+            [ a["to"] for a in arcs ],
+            [ a["cos_similarity_tfidf"] for a in arcs ],
+            [ a["cos_similarity_word_embeddings"] for a in arcs ],
+            [ a["categoric_similarity"] for a in arcs ]
+        )
+
+    def build(self):
+        arrays = { "from": np.asarray(self.from_bg_numbers, dtype=np.int64) }
+        for version, edges in self.edges.items():
+            indptr = np.zeros(len(self.from_bg_numbers) + 1, dtype=np.int64)
+            np.cumsum(edges["counts"], out=indptr[1:])
+            arrays[f"{version}/indptr"] = indptr
+            for field in ["to", "tfidf", "word_embeddings", "categoric", "score"]:
+                dtype = np.int64 if field == "to" else np.float32
+                arrays[f"{version}/{field}"] = np.concatenate(edges[field]).astype(dtype) if len(edges[field]) > 0 else np.empty(0, dtype=dtype)
+        return ArcGraph(arrays)
+
+    # lê a collection arc agrupada por "from" (cursor ordenado pelo índice em "from")
+    @classmethod
+    def from_mongo(cls, db, top_n=100, versions=SCORE_VERSIONS):
+        db["arc"].create_index([("from", pymongo.ASCENDING)])
+
+        builder = cls(top_n=top_n, versions=versions)
+        current, arcs = None, []
+        for arc in db["arc"].find({}, ARC_FIELDS).sort("from", pymongo.ASCENDING):
+            if arc["from"] != current and len(arcs) > 0:
+                builder.add_arcs(current, arcs)
+                arcs = []
+            current = arc["from"]
+            arcs.append(arc)
+        if len(arcs) > 0:
+            builder.add_arcs(current, arcs)
+        return builder.build()
+
+class ArcGraph():
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.row_by_from = { bg_number: row for row, bg_number in enumerate(arrays["from"].tolist()) }
+
+    def __len__(self):
+        return len(self.row_by_from)
+
+    def __contains__(self, from_bg_number):
+        return from_bg_number in self.row_by_from
+
+    @property
+    def versions(self):
+        return sorted({ key.split('/')[0] for key in self.arrays if '/' in key })
+
+    def save(self, path):
+        np.savez(path, **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            return cls({ key: saved[key] for key in saved.files })
+
+    # devolve os K primeiros vizinhos de from_bg_number na versão, já ordenados pelo score
+    def neighbors(self, from_bg_number, version, K):
+        row = self.row_by_from.get(from_bg_number)
+        if row is None:
+            return { field: self.arrays[f"{version}/{field}"][:0] for field in ["to", "score", "tfidf", "word_embeddings", "categoric"] }
+        indptr = self.arrays[f"{version}/indptr"]
+        start = indptr[row]
+        end = min(indptr[row + 1], start + K)
+        return { field: self.arrays[f"{version}/{field}"][start:end] for field in ["to", "score", "tfidf", "word_embeddings", "categoric"] }
+
+    def all_to_bg_numbers(self):
+        return np.unique(np.concatenate([ self.arrays[f"{version}/to"] for version in self.versions ]))
+
+# RECOMENDAÇÃO POR CONSULTA AO GRAFO
+# mesma interface de get_recommendations do recomendador; os documentos dos vizinhos
+# são carregados uma vez na criação
+
+ITEM_FIELDS = {
+    "_id": False,
+    "bg_number": True,
+    "summary": True,
+    "product": True,
+    "component": True,
+    "assigned_to": True
+}
+
+class ArcGraphRecommender():
+    def __init__(self, arc_graph, db):
+        self.arc_graph = arc_graph
+        to_bg_numbers = arc_graph.all_to_bg_numbers().tolist()
+        self.items = {}
+        for start in range(0, len(to_bg_numbers), 10000):
+            for bug in db["bug"].find({ "bg_number": { "$in": to_bg_numbers[start:start + 10000] } }, ITEM_FIELDS):
+                self.items[bug["bg_number"]] = bug
+
+    def get_recommendations(self, query, K, similarity_score_type):
+        neighbors = self.arc_graph.neighbors(query["bg_number"], similarity_score_type, K)
+        return [
+            {
+                "item": self.items[to],
+                "score": score,
+                "cos_similarity_tfidf": tfidf,
+                "cos_similarity_word_embeddings": we
+            } for to, score, tfidf, we in zip(
+                neighbors["to"].tolist(),
+                neighbors["score"].tolist(),
+                neighbors["tfidf"].tolist(),
+                neighbors["word_embeddings"].tolist()
+            ) if to in self.items
+        ]
@@ -0,0 +1,57 @@
+import numpy as np
+from time import time
+from scipy.sparse import random as sparse_random
+
+from generate_sample_calculate_and_save_similarity_arcs import calculate_distance_arcs_between_reports, calculate_distance_arcs_between_reports_pairwise
+
+# MICROBENCHMARK: CAMINHO PAR-A-PAR x MOTOR VETORIZADO
+
+PRODUCTS   = ['Firefox', 'Core', 'Thunderbird', 'Toolkit']
+COMPONENTS = ['General', 'DOM', 'Networking', 'Layout', 'Graphics', 'JavaScript Engine']
+
+def generate_synthetic_bugs(qty, vocabulary_size=20000, density=0.002, embeddings_dim=384, seed=42):
+    rng = np.random.default_rng(seed)
+    bugs = []
+    for i in range(qty):
+        bugs.append({
+            "bg_number": i,
+            "product": PRODUCTS[rng.integers(len(PRODUCTS))],
+            "component": COMPONENTS[rng.integers(len(COMPONENTS))],
+            "tfidf_vector": sparse_random(1, vocabulary_size, density=density, format='csr', random_state=int(rng.integers(1 << 31))),
+            "embeddings_vector": rng.standard_normal(embeddings_dim).astype(np.float32)
+        })
+    return bugs
+
+def check_same_arcs(arcs_a, arcs_b, tolerance=1e-5):
+    if len(arcs_a) != len(arcs_b):
+        return False
+    for a, b in zip(arcs_a, arcs_b):
+        if a["from"] != b["from"] or a["to"] != b["to"] or a["categoric_similarity"] != b["categoric_similarity"]:
+            return False
+        if abs(a["cos_similarity_tfidf"] - b["cos_similarity_tfidf"]) > tolerance:
+            return False
+        if abs(a["cos_similarity_word_embeddings"] - b["cos_similarity_word_embeddings"]) > tolerance:
+            return False
+    return True
+
+def run_benchmark(n_queries=5, n_candidates=2000):
+    print(f'generating {n_queries} queries and {n_candidates} candidates...')
+    queries    = generate_synthetic_bugs(n_queries, seed=1)
+    candidates = generate_synthetic_bugs(n_candidates, seed=2)
+
+    time_a = time()
+    pairwise_arcs = [calculate_distance_arcs_between_reports_pairwise(q, candidates) for q in queries]
+    pairwise_time = time() - time_a
+
+    time_a = time()
+    vectorized_arcs = [calculate_distance_arcs_between_reports(q, candidates) for q in queries]
+    vectorized_time = time() - time_a
+
+    same = all(check_same_arcs(a, b) for a, b in zip(pairwise_arcs, vectorized_arcs))
+
+    print(f'pairwise:   {pairwise_time*1000:.1f}ms ({pairwise_time*1000/n_queries:.1f}ms/query)')
+    print(f'vectorized: {vectorized_time*1000:.1f}ms ({vectorized_time*1000/n_queries:.1f}ms/query)')
+    print(f'speedup: {pairwise_time/vectorized_time:.1f}x - same arcs: {same}')
+
+if __name__ == '__main__':
+    run_benchmark()
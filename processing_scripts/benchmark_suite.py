@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import zlib
+import platform
+import datetime
+import contextlib
+import numpy as np
+import mongomock
+from time import time
+
+from preprocessing import pre_process_corpus, download_nltk_data
+from generate_vectorizations_and_update_db import TfidfVectorizer, BertVectorizer, BERT_BATCH_SIZE, convert_to_mongo_acceptable
+from generate_sample_calculate_and_save_similarity_arcs import retrieve_candidates_query, calculate_distance_arcs_between_reports
+from candidate_index import CandidateIndex
+from vector_store import load_bug_vectors
+from arc_graph import ArcGraphBuilder, ArcGraphRecommender
+from recommendation_service import OnlineRecommender, load_items
+from bug_collection import ensure_bug_indexes
+from instrumentation import summary as instrumentation_summary
+
+# metrics.py fica na raiz do repositório, junto do evaluate.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import AssigneeEncoder, build_relevance_matrix, calculate_metrics_all_k
+
+# SUÍTE DE BENCHMARK
+# gera um corpus sintético parecido com o do Bugzilla (produtos, componentes,
+# assignees, descrições e datas de criação/resolução), carrega em um mongomock e
+# cronometra cada estágio do pipeline: pré-processamento, tfidf, bert, carga no
+# mongo, busca de candidatos, similaridade dos arcos e o loop de avaliação.
+# O resultado sai em JSON para comparar execuções antes/depois de uma mudança.
+
+PRODUCTS   = ['Firefox', 'Core', 'Thunderbird', 'Toolkit', 'SeaMonkey', 'Calendar']
+COMPONENTS = ['General', 'DOM', 'Networking', 'Layout', 'Graphics', 'JavaScript Engine', 'Preferences', 'Widget', 'Security', 'Build Config']
+FILLER_WORDS = ['the', 'a', 'is', 'when', 'after', 'in', 'on', 'with', 'not', 'and', '.', ',', '(', ')', ':']
+
+BENCHMARK_OUTPUT_PATH = 'benchmark_results.json'
+
+def generate_synthetic_corpus(qty, vocabulary_size=5000, description_words=(20, 200), n_assignees=200, seed=42,
+                              start=datetime.datetime(2009, 1, 1), days=4 * 365, unresolved_ratio=0.05):
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([ f'term{i}' for i in range(vocabulary_size) ] + FILLER_WORDS)
+    # frequência dos termos decai como em um texto real (zipf), palavras vazias são as mais comuns
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights = np.roll(weights, len(FILLER_WORDS))
+    weights /= weights.sum()
+
+    bugs = []
+    for i in range(qty):
+        n_words = int(rng.integers(description_words[0], description_words[1] + 1))
+        creation_time = start + datetime.timedelta(seconds=int(rng.integers(days * 86400)))
+        resolved = rng.random() >= unresolved_ratio
+        bugs.append({
+            "bg_number": i,
+            "product": PRODUCTS[rng.integers(len(PRODUCTS))],
+            "component": COMPONENTS[rng.integers(len(COMPONENTS))],
+            "assigned_to": f'dev{int(rng.zipf(1.5)) % n_assignees}@example.com',
+            "summary": " ".join(rng.choice(vocabulary, size=8, p=weights)),
+            "description": " ".join(rng.choice(vocabulary, size=n_words, p=weights)),
+            "creation_time": creation_time,
+            # bugs nunca resolvidos ficam com '' como no dataset original
+            "when_changed_to_resolved": creation_time + datetime.timedelta(days=int(rng.integers(1, 365))) if resolved else ''
+        })
+    return bugs
+
+# modelo falso com a mesma interface de BertVectorizer: soma vetores aleatórios fixos
+# dos tokens, para medir o pipeline sem baixar/rodar o sentence transformer
+class StubBertVectorizer():
+    def __init__(self, dimension=384, table_size=1 << 14, batch_size=BERT_BATCH_SIZE, seed=42):
+        self.table = np.random.default_rng(seed).standard_normal((table_size, dimension)).astype(np.float32)
+        self.batch_size = batch_size
+
+    def encode(self, doc):
+        rows = [ zlib.crc32(token.encode('utf-8')) % len(self.table) for token in (doc or '').split() ]
+        return self.table[rows].sum(axis=0) if len(rows) > 0 else np.zeros(self.table.shape[1], dtype=np.float32)
+
+    def transform(self, docs, batched=False, batch_size=None):
+        if batched:
+            return self.transform_batched(docs, batch_size=batch_size)
+        return [ self.encode(doc) for doc in docs ]
+
+    def transform_batched(self, docs, batch_size=None):
+        return np.vstack([ self.encode(doc) for doc in docs ]) if len(docs) > 0 else np.empty((0, self.table.shape[1]), dtype=np.float32)
+
+class BenchmarkResults():
+    def __init__(self, config):
+        self.config = config
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, items):
+        print(f'{name}...')
+        time_a = time()
+        yield
+        seconds = time() - time_a
+        self.stages[name] = {
+            "seconds": seconds,
+            "items": items,
+            "items_per_second": items / seconds if seconds > 0 else None
+        }
+        print(f'{name}: {seconds:.3f}s ({items} items)')
+
+    def to_dict(self):
+        return {
+            "config": self.config,
+            "environment": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count()
+            },
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "stages": self.stages,
+            # contadores do pipeline (docs pré-processados, bytes serializados, queries ao mongo...)
+            "counters": instrumentation_summary()["counters"]
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+# queries da amostra saem da metade mais recente do corpus, onde há candidatos
+def select_queries(bugs, n_queries, seed=42):
+    recent = sorted(bugs, key=lambda b: b["creation_time"])[len(bugs) // 2:]
+    rng = np.random.default_rng(seed)
+    return [ recent[i] for i in rng.choice(len(recent), size=min(n_queries, len(recent)), replace=False) ]
+
+# bert_batch_sizes (opcional): repete o encode do bert com cada batch_size, um estágio bert_encode_batch_<n> por tamanho
+def run_benchmark_suite(n_bugs=5000, n_queries=100, max_k=20, bert='stub', workers=1, seed=42,
+                        versions=('categoric_tfidf_we', 'categoric_tfidf', 'categoric_we'), bert_batch_sizes=None, output_path=BENCHMARK_OUTPUT_PATH):
+    results = BenchmarkResults({
+        "n_bugs": n_bugs,
+        "n_queries": n_queries,
+        "max_k": max_k,
+        "bert": bert,
+        "workers": workers,
+        "seed": seed,
+        "versions": list(versions),
+        "bert_batch_sizes": list(bert_batch_sizes) if bert_batch_sizes is not None else None
+    })
+
+    download_nltk_data()
+
+    with results.stage('generate_corpus', n_bugs):
+        bugs = generate_synthetic_corpus(n_bugs, seed=seed)
+
+    with results.stage('pre_process', n_bugs):
+        preprocessed = pre_process_corpus(bugs, cache_path=None, workers=workers)
+    texts = [ preprocessed[b["bg_number"]] for b in bugs ]
+
+    with results.stage('tfidf_fit', n_bugs):
+        tfidf_vectorizer = TfidfVectorizer(texts)
+
+    with results.stage('tfidf_transform', n_bugs):
+        tfidf_matrix = tfidf_vectorizer.transform_batch(texts)
+
+    bert_vectorizer = StubBertVectorizer() if bert == 'stub' else BertVectorizer()
+    with results.stage('bert_encode', n_bugs):
+        embeddings_matrix = bert_vectorizer.transform([ b["description"] for b in bugs ], batched=True)
+
+    for batch_size in bert_batch_sizes or []:
+        with results.stage(f'bert_encode_batch_{batch_size}', n_bugs):
+            bert_vectorizer.transform([ b["description"] for b in bugs ], batched=True, batch_size=batch_size)
+
+    db = mongomock.MongoClient()["benchmark"]
+    with results.stage('mongo_load', n_bugs):
+        ensure_bug_indexes(db)
+        db["bug"].insert_many([{
+            **b,
+            "tfidf_vector": convert_to_mongo_acceptable(tfidf_matrix[i], "tfidf"),
+            "embeddings_vector": convert_to_mongo_acceptable(embeddings_matrix[i], "bert")
+        } for i, b in enumerate(bugs) ])
+
+    queries = [ load_bug_vectors(b) for b in db["bug"].find({ "bg_number": { "$in": [ q["bg_number"] for q in select_queries(bugs, n_queries, seed) ] } }) ]
+
+    with results.stage('candidate_retrieval_mongo', len(queries)):
+        candidates = [ retrieve_candidates_query(db, q) for q in queries ]
+    results.stages['candidate_retrieval_mongo']["candidates"] = sum(len(c) for c in candidates)
+
+    with results.stage('arc_similarity', len(queries)):
+        all_arcs = [ calculate_distance_arcs_between_reports(q, c) for q, c in zip(queries, candidates) ]
+    results.stages['arc_similarity']["arcs"] = sum(len(a) for a in all_arcs)
+
+    with results.stage('candidate_index_build', n_bugs):
+        candidate_index = CandidateIndex.load_from_mongo(db)
+
+    with results.stage('candidate_retrieval_index', len(queries)):
+        for q in queries:
+            candidate_index.candidate_rows(q)
+
+    with results.stage('arc_similarity_index', len(queries)):
+        index_arcs = [ candidate_index.arcs(q) for q in queries ]
+    results.stages['arc_similarity_index']["arcs"] = sum(len(a) for a in index_arcs)
+
+    # recomendações pelo índice: uma chamada por versão contra todas as versões fundidas em uma
+    index_recommender = OnlineRecommender(candidate_index, load_items(db), tfidf_vectorizer=None, bert_vectorizer=None)
+    with results.stage('index_recommendations_per_version', len(queries) * len(versions)):
+        for version in versions:
+            for q in queries:
+                index_recommender.get_recommendations(q, max_k, version)
+
+    with results.stage('index_recommendations_fused', len(queries) * len(versions)):
+        for q in queries:
+            index_recommender.get_recommendations_all_versions(q, max_k, list(versions))
+
+    with results.stage('arc_graph_build', len(queries)):
+        builder = ArcGraphBuilder(top_n=max_k)
+        for q, arcs in zip(queries, all_arcs):
+            builder.add_arcs(q["bg_number"], arcs)
+        recommender = ArcGraphRecommender(builder.build(), db)
+
+    # mesmo cálculo de execute_evaluation_all_k, com o recomendador do grafo
+    evaluation = {}
+    with results.stage('evaluation_loop', len(queries) * len(versions)):
+        assignees = AssigneeEncoder()
+        queries_ids = assignees.encode_many([ q["assigned_to"] for q in queries ])
+        for version in versions:
+            recommendations_ids = [
+                assignees.encode_many([ rec["item"]["assigned_to"] for rec in recommender.get_recommendations(q, max_k, version) ])
+                for q in queries
+            ]
+            relevance, lengths = build_relevance_matrix(queries_ids, recommendations_ids, max_k)
+            evaluation[version] = { metric: float(values[-1]) for metric, values in calculate_metrics_all_k(relevance, lengths).items() }
+    results.stages['evaluation_loop'][f"metrics@{max_k}"] = evaluation
+
+    if output_path is not None:
+        results.save(output_path)
+        print(f'benchmark results saved on {output_path}')
+    return results.to_dict()
+
+def main():
+    N_BUGS = 5000
+    N_QUERIES = 100
+    MAX_K = 20
+    BERT = 'stub' # 'stub' ou 'real' (sentence transformer de generate_vectorizations_and_update_db)
+    WORKERS = 1
+    BERT_BATCH_SIZES = None # ex: (16, 32, 64, 128) com BERT = 'real' para escolher o BERT_BATCH_SIZE
+
+    run_benchmark_suite(n_bugs=N_BUGS, n_queries=N_QUERIES, max_k=MAX_K, bert=BERT, workers=WORKERS, bert_batch_sizes=BERT_BATCH_SIZES, output_path=BENCHMARK_OUTPUT_PATH)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import pymongo
+import datetime
+from pymongo import UpdateOne
+
+from vector_store import VECTOR_STORE_REF_FIELD, VECTORS_UPDATED_AT_FIELD
+
+# ÍNDICES DA COLLECTION BUG
+# cobrem as consultas dos scripts: update/lookup por bg_number, candidatos de uma
+# query (creation_time < q e product/component iguais), when_changed_to_resolved,
+# amostragem por creation_time só entre bugs já vetorizados (índices parciais pela
+# presença dos vetores) e a busca incremental por vectors_updated_at.
+
+PICKLED_VECTORS_FILTER = {
+    "tfidf_vector":      { "$exists": True },
+    "embeddings_vector": { "$exists": True }
+}
+
+BUG_INDEXES = [
+    ([("bg_number", pymongo.ASCENDING)], { "name": "bg_number_unique", "unique": True }),
+    ([("product", pymongo.ASCENDING), ("creation_time", pymongo.ASCENDING)], { "name": "product_creation_time" }),
+    ([("component", pymongo.ASCENDING), ("creation_time", pymongo.ASCENDING)], { "name": "component_creation_time" }),
+    ([("when_changed_to_resolved", pymongo.ASCENDING)], { "name": "when_changed_to_resolved" }),
+    ([("creation_time", pymongo.ASCENDING)], { "name": "creation_time_with_vectors", "partialFilterExpression": PICKLED_VECTORS_FILTER }),
+    ([("creation_time", pymongo.ASCENDING)], { "name": "creation_time_with_vector_store_row", "partialFilterExpression": { VECTOR_STORE_REF_FIELD: { "$exists": True } } }),
+    ([(VECTORS_UPDATED_AT_FIELD, pymongo.ASCENDING)], { "name": "vectors_updated_at", "sparse": True })
+]
+
+def ensure_bug_indexes(db):
+    for keys, options in BUG_INDEXES:
+        db["bug"].create_index(keys, **options)
+    return [ options["name"] for _, options in BUG_INDEXES ]
+
+# DATAS
+# no json do Bugzilla as datas são strings ISO ('2010-01-01T10:00:00Z'); no mongo elas
+# ficam como datetime (UTC, sem tzinfo) para casar com os filtros $lt/$gt de datas dos
+# outros scripts. Bug nunca resolvido continua com '' em when_changed_to_resolved.
+
+BUG_DATE_FIELDS = ["creation_time", "when_changed_to_resolved", "when_final_change_assigned_to"]
+
+def parse_bug_date(value):
+    if not isinstance(value, str) or value == '':
+        return value
+    date = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return date
+
+def parse_bug_dates(bug):
+    for field in BUG_DATE_FIELDS:
+        if field in bug:
+            bug[field] = parse_bug_date(bug[field])
+    return bug
+
+# upsert por bg_number: recarregar o mesmo arquivo não duplica documentos nem apaga vetores já gravados
+def upsert_bug_operation(bug):
+    return UpdateOne({ "bg_number": bug["bg_number"] }, { "$set": parse_bug_dates(bug) }, upsert=True)
+
+def upsert_bugs(bugs_writer, bugs):
+    total = 0
+    for bug in bugs:
+        bugs_writer.add(upsert_bug_operation(bug))
+        total += 1
+    return total
+
+# PLANOS DE EXECUÇÃO
+# resume o winningPlan do explain() em uma cadeia de estágios, ex: FETCH <- IXSCAN(product_creation_time)
+
+def plan_stages(plan):
+    stages = []
+    while plan is not None:
+        stage = plan.get("stage", "?")
+        if "indexName" in plan:
+            stage = f'{stage}({plan["indexName"]})'
+        elif "inputStages" in plan:
+            stage = f'{stage}[{", ".join(" <- ".join(plan_stages(p)) for p in plan["inputStages"])}]'
+        stages.append(stage)
+        plan = plan.get("inputStage")
+    return stages
+
+def winning_plan(explain):
+    planner = explain.get("queryPlanner", {})
+    plan = planner.get("winningPlan", {})
+    # servidores com o slot-based engine aninham o plano em queryPlan
+    return plan.get("queryPlan", plan)
+
+def uses_collection_scan(stages):
+    return any("COLLSCAN" in stage for stage in stages)
+
+# consultas representativas de cada script, montadas a partir de um bug de exemplo;
+# a amostra usa uma janela de sample_window_days terminando no creation_time do exemplo
+def representative_queries(example_bug, sample_window_days=365):
+    sample_window = {
+        "$gt": example_bug["creation_time"] - datetime.timedelta(days=sample_window_days),
+        "$lt": example_bug["creation_time"]
+    }
+    return {
+        "update by bg_number": { "bg_number": example_bug["bg_number"] },
+        "candidates of a query": {
+            **PICKLED_VECTORS_FILTER,
+            "creation_time": { "$lt": example_bug["creation_time"] },
+            "when_changed_to_resolved": { "$gt": example_bug["creation_time"] },
+            "$or": [{ "component": example_bug["component"] }, { "product": example_bug["product"] }]
+        },
+        "sample by creation_time": {
+            **PICKLED_VECTORS_FILTER,
+            "creation_time": sample_window,
+            "sample_set": { "$exists": False }
+        },
+        "sample by creation_time (vector store)": {
+            VECTOR_STORE_REF_FIELD: { "$exists": True },
+            "creation_time": sample_window,
+            "sample_set": { "$exists": False }
+        },
+        "candidates of a query (vector store)": {
+            VECTOR_STORE_REF_FIELD: { "$exists": True },
+            "creation_time": { "$lt": example_bug["creation_time"] },
+            "when_changed_to_resolved": { "$gt": example_bug["creation_time"] },
+            "$or": [{ "component": example_bug["component"] }, { "product": example_bug["product"] }]
+        },
+        "resolved after": { "when_changed_to_resolved": { "$gt": example_bug["creation_time"] } },
+        "changed vectors since": { VECTORS_UPDATED_AT_FIELD: { "$gt": datetime.datetime(1970, 1, 1) } }
+    }
+
+def print_query_plans(db, example_bug=None):
+    if example_bug is None:
+        example_bug = db["bug"].find_one({ "creation_time": { "$type": "date" } }, { "bg_number": True, "creation_time": True, "product": True, "component": True })
+    if example_bug is None:
+        print('collection bug sem bugs com creation_time, nada para explicar')
+        return {}
+
+    plans = {}
+    for name, query in representative_queries(example_bug).items():
+        stages = plan_stages(winning_plan(db["bug"].find(query).explain()))
+        plans[name] = stages
+        flag = 'COLLSCAN!' if uses_collection_scan(stages) else 'ok'
+        print(f'[{flag}] {name}: {" <- ".join(stages)}')
+    return plans
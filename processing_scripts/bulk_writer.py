@@ -0,0 +1,124 @@
+import queue
+import threading
+from time import sleep
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# ESCRITA EM LOTE NO MONGO
+# acumula UpdateOne/InsertOne e envia bulk_write(ordered=False) a cada batch_size
+# operações. No modo assíncrono os lotes são enviados por uma thread em background
+# enquanto o processamento continua; a fila é limitada para não acumular memória.
+# Expõe update_one/insert_one/insert_many com a mesma assinatura da collection,
+# então pode ser passado no lugar dela para as funções save_* existentes.
+
+DUPLICATE_KEY_ERROR = 11000
+
+class BulkWriter():
+    def __init__(self, collection, batch_size=1000, max_retries=3, retry_delay=1.0, asynchronous=True, max_pending_batches=4):
+        self.collection  = collection
+        self.batch_size  = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.operations = []
+        self.written    = 0
+        # bulk_write enviados ao servidor, incluindo as novas tentativas
+        self.round_trips = 0
+        self.error      = None
+
+        self.queue  = None
+        self.thread = None
+        if asynchronous:
+            self.queue  = queue.Queue(maxsize=max_pending_batches)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # mesma interface da collection
+
+    def update_one(self, filter, update, upsert=False):
+        self.add(UpdateOne(filter, update, upsert=upsert))
+
+    def insert_one(self, document):
+        self.add(InsertOne(document))
+
+    def insert_many(self, documents):
+        for document in documents:
+            self.add(InsertOne(document))
+
+    def add(self, operation):
+        self.operations.append(operation)
+        if len(self.operations) >= self.batch_size:
+            self.submit()
+
+    def submit(self):
+        self.raise_error()
+        if len(self.operations) == 0:
+            return
+        batch, self.operations = self.operations, []
+        if self.queue is None:
+            self.write_batch(batch)
+        else:
+            self.queue.put(batch)
+
+    # envia o que estiver pendente e espera todos os lotes serem escritos
+    def flush(self):
+        self.submit()
+        if self.queue is not None:
+            self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.thread is not None and self.thread.is_alive():
+                self.queue.put(None)
+                self.thread.join()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                # depois de um erro descarta os lotes seguintes até o erro ser levantado
+                if self.error is None:
+                    self.write_batch(batch)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.round_trips += 1
+                self.collection.bulk_write(batch, ordered=False)
+                self.written += len(batch)
+                return
+            except BulkWriteError as e:
+                # com ordered=False só as operações com erro falharam; reenvia apenas essas.
+                # chave duplicada significa que a operação já tinha sido escrita
+                failed = [ err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY_ERROR ]
+                self.written += len(batch) - len(failed)
+                if len(failed) == 0:
+                    return
+                if attempt == self.max_retries:
+                    raise
+                batch = [ batch[i] for i in failed ]
+            except PyMongoError:
+                if attempt == self.max_retries:
+                    raise
+            print(f'bulk write failed, retrying {len(batch)} operations ({attempt+1}/{self.max_retries})...')
+            sleep(self.retry_delay * (attempt + 1))
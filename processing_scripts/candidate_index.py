@@ -0,0 +1,254 @@
+import os
+import json
+import datetime
+import numpy as np
+
+from similarity_engine import SimilarityEngine, stack_tfidf_vectors, stack_embeddings_vectors
+from vector_store import VectorStore, vectors_filter, vectors_projection, load_bug_vectors
+from ann_index import IVFIndex
+
+# ÍNDICE DE CANDIDATOS EM MEMÓRIA
+# carrega o corpus elegível uma única vez, ordenado por creation_time, e responde
+# o mesmo filtro de retrieve_candidates_query sem ir ao mongo:
+#   creation_time < query.creation_time
+#   when_changed_to_resolved > query.creation_time
+#   component == query.component OR product == query.product
+# as linhas devolvidas indexam as matrizes compartilhadas do SimilarityEngine
+
+NAT = np.datetime64('NaT', 'us')
+
+CANDIDATE_FIELDS = {
+    "bg_number": True,
+    "product": True,
+    "component": True,
+    "creation_time": True,
+    "when_changed_to_resolved": True
+}
+
+CREATION_TIMES_FILE = 'creation_times.npy'
+RESOLVED_TIMES_FILE = 'resolved_times.npy'
+STORE_ROWS_FILE     = 'store_rows.npy'
+INDEX_META_FILE     = 'candidate_index_meta.json'
+
+def to_datetime64(value):
+    # no mongo, datas salvas como '' (bug nunca resolvido) não casam com $gt/$lt de datas
+    if isinstance(value, datetime.datetime):
+        return np.datetime64(value.replace(tzinfo=None), 'us')
+    return NAT
+
+def build_posting_lists(values):
+    posting_lists = {}
+    for row, value in enumerate(values):
+        posting_lists.setdefault(value, []).append(row)
+    return { value: np.asarray(rows, dtype=np.int64) for value, rows in posting_lists.items() }
+
+# embeddings em precisão total de linhas do índice lidos do VectorStore (mmap), para o re-ranking
+class StoreEmbeddingsRows():
+    def __init__(self, vector_store, store_rows):
+        self.vector_store = vector_store
+        self.store_rows   = store_rows
+
+    def __getitem__(self, rows):
+        return self.vector_store.embeddings_rows(self.store_rows[rows])
+
+class CandidateIndex():
+    # tfidf_matrix/embeddings_matrix (opcionais) vêm alinhados com bugs, ex: linhas de um VectorStore;
+    # sem eles os vetores são empilhados a partir de cada bug.
+    # embeddings_precision/tfidf_dtype/rerank_k vão para o SimilarityEngine; com vector_store e store_rows
+    # (linha de cada bug no store) o re-ranking lê do store e só a forma compacta fica em memória
+    def __init__(self, bugs, tfidf_matrix=None, embeddings_matrix=None, embeddings_precision='float32', tfidf_dtype=np.float64,
+                 rerank_k=None, vector_store=None, store_rows=None):
+        order = [ i for i, b in enumerate(bugs) if isinstance(b["creation_time"], datetime.datetime) ]
+        order = sorted(order, key=lambda i: to_datetime64(bugs[i]["creation_time"]))
+        bugs  = [ bugs[i] for i in order ]
+
+        # intervalo [creation_time, when_changed_to_resolved) de cada bug, na ordem das linhas
+        self.creation_times = np.array([ to_datetime64(b["creation_time"]) for b in bugs ], dtype='datetime64[us]')
+        self.resolved_times = np.array([ to_datetime64(b["when_changed_to_resolved"]) for b in bugs ], dtype='datetime64[us]')
+
+        products   = [ b["product"] for b in bugs ]
+        components = [ b["component"] for b in bugs ]
+        self.product_postings   = build_posting_lists(products)
+        self.component_postings = build_posting_lists(components)
+
+        if tfidf_matrix is None:
+            tfidf_matrix      = stack_tfidf_vectors([ b["tfidf_vector"] for b in bugs ])
+            embeddings_matrix = stack_embeddings_vectors([ b["embeddings_vector"] for b in bugs ])
+        else:
+            tfidf_matrix      = tfidf_matrix[order]
+            embeddings_matrix = embeddings_matrix[order]
+
+        full_embeddings = None
+        if vector_store is not None and store_rows is not None:
+            full_embeddings = StoreEmbeddingsRows(vector_store, np.asarray(store_rows, dtype=np.int64)[order])
+
+        # com ann_index e top_k, arcs() e o serviço (shortlist_rows) usam só os top_k vizinhos por embeddings
+        self.ann_index = None
+        self.top_k     = None
+        self.ann_exact = False
+
+        # bg_number -> linha, montado na primeira chamada de bug()
+        self.row_by_bg_number = None
+
+        self.engine = SimilarityEngine(
+            tfidf_matrix=tfidf_matrix,
+            embeddings_matrix=embeddings_matrix,
+            products=products,
+            components=components,
+            bg_numbers=[ b["bg_number"] for b in bugs ],
+            embeddings_precision=embeddings_precision,
+            tfidf_dtype=tfidf_dtype,
+            rerank_k=rerank_k,
+            full_embeddings=full_embeddings
+        )
+
+    # match (opcional) restringe os bugs carregados, ex: só os produtos/janela de tempo de algumas queries
+    @classmethod
+    def load_from_mongo(cls, db, vector_store=None, embeddings_precision='float32', tfidf_dtype=np.float64, rerank_k=None, match=None):
+        options = { "embeddings_precision": embeddings_precision, "tfidf_dtype": tfidf_dtype, "rerank_k": rerank_k }
+        db_bugs = db["bug"]
+
+        db_bugs_query = db_bugs.find({ **vectors_filter(vector_store), **(match or {}) }, { **CANDIDATE_FIELDS, **vectors_projection(vector_store) })
+
+        if vector_store is not None:
+            # só metadados vêm do mongo, os vetores saem direto das matrizes do store
+            bugs = [ b for b in db_bugs_query if b["bg_number"] in vector_store ]
+            rows = vector_store.rows_of([ b["bg_number"] for b in bugs ])
+            return cls(bugs, vector_store.tfidf_rows(rows), vector_store.embeddings_rows(rows), vector_store=vector_store, store_rows=rows, **options)
+
+        return cls([ load_bug_vectors(b) for b in db_bugs_query ], **options)
+
+    # SALVAR E REABRIR COM MMAP
+    # para os workers do cálculo paralelo de arcos: cada um reabre o diretório com mmap
+    # em vez de receber o índice montado em pickle (uma cópia inteira por processo).
+    # O re-ranking pelo VectorStore guarda só o caminho do store e a linha de cada bug nele
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, CREATION_TIMES_FILE), self.creation_times)
+        np.save(os.path.join(path, RESOLVED_TIMES_FILE), self.resolved_times)
+        self.engine.save(path)
+
+        full_embeddings = self.engine.full_embeddings
+        vector_store_path = None
+        if isinstance(full_embeddings, StoreEmbeddingsRows):
+            vector_store_path = full_embeddings.vector_store.path
+            np.save(os.path.join(path, STORE_ROWS_FILE), full_embeddings.store_rows)
+        if self.ann_index is not None:
+            self.ann_index.save_arrays(path)
+
+        with open(os.path.join(path, INDEX_META_FILE), 'w') as f:
+            json.dump({
+                "vector_store_path": vector_store_path,
+                "ann_index": self.ann_index is not None,
+                "top_k": self.top_k,
+                "ann_exact": self.ann_exact
+            }, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, INDEX_META_FILE)) as f:
+            meta = json.load(f)
+
+        full_embeddings = None
+        if meta["vector_store_path"] is not None:
+            store_rows = np.load(os.path.join(path, STORE_ROWS_FILE), mmap_mode=mmap_mode)
+            full_embeddings = StoreEmbeddingsRows(VectorStore(meta["vector_store_path"], mmap=mmap), store_rows)
+
+        index = cls.__new__(cls)
+        index.creation_times = np.load(os.path.join(path, CREATION_TIMES_FILE), mmap_mode=mmap_mode)
+        index.resolved_times = np.load(os.path.join(path, RESOLVED_TIMES_FILE), mmap_mode=mmap_mode)
+        index.engine = SimilarityEngine.load(path, mmap=mmap, full_embeddings=full_embeddings)
+        index.product_postings   = build_posting_lists(index.engine.products.tolist())
+        index.component_postings = build_posting_lists(index.engine.components.tolist())
+
+        index.ann_index = IVFIndex.load_arrays(path, mmap_mode=mmap_mode) if meta["ann_index"] else None
+        index.top_k     = meta["top_k"]
+        index.ann_exact = meta["ann_exact"]
+        index.row_by_bg_number = None
+        return index
+
+    def __len__(self):
+        return len(self.creation_times)
+
+    @property
+    def bg_numbers(self):
+        return self.engine.bg_numbers
+
+    # reconstrói a query de um bug do índice, com os vetores (já normalizados) das matrizes;
+    # com re-ranking o embedding vem em precisão total
+    def bug(self, bg_number):
+        if self.row_by_bg_number is None:
+            self.row_by_bg_number = { b: row for row, b in enumerate(self.bg_numbers.tolist()) }
+        row = self.row_by_bg_number[bg_number]
+        if self.engine.full_embeddings is not None:
+            embeddings_vector = np.asarray(self.engine.full_embeddings[[row]], dtype=np.float32)[0]
+        else:
+            embeddings_vector = self.engine.embeddings_rows([row])[0]
+        return {
+            "bg_number": bg_number,
+            "product": self.engine.products[row],
+            "component": self.engine.components[row],
+            "creation_time": self.creation_times[row].astype(datetime.datetime),
+            "tfidf_vector": self.engine.tfidf_matrix[row:row + 1],
+            "embeddings_vector": embeddings_vector
+        }
+
+    def candidate_rows(self, query):
+        query_time = to_datetime64(query["creation_time"])
+        if np.isnat(query_time):
+            return np.empty(0, dtype=np.int64)
+
+        # linhas [0, created_before) foram criadas antes da query
+        created_before = np.searchsorted(self.creation_times, query_time, side='left')
+
+        empty = np.empty(0, dtype=np.int64)
+        product_rows   = self.product_postings.get(query["product"], empty)
+        component_rows = self.component_postings.get(query["component"], empty)
+        product_rows   = product_rows[:np.searchsorted(product_rows, created_before)]
+        component_rows = component_rows[:np.searchsorted(component_rows, created_before)]
+
+        rows = np.union1d(product_rows, component_rows)
+
+        # ainda aberto no momento da criação da query
+        return rows[self.resolved_times[rows] > query_time]
+
+    # bug novo, ainda sem creation_time (serviço online): o filtro de "volta no tempo" acima
+    # não se aplica; candidatos são todos os bugs do índice do mesmo produto ou componente,
+    # já resolvidos ou ainda abertos
+    def live_candidate_rows(self, query):
+        empty = np.empty(0, dtype=np.int64)
+        return np.union1d(self.product_postings.get(query.get("product"), empty), self.component_postings.get(query.get("component"), empty))
+
+    # ÍNDICE APROXIMADO SOBRE AS MESMAS LINHAS
+
+    def build_ann_index(self, n_lists=256, n_probe=8):
+        return IVFIndex(n_lists=n_lists, n_probe=n_probe).build(self.engine.embeddings_rows(), ids=self.bg_numbers)
+
+    def load_ann_index(self, path):
+        ann_index = IVFIndex.load(path)
+        if ann_index.ids is None or not np.array_equal(ann_index.ids, self.bg_numbers):
+            raise ValueError(f'ann index at {path} is not aligned with the candidate index rows, rebuild it')
+        return ann_index
+
+    # exact=True mantém o mesmo top_k mas com busca exata, para comparar o recall
+    def use_ann_index(self, ann_index, top_k, exact=False):
+        self.ann_index = ann_index
+        self.top_k     = top_k
+        self.ann_exact = exact
+
+    # rows: linhas permitidas (None = candidate_rows da query), ex: live_candidate_rows no serviço
+    def nearest_rows(self, query, k, exact=None, rows=None):
+        exact = self.ann_exact if exact is None else exact
+        rows = self.candidate_rows(query) if rows is None else rows
+        return self.ann_index.search(query["embeddings_vector"], k, rows, exact=exact)
+
+    # com ann_index e top_k, só as top_k linhas mais próximas por embeddings (ordenadas) entre rows
+    def shortlist_rows(self, query, rows):
+        if self.ann_index is None or self.top_k is None:
+            return rows
+        return np.sort(self.nearest_rows(query, self.top_k, rows=rows)[0])
+
+    def arcs(self, query):
+        return self.engine.arcs(query, self.shortlist_rows(query, self.candidate_rows(query)))
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import pymongo
+import logging
+from time import time
+
+from candidate_index import CandidateIndex
+from vector_store import VectorStore
+from recommendation_service import OnlineRecommender, load_items
+from instrumentation import configure_logging
+
+# evaluate.py fica na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluate import execute_evaluation_all_k, compare_metrics_all_k, print_metrics_comparison
+
+# IMPACTO DA PRECISÃO DOS VETORES NAS MÉTRICAS
+# avalia a amostra (sample_set) com o índice de candidatos em cada configuração de
+# precisão (embeddings float32/float16/int8, tfidf float64/float32, com ou sem
+# re-ranking em float32) e compara feedback/precision/likelihood com a primeira
+# configuração, que serve de referência. Também mostra a memória das matrizes; re-ranking
+# sem VECTOR_STORE_PATH mantém também a matriz float32 em RAM (full_embeddings_bytes).
+# As queries da amostra são bugs do índice, então os vetorizadores não são usados.
+
+PRECISION_CONFIGURATIONS = [
+    { "name": 'float32', "embeddings_precision": 'float32', "tfidf_dtype": 'float64', "rerank_k": None },
+    { "name": 'float32_tfidf32', "embeddings_precision": 'float32', "tfidf_dtype": 'float32', "rerank_k": None },
+    { "name": 'float16', "embeddings_precision": 'float16', "tfidf_dtype": 'float32', "rerank_k": None },
+    { "name": 'int8', "embeddings_precision": 'int8', "tfidf_dtype": 'float32', "rerank_k": None },
+    { "name": 'int8_rerank200', "embeddings_precision": 'int8', "tfidf_dtype": 'float32', "rerank_k": 200 }
+]
+
+PRECISION_REPORT_PATH = 'embedding_precision_report.json'
+
+def evaluate_configuration(db, configuration, items, max_k, versions, vector_store=None, workers=1):
+    candidate_index = CandidateIndex.load_from_mongo(
+        db,
+        vector_store=vector_store,
+        embeddings_precision=configuration["embeddings_precision"],
+        tfidf_dtype=configuration["tfidf_dtype"],
+        rerank_k=configuration["rerank_k"]
+    )
+    recommender = OnlineRecommender(candidate_index, items, tfidf_vectorizer=None, bert_vectorizer=None)
+
+    time_a = time()
+    metrics = execute_evaluation_all_k(db, max_k, versions, workers=workers, backend='thread', recommender=recommender)
+    return metrics, candidate_index.engine.memory_usage(), time() - time_a
+
+def evaluate_precisions(db, max_k, versions, configurations=PRECISION_CONFIGURATIONS, ks=(1, 5, 10, 20), vector_store=None, workers=1, output_path=PRECISION_REPORT_PATH):
+    ks = [ k for k in ks if k <= max_k ]
+    items = load_items(db)
+    baseline = None
+    report = {}
+
+    for configuration in configurations:
+        print('='*50)
+        print(f'evaluating {configuration["name"]}...')
+        metrics, memory, seconds = evaluate_configuration(db, configuration, items, max_k, versions, vector_store=vector_store, workers=workers)
+        if baseline is None:
+            baseline = metrics
+
+        comparison = compare_metrics_all_k(baseline, metrics, ks)
+        print_metrics_comparison(configuration["name"], comparison)
+        print(f'{configuration["name"]}: tfidf {memory["tfidf_bytes"] / 1024 / 1024:.1f}MB, embeddings {memory["embeddings_bytes"] / 1024 / 1024:.1f}MB, evaluated in {seconds:.2f}s')
+        if memory["full_embeddings_bytes"] > 0:
+            print(f'{configuration["name"]}: re-ranking without a vector store keeps the float32 embeddings in RAM too (+{memory["full_embeddings_bytes"] / 1024 / 1024:.1f}MB)')
+
+        report[configuration["name"]] = { "configuration": configuration, "memory": memory, "seconds": seconds, "metrics": comparison }
+
+    if output_path is not None:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'precision report saved on {output_path}')
+    return report
+
+def main():
+    MONGO_URL = "mongodb://localhost:27017/"
+    MONGO_DATABASE = "bug_report_colab"
+    VECTOR_STORE_PATH = None # ex: 'vector_store/'; com ele o re-ranking lê do store e só a forma compacta fica em memória
+    MAX_K = 20
+    VERSIONS = ['categoric_tfidf_we', 'categoric_tfidf', 'categoric_we']
+    WORKERS = 1
+
+    configure_logging(logging.INFO)
+    db = pymongo.MongoClient(MONGO_URL)[MONGO_DATABASE]
+    vector_store = VectorStore(VECTOR_STORE_PATH) if VECTOR_STORE_PATH is not None else None
+
+    evaluate_precisions(db, MAX_K, VERSIONS, vector_store=vector_store, workers=WORKERS)
+
+if __name__ == '__main__':
+    main()
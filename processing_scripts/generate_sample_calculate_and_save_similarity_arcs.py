@@ -1,11 +1,29 @@
+import os
+import logging
 import pymongo
 import pickle
 import datetime
+import tempfile
+import multiprocessing
 from tqdm import tqdm
 from time import time
 
 from sklearn.metrics.pairwise import cosine_similarity
 
+from similarity_engine import SimilarityEngine
+from candidate_index import CandidateIndex
+from vector_store import VectorStore, vectors_filter, load_bug_vectors, pickled_vectors_size
+from bulk_writer import BulkWriter
+from ann_index import measure_recall_at_k
+from arc_graph import ArcGraphBuilder
+from sample_selection import select_sample, sample_distribution, load_sample_vectors
+from instrumentation import configure_logging, configure_instrumentation, stage, count, log_debug, print_summary, write_summary, pop_stats, merge_stats
+
+RUN_SUMMARY_PATH = 'arcs_run_summary.json'
+PROFILE = None # 'cprofile' ou 'pyinstrument' salva o profile dos estágios em PROFILE_DIR
+PROFILE_STAGES = None # ex: ['arc_similarity']; None perfila qualquer estágio (só o mais externo)
+PROFILE_DIR = 'profiles'
+
 # SAVE PICKLE
 def save_as_pkl_file(bugs, filename='sample_bug_reports_ids_final.pkl'):
     with open(f'sample/{filename}', 'wb') as f:
@@ -35,40 +53,16 @@ def get_mongo_conn(MONGO_URL, MONGO_DATABASE):
     db = client[MONGO_DATABASE]
     return db
 
-def retrieve_sample(db, qty, time_scope):
-    db_bugs = db["bug"]
-
-    db_bugs_query = db_bugs.aggregate([{
-        "$match": {
-            "tfidf_vector":      { "$exists": True },
-            "embeddings_vector": { "$exists": True },
-            "creation_time": {
-                "$lt": time_scope["creation_time_end"], # convert to iso
-                "$gt": time_scope["creation_time_start"] # convert to iso
-            },
-            "sample_set": {
-                "$exists": False
-            }
-        }
-    }, {
-        "$sample": { "size": qty }
-    }])
-
-    bugs = []
-
-    for b in db_bugs_query:
-        b["tfidf_vector"]      = deconvert_from_mongo(b["tfidf_vector"])
-        b["embeddings_vector"] = deconvert_from_mongo(b["embeddings_vector"])
-        bugs.append(b)
+# só os campos leves da amostra (bg_number, product, component, datas); os vetores
+# de cada query são carregados por chunk em load_sample_vectors
+def retrieve_sample(db, qty, time_scope, vector_store=None, strata=None, seed=None):
+    return select_sample(db, qty, time_scope, vector_store=vector_store, strata=strata, seed=seed)
 
-    return bugs
-
-def retrieve_candidates_query(db, query):
+def retrieve_candidates_query(db, query, vector_store=None):
     db_bugs = db["bug"]
 
     db_bugs_query = db_bugs.find({
-        "tfidf_vector":      { "$exists": True },
-        "embeddings_vector": { "$exists": True },
+        **vectors_filter(vector_store),
         "creation_time": {
             "$lt": query["creation_time"],
         },
@@ -86,24 +80,30 @@ def retrieve_candidates_query(db, query):
     bugs = []
 
     for b in db_bugs_query:
-        b["tfidf_vector"]      = deconvert_from_mongo(b["tfidf_vector"])
-        b["embeddings_vector"] = deconvert_from_mongo(b["embeddings_vector"])
-        bugs.append(b)
+        count('bytes_deserialized', pickled_vectors_size(b))
+        bugs.append(load_bug_vectors(b, vector_store))
 
+    count('mongo_queries')
+    count('candidates_retrieved', len(bugs))
     return bugs
 
 
-def save_arcs(db, arcs):
-    db["arc"].insert_many(arcs)
-
-# PICKLE OPERATIONS
-
-def deconvert_from_mongo(bin):
-    return pickle.loads(bin)
+# com arcs_writer os arcos entram no lote do BulkWriter em vez de um insert_many por query
+def save_arcs(db, arcs, arcs_writer=None):
+    if arcs_writer is not None:
+        arcs_writer.insert_many(arcs)
+    else:
+        db["arc"].insert_many(arcs)
 
 # ARC CALCULATIONS
 
 def calculate_distance_arcs_between_reports(query, others):
+    if len(others) == 0:
+        return []
+    return SimilarityEngine.from_bugs(others).arcs(query)
+
+# caminho original par-a-par, mantido como referência para o benchmark
+def calculate_distance_arcs_between_reports_pairwise(query, others):
     arcs = []
 
     for other in others:
@@ -118,58 +118,136 @@ def calculate_distance_arcs_between_reports(query, others):
         arcs.append(arc)
     return arcs
 
+# PARALLEL ARC CALCULATIONS
+# cada processo do pool mantém sua própria conexão com o mongo
+
+ARCS_WRITE_BATCH_SIZE = 5000
+
+worker_db = None
+worker_candidate_index = None
+worker_vector_store = None
+worker_arcs_writer = None
+
+def init_arcs_worker(mongo_url, mongo_database, candidate_index_path=None, vector_store_path=None):
+    global worker_db, worker_candidate_index, worker_vector_store, worker_arcs_writer
+    worker_db = get_mongo_conn(MONGO_URL=mongo_url, MONGO_DATABASE=mongo_database)
+    worker_arcs_writer = BulkWriter(worker_db["arc"], batch_size=ARCS_WRITE_BATCH_SIZE)
+    # cada worker abre o próprio mmap (do candidate index salvo e do store), as páginas são compartilhadas pelo sistema operacional
+    if candidate_index_path is not None:
+        worker_candidate_index = CandidateIndex.load(candidate_index_path)
+    if vector_store_path is not None:
+        worker_vector_store = VectorStore(vector_store_path)
+
+# com candidate_index, candidatos e vetores saem do índice em memória em vez do mongo
+def calculate_and_save_arcs_for_query(db, qb, candidate_index=None, vector_store=None, arcs_writer=None):
+    if candidate_index is not None:
+        with stage('arc_similarity'):
+            qb_arcs = candidate_index.arcs(qb)
+    else:
+        with stage('candidate_retrieval'):
+            candidates = retrieve_candidates_query(db=db, query=qb, vector_store=vector_store)
+        with stage('arc_similarity'):
+            qb_arcs = calculate_distance_arcs_between_reports(qb, candidates)
+
+    if (len(qb_arcs) != 0):
+        with stage('save_arcs'):
+            save_arcs(db, qb_arcs, arcs_writer)
+    count('queries_processed')
+    count('arcs_calculated', len(qb_arcs))
+    return len(qb_arcs)
+
+# devolve o tamanho do chunk recebido (bugs sem vetores saem em load_sample_vectors e não têm arcos)
+def calculate_and_save_arcs_for_chunk(sample_chunk):
+    with stage('load_sample_vectors'):
+        chunk = load_sample_vectors(worker_db, sample_chunk, worker_vector_store)
+    chunk_arcs = [calculate_and_save_arcs_for_query(worker_db, qb, worker_candidate_index, worker_vector_store, worker_arcs_writer) for qb in chunk]
+    # o pool não avisa o worker no fim, então cada chunk só é contado depois de escrito
+    worker_arcs_writer.flush()
+    # contadores e estágios do worker voltam com o chunk e são somados no processo pai
+    return len(sample_chunk), chunk_arcs, pop_stats()
+
+def calculate_and_save_arcs_parallel(sample_bugs, mongo_url, mongo_database, workers=None, chunk_size=16, candidate_index=None, vector_store_path=None):
+    workers = workers or os.cpu_count()
+    chunks = [sample_bugs[i:i + chunk_size] for i in range(0, len(sample_bugs), chunk_size)]
+
+    total_arcs = 0
+    # spawn: o MongoClient do processo pai não é fork-safe
+    context = multiprocessing.get_context('spawn')
+    # o índice montado vai para um diretório temporário e os workers o reabrem com mmap
+    with tempfile.TemporaryDirectory(prefix='candidate_index_') as candidate_index_path:
+        if candidate_index is not None:
+            candidate_index.save(candidate_index_path)
+        initargs = (mongo_url, mongo_database, candidate_index_path if candidate_index is not None else None, vector_store_path)
+        with context.Pool(processes=workers, initializer=init_arcs_worker, initargs=initargs) as pool:
+            with tqdm(total=len(sample_bugs)) as progress:
+                for chunk_bugs, chunk_arcs, worker_stats in pool.imap_unordered(calculate_and_save_arcs_for_chunk, chunks):
+                    merge_stats(worker_stats)
+                    total_arcs += sum(chunk_arcs)
+                    progress.update(chunk_bugs)
+
+    return total_arcs
+
+# compara top-K aproximado e exato nas próprias queries da amostra
+def check_ann_recall(candidate_index, sample_bugs, k, qty=200):
+    queries = sample_bugs[:qty]
+    return measure_recall_at_k(
+        candidate_index.ann_index,
+        [ qb["embeddings_vector"] for qb in queries ],
+        k,
+        [ candidate_index.candidate_rows(qb) for qb in queries ]
+    )
+
 def check_sample(sample_bugs, sample_info_filename):
-    info = {
-        "years": {},
-        "products": {},
-        "components": {}
-    }
-
-    # count years dist
-    for sp in sample_bugs:
-        # years count
-        sp_year = sp["creation_time"].year
-        if sp_year in info["years"].keys():
-            info["years"][sp_year] += 1
-        else:
-            info["years"][sp_year] = 1
-        
-        # products count
-        sp_product = sp["product"]
-        if sp_product in info["products"].keys():
-            info["products"][sp_product] += 1
-        else:
-            info["products"][sp_product] = 1
-        
-        # components count
-        sp_component = sp["component"]
-        if sp_component in info["components"].keys():
-            info["components"][sp_component] += 1
-        else:
-            info["components"][sp_component] = 1
-    
-
-    print(f'check years: {info["years"]}')
-
-    input()
+    info = sample_distribution(sample_bugs)
+
+    print(f'check years: {dict(sorted(info["years"].items()))}')
+    print(f'products: {len(info["products"])}, components: {len(info["components"])}')
 
     print(f'saving sample info on {sample_info_filename}')
     save_as_pkl_file(info, sample_info_filename)
 
 def main():
-    db = get_mongo_conn(MONGO_URL="mongodb://localhost:27017/",
-                        MONGO_DATABASE="bug_report_colab")
+    MONGO_URL = "mongodb://localhost:27017/"
+    MONGO_DATABASE = "bug_report_colab"
+    db = get_mongo_conn(MONGO_URL=MONGO_URL,
+                        MONGO_DATABASE=MONGO_DATABASE)
 
     SAMPLE_SIZE = 10000
     SAMPLE_CREATION_DATE_FROM = datetime.datetime(2009, 1, 1, 0, 0, 0, 0) # converter para iso 
     SAMPLE_CREATION_DATE_TO   = datetime.datetime(2012, 12, 31, 23, 59, 59, 0) # converter para iso
     SAMPLE_FILENAME = 'sample_bug_reports_final_180123.pkl'
+    SAMPLE_STRATA = None # ex: ['year', 'product'] amostra estratificada, com cotas proporcionais a cada estrato
+    SAMPLE_SEED = None # ex: 42 para repetir a mesma amostra
+    WORKERS = os.cpu_count() # 1 = modo sequencial
+    CHUNK_SIZE = 16
+    USE_CANDIDATE_INDEX = True
+    VECTOR_STORE_PATH = None # ex: 'vector_store/' para ler os vetores do store em vez dos pickles no mongo
+    # ARCS_TOP_K muda quais arcos são salvos: em vez de um arco para cada candidato (mesmo filtro de
+    # retrieve_candidates_query), só os ARCS_TOP_K candidatos mais próximos por embeddings, achados pelo
+    # índice IVF (aproximado, veja CHECK_ANN_RECALL). Versões que ordenam por tfidf/categórico leem então
+    # só esse subconjunto. None = todos os candidatos
+    ARCS_TOP_K = None # ex: 100 (requer o candidate index)
+    ANN_INDEX_PATH = 'ann_index.npz'
+    ANN_EXACT = False # True = mesmo top-K com busca exata
+    CHECK_ANN_RECALL = True
+    ARC_GRAPH_PATH = 'arc_graph.npz' # None = não gera o grafo top-N
+    ARC_GRAPH_TOP_N = 100
+    EMBEDDINGS_PRECISION = 'float32' # 'float16' ou 'int8' mantém os embeddings do candidate index na forma compacta
+    TFIDF_DTYPE = 'float64' # 'float32' corta pela metade os valores da matriz tfidf
+    RERANK_K = 200 # com precisão reduzida, os RERANK_K melhores por embeddings são recalculados em float32
+
+    vector_store = None
+    if VECTOR_STORE_PATH is not None:
+        print(f"opening vector store at {VECTOR_STORE_PATH}...")
+        vector_store = VectorStore(VECTOR_STORE_PATH)
 
     print("Retrieving sample...")
-    sample_bugs = retrieve_sample(db, SAMPLE_SIZE, {
-        "creation_time_start": SAMPLE_CREATION_DATE_FROM,
-        "creation_time_end": SAMPLE_CREATION_DATE_TO
-    })
+    with stage('retrieve_sample'):
+        sample_bugs = retrieve_sample(db, SAMPLE_SIZE, {
+            "creation_time_start": SAMPLE_CREATION_DATE_FROM,
+            "creation_time_end": SAMPLE_CREATION_DATE_TO
+        }, vector_store=vector_store, strata=SAMPLE_STRATA, seed=SAMPLE_SEED)
+    print(f'sample with {len(sample_bugs)} bugs')
 
     check_sample(sample_bugs, "QUICK_INFORMATIONS_"+SAMPLE_FILENAME)
 
@@ -178,22 +256,65 @@ def main():
     print(f'saving ids sample on pkl...')
     save_as_pkl_file(sample_bugs_ids, SAMPLE_FILENAME)
 
+    candidate_index = None
+    if USE_CANDIDATE_INDEX:
+        print("loading candidate index...")
+        with stage('candidate_index_load'):
+            candidate_index = CandidateIndex.load_from_mongo(db, vector_store=vector_store, embeddings_precision=EMBEDDINGS_PRECISION,
+                                                             tfidf_dtype=TFIDF_DTYPE, rerank_k=RERANK_K)
+        print(f'candidate index with {len(candidate_index)} bugs ({candidate_index.engine.memory_usage()})')
+
+        if ARCS_TOP_K is not None:
+            print(f'saving only the {ARCS_TOP_K} nearest candidates by embeddings per query (ARCS_TOP_K)')
+            if os.path.exists(ANN_INDEX_PATH):
+                print(f"loading ann index from {ANN_INDEX_PATH}...")
+                ann_index = candidate_index.load_ann_index(ANN_INDEX_PATH)
+            else:
+                print("building ann index...")
+                ann_index = candidate_index.build_ann_index()
+                ann_index.save(ANN_INDEX_PATH)
+            candidate_index.use_ann_index(ann_index, ARCS_TOP_K, exact=ANN_EXACT)
+
+            if CHECK_ANN_RECALL:
+                check_ann_recall(candidate_index, load_sample_vectors(db, sample_bugs[:200], vector_store), ARCS_TOP_K)
+
     print("calculating and saving arcs...")
     total_time_a = time()
-    for qb in tqdm(sample_bugs):
-
-        candidates = retrieve_candidates_query(db=db, query=qb)
-
-        qb_arcs = calculate_distance_arcs_between_reports(qb, candidates)
-
-        if (len(qb_arcs) != 0):
-            print(f'saving {len(qb_arcs)} arcs from ID={qb["bg_number"]}...')
-            save_arcs(db, qb_arcs)
-        else:
-            print(f'no candidates for ID={qb["bg_number"]}')
+    if WORKERS > 1:
+        print(f'using {WORKERS} workers...')
+        total_arcs = calculate_and_save_arcs_parallel(sample_bugs, MONGO_URL, MONGO_DATABASE, workers=WORKERS, chunk_size=CHUNK_SIZE, candidate_index=candidate_index, vector_store_path=VECTOR_STORE_PATH)
+        print(f'saved {total_arcs} arcs')
+    else:
+        with BulkWriter(db["arc"], batch_size=ARCS_WRITE_BATCH_SIZE) as arcs_writer, tqdm(total=len(sample_bugs)) as progress:
+            for i in range(0, len(sample_bugs), CHUNK_SIZE):
+                with stage('load_sample_vectors'):
+                    chunk = load_sample_vectors(db, sample_bugs[i:i + CHUNK_SIZE], vector_store)
+
+                for qb in chunk:
+                    qb_arcs_count = calculate_and_save_arcs_for_query(db, qb, candidate_index, vector_store, arcs_writer)
+
+                    if (qb_arcs_count != 0):
+                        log_debug(lambda: f'saved {qb_arcs_count} arcs from ID={qb["bg_number"]}...')
+                    else:
+                        log_debug(lambda: f'no candidates for ID={qb["bg_number"]}')
+                progress.update(len(sample_bugs[i:i + CHUNK_SIZE]))
+        count('mongo_bulk_round_trips', arcs_writer.round_trips)
 
     total_time_in_ms = int((time() - total_time_a) * 1000)
     print(f"Total time to calculate and save all arcs from {len(sample_bugs)} bugs: {total_time_in_ms}ms -> {total_time_in_ms/1000}s")
 
+    if ARC_GRAPH_PATH is not None:
+        print(f"building top-{ARC_GRAPH_TOP_N} arc graph...")
+        with stage('arc_graph_build'):
+            arc_graph = ArcGraphBuilder.from_mongo(db, top_n=ARC_GRAPH_TOP_N)
+            arc_graph.save(ARC_GRAPH_PATH)
+        print(f'saved arc graph with {len(arc_graph)} bugs on {ARC_GRAPH_PATH}')
+
+    # no modo paralelo os estágios por query somam o tempo de todos os workers
+    print_summary()
+    write_summary(RUN_SUMMARY_PATH)
+
 if __name__ == '__main__':
+    configure_logging(logging.INFO) # logging.DEBUG mostra os arcos salvos por query
+    configure_instrumentation(profile=PROFILE, profile_stages=PROFILE_STAGES, profile_dir=PROFILE_DIR)
     main()
\ No newline at end of file
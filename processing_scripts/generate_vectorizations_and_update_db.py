@@ -1,93 +1,212 @@
+import os
+import logging
 import pymongo
-import nltk
 import pickle
-import string
+import datetime
+import multiprocessing
+import numpy as np
+from bson import json_util
+from time import time
+from scipy.sparse import csr_matrix, vstack
 from bson import Binary
 from tqdm import tqdm
-from nltk import word_tokenize
-from nltk.corpus import stopwords
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer as SklearnTfIdfVectorizer
 
+from vector_store import VECTOR_STORE_REF_FIELD, VECTORS_UPDATED_AT_FIELD, save_vector_store
+from preprocessing import PREPROCESSING_CACHE_PATH, pre_process, pre_process_corpus, download_nltk_data
+from bulk_writer import BulkWriter
+from instrumentation import configure_logging, configure_instrumentation, stage, count, log_debug, print_summary, write_summary
+
+WRITE_BATCH_SIZE = 500
+STREAMING_CHECKPOINT_PATH = 'vectorization_checkpoint.json'
+TFIDF_VECTORIZER_PATH = 'tfidf_vectorizer.npz'
+RUN_SUMMARY_PATH = 'vectorization_run_summary.json'
+PROFILE = None # 'cprofile' ou 'pyinstrument' salva o profile dos estágios em PROFILE_DIR
+PROFILE_STAGES = None # ex: ['bert_encode']; None perfila qualquer estágio (só o mais externo)
+PROFILE_DIR = 'profiles'
+# dtype dos tfidf gravados em pickle no mongo; None mantém o dtype do vetorizador, ex: np.float32.
+# Os embeddings no mongo ficam sempre no formato original (ndarray em pickle), que é o que o
+# EnhancedMongoDataLoader/recommender lê; embeddings float16/int8 só existem no vector store (.npy)
+MONGO_TFIDF_DTYPE = None
+
 # CÓDIGO RELACIONADO À VETORIZADORES
 
 BERT = 'all-MiniLM-L6-v2'
+BERT_BATCH_SIZE = 64
 
 class BertVectorizer():
-    def __init__(self):
+    def __init__(self, batch_size=BERT_BATCH_SIZE):
         print(f'instanciating bert...')
         self.vectorizer = SentenceTransformer(BERT)
+        self.batch_size = batch_size
 
-    def transform(self, docs):
+    def transform(self, docs, batched=False, batch_size=None):
+        if batched:
+            return self.transform_batched(docs, batch_size=batch_size)
         vectorized_docs = [ self.vectorizer.encode(doc) for doc in docs ]
         return vectorized_docs
 
+    def token_length(self, doc):
+        # tamanho em tokens já truncado no max_seq_length do modelo
+        n_tokens = len(self.vectorizer.tokenizer.tokenize(doc))
+        return min(n_tokens, self.vectorizer.max_seq_length)
+
+    def transform_batched(self, docs, batch_size=None):
+        # agrupa descrições de tamanho parecido para reduzir padding em cada forward pass
+        batch_size = batch_size or self.batch_size
+        docs = [ doc if doc else '' for doc in docs ]
+
+        lengths = [ self.token_length(doc) for doc in docs ]
+        order = np.argsort(lengths, kind='stable')[::-1]
+
+        dimension = self.vectorizer.get_sentence_embedding_dimension()
+        vectorized_docs = np.empty((len(docs), dimension), dtype=np.float32)
+
+        time_a = time()
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            vectorized_docs[bucket] = self.vectorizer.encode(
+                [ docs[i] for i in bucket ],
+                batch_size=len(bucket),
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        elapsed = time() - time_a
+
+        docs_per_sec = len(docs) / elapsed if elapsed > 0 else float('inf')
+        print(f'bert: {len(docs)} docs encoded in {elapsed:.2f}s -> {docs_per_sec:.1f} docs/s (batch_size={batch_size})')
+
+        return vectorized_docs
+
 class TfidfVectorizer():
-    def __init__(self, corpus):
-        self.vectorizer = SklearnTfIdfVectorizer()
-        print(f'Fitting tfidfVectorizer with a corpus with size of {len(corpus)} docs...')
+    # corpus=None cria o wrapper sem ajustar, para ser preenchido por load()
+    def __init__(self, corpus=None, dtype=np.float64, max_features=None):
+        self.vectorizer = SklearnTfIdfVectorizer(dtype=dtype, max_features=max_features, norm='l2')
+        if corpus is None:
+            return
+        # corpus pode ser um gerador (vetorização em streaming), que não tem len
+        if hasattr(corpus, '__len__'):
+            print(f'Fitting tfidfVectorizer with a corpus with size of {len(corpus)} docs...')
+        else:
+            print(f'Fitting tfidfVectorizer with a streamed corpus...')
         self.vectorizer.fit(corpus)
     
     def transform(self, text):
         return self.vectorizer.transform([text])
+
+    # transforma o corpus todo em uma chamada: uma única csr_matrix (n_docs x vocab) com linhas normalizadas (L2)
+    def transform_batch(self, texts):
+        return csr_matrix(self.vectorizer.transform(texts))
+
+    # persiste só vocabulário e pesos idf, sem depender do pickle do sklearn
+    def save(self, path):
+        vocabulary = self.vectorizer.vocabulary_
+        terms = np.empty(len(vocabulary), dtype=object)
+        for term, index in vocabulary.items():
+            terms[index] = term
+        np.savez(
+            path,
+            terms=terms.astype(str),
+            idf=self.vectorizer.idf_,
+            dtype=np.array(np.dtype(self.vectorizer.dtype).name)
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as saved:
+            terms = saved["terms"].tolist()
+            idf   = saved["idf"]
+            dtype = np.dtype(str(saved["dtype"]))
+
+        tfidf_vectorizer = cls(dtype=dtype)
+        tfidf_vectorizer.vectorizer.set_params(vocabulary={ term: index for index, term in enumerate(terms) })
+        tfidf_vectorizer.vectorizer.idf_ = idf
+        print(f'tfidfVectorizer loaded from {path} with a vocabulary of {len(terms)} terms')
+        return tfidf_vectorizer
+
+# carrega o vetorizador salvo em path, se existir; senão ajusta em corpus_fn() e salva.
+# com isso bugs novos são vetorizados sem reajustar sobre o corpus inteiro
+def fit_or_load_tfidf_vectorizer(corpus_fn, path=None, dtype=np.float64, max_features=None):
+    if path is not None and os.path.exists(path):
+        return TfidfVectorizer.load(path)
+    tfidf_vectorizer = TfidfVectorizer(corpus_fn(), dtype=dtype, max_features=max_features)
+    if path is not None:
+        tfidf_vectorizer.save(path)
+    return tfidf_vectorizer
         
 # CÓDIGO RELACIONADO À PRE-PROCESSAMENTO E GERAÇÃO DE VETORES
 
-def pre_process(text):
-    print('start preprocessing...')
-
-    # remove stopwords and punctuation
-    print('removing stopwords...')
-    stop = set(stopwords.words('english') + list(string.punctuation))
-    return " ".join([w for w in word_tokenize(text.lower()) if w not in stop])   
-
-def generate_tfidf(pp_document, tfidf_vectorizer):
-    return tfidf_vectorizer.transform(pp_document)
-
-def generate_embeddings(document, bert_vectorizer):
-    return bert_vectorizer.transform(document)[0]
+def generate_embeddings_batch(documents, bert_vectorizer, batch_size=None):
+    return bert_vectorizer.transform(documents, batched=True, batch_size=batch_size)
 
 
 # CÓDIGO RELACIONADO À MONGODB
 
-def convert_to_mongo_acceptable(vector, vectorization="tfidf"):
+def convert_to_mongo_acceptable(vector, vectorization="tfidf", tfidf_dtype=MONGO_TFIDF_DTYPE):
     
     if vectorization == "bert":
-        print(f'{vectorization}: type={type(vector)}')
-        return Binary(pickle.dumps(vector, protocol=2), subtype=128)
+        log_debug(lambda: f'{vectorization}: type={type(vector)}')
+        serialized = pickle.dumps(vector, protocol=2)
+        count('bytes_serialized', len(serialized))
+        return Binary(serialized, subtype=128)
         # ndarray to python list
         # return vector
     if vectorization == "tfidf":
-        print(f'{vectorization}: type={type(vector)}')
+        log_debug(lambda: f'{vectorization}: type={type(vector)}')
         # csr matrix to python list of lists (LIL)
         # return vector.tolil()
-        return Binary(pickle.dumps(vector, protocol=2), subtype=128)
+        if tfidf_dtype is not None:
+            vector = vector.astype(tfidf_dtype)
+        serialized = pickle.dumps(vector, protocol=2)
+        count('bytes_serialized', len(serialized))
+        return Binary(serialized, subtype=128)
     return -1
 
 def deconvert_from_mongo(bin):
+    count('bytes_deserialized', len(bin))
     return pickle.loads(bin)
 
 def save_vectors_on_mongo(db, bug_id, tfidf_vector, bert_vector):
-    print(f'salvando vetores em mongo, id={bug_id}...')
+    log_debug(lambda: f'salvando vetores em mongo, id={bug_id}...')
     db.update_one({
         "bg_number": bug_id
     }, {
         "$set": {
             "tfidf_vector"     : tfidf_vector,
-            "embeddings_vector": bert_vector
+            "embeddings_vector": bert_vector,
+            VECTORS_UPDATED_AT_FIELD: datetime.datetime.utcnow()
         }
     })
 
 def update_tfidf_vector_on_mongo(db, bug_id, tfidf_vector):
-    print(f'atualizando tfidf em mongo, id={bug_id}...')
+    log_debug(lambda: f'atualizando tfidf em mongo, id={bug_id}...')
     db.update_one({
         "bg_number": bug_id
     }, {
         "$set": {
             "tfidf_vector": tfidf_vector,
+            VECTORS_UPDATED_AT_FIELD: datetime.datetime.utcnow()
         }
     })
 
+# no modo vector store o documento guarda só a linha do vetor no store
+def save_vector_reference_on_mongo(db, bug_id, row, drop_pickled=False):
+    update = {
+        "$set": {
+            VECTOR_STORE_REF_FIELD: row,
+            VECTORS_UPDATED_AT_FIELD: datetime.datetime.utcnow()
+        }
+    }
+    if drop_pickled:
+        update["$unset"] = {
+            "tfidf_vector": "",
+            "embeddings_vector": ""
+        }
+    db.update_one({
+        "bg_number": bug_id
+    }, update)
+
 def retrieve_bugs_without_vectors(db):
     return db.find({
         "tfidf_vector":      { "$exists": False },
@@ -99,9 +218,43 @@ def retrieve_bugs_with_tfidf(db):
         "tfidf_vector": { "$exists": True }
     })
 
+# cursor em ordem de _id só com os campos usados na vetorização, em chunks de tamanho fixo
+def stream_bugs_without_vectors(db, chunk_size, start_after_id=None):
+    query = {
+        "tfidf_vector":      { "$exists": False },
+        "embeddings_vector": { "$exists": False }
+    }
+    if start_after_id is not None:
+        query["_id"] = { "$gt": start_after_id }
+
+    cursor = db.find(query, {"bg_number": True, "description": True}).sort("_id", pymongo.ASCENDING).batch_size(chunk_size)
+
+    chunk = []
+    for b in cursor:
+        chunk.append(b)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+# CHECKPOINT DA VETORIZAÇÃO EM STREAMING
+
+def load_checkpoint(checkpoint_path):
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json_util.loads(f.read())["last_id"]
+
+def save_checkpoint(checkpoint_path, last_id):
+    tmp_path = f'{checkpoint_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json_util.dumps({ "last_id": last_id }))
+    os.replace(tmp_path, checkpoint_path)
+
 # OPERAÇÕES EM DATASETS
 
-def fix_tfidf_vectors_on_dataset(database_name):
+def fix_tfidf_vectors_on_dataset(database_name, cache_path=PREPROCESSING_CACHE_PATH, workers=None, write_batch_size=WRITE_BATCH_SIZE, tfidf_vectorizer_path=TFIDF_VECTORIZER_PATH):
     # connect to mongodb
     print('abrindo conexão com mongodb...')
     client = pymongo.MongoClient(f"mongodb://localhost:27017/")
@@ -109,92 +262,229 @@ def fix_tfidf_vectors_on_dataset(database_name):
 
     # find all bug reports
     print('buscando todos os bug reports que ja possuem tfidf...')
-    all_bugs = [b for b in retrieve_bugs_with_tfidf(db_bugs)]
+    with stage('retrieve_bugs'):
+        all_bugs = [b for b in retrieve_bugs_with_tfidf(db_bugs)]
 
     # preprocess all bug reports and puts on dict
     print('aplicando preprocessamentos nas descrições dos bug reports que ja possuem tfidf...')
-    all_preprocessed_bugs = {}
-    for b in all_bugs:
-        pp_bug = {
-            "id": b["bg_number"],
-            "pp_description": pre_process(b["description"])
-        }
-        all_preprocessed_bugs[b["bg_number"]] = pp_bug
-
-    tfidf_vectorizer = TfidfVectorizer([all_preprocessed_bugs[key]["pp_description"] for key in all_preprocessed_bugs.keys()])
-
-    for i, b in enumerate(all_bugs):
-        print(f"gerando tfidf e atualizando db para id={b['bg_number']} || contagem: {i+1}/{len(all_bugs)}")
-        # gera tfidf
-        tfidf_vector = generate_tfidf(all_preprocessed_bugs[ b["bg_number"] ]["pp_description"], tfidf_vectorizer)
-
-        # atualiza no banco
-        update_tfidf_vector_on_mongo(db_bugs, b["bg_number"], convert_to_mongo_acceptable(tfidf_vector, "tfidf"))
-
-def populate_vectorizations(database_name, batch_size=10000):
+    with stage('pre_process'):
+        all_preprocessed_bugs = pre_process_corpus(all_bugs, cache_path=cache_path, workers=workers)
+
+    # a correção sempre reajusta o vocabulário e sobrescreve o vetorizador salvo
+    with stage('tfidf_fit'):
+        tfidf_vectorizer = TfidfVectorizer(list(all_preprocessed_bugs.values()))
+    if tfidf_vectorizer_path is not None:
+        tfidf_vectorizer.save(tfidf_vectorizer_path)
+
+    # gera tfidf de todos os bugs em uma chamada
+    with stage('tfidf_transform'):
+        tfidf_matrix = tfidf_vectorizer.transform_batch([all_preprocessed_bugs[ b["bg_number"] ] for b in all_bugs])
+
+    with stage('save_vectors'), BulkWriter(db_bugs, batch_size=write_batch_size) as bugs_writer:
+        for i, b in enumerate(all_bugs):
+            log_debug(lambda: f"atualizando tfidf no db para id={b['bg_number']} || contagem: {i+1}/{len(all_bugs)}")
+            # atualiza no banco (em lote, pela thread do writer)
+            update_tfidf_vector_on_mongo(bugs_writer, b["bg_number"], convert_to_mongo_acceptable(tfidf_matrix[i], "tfidf"))
+    count('docs_vectorized', len(all_bugs))
+    count('mongo_bulk_round_trips', bugs_writer.round_trips)
+
+# o vetorizador tfidf ajustado fica em tfidf_vectorizer_path (o mesmo caminho lido pelo
+# recommendation_service), para as queries novas usarem o vocabulário dos vetores gravados
+def populate_vectorizations(database_name, batch_size=10000, bert_batch_size=BERT_BATCH_SIZE, cache_path=PREPROCESSING_CACHE_PATH, workers=None, write_batch_size=WRITE_BATCH_SIZE, tfidf_vectorizer_path=TFIDF_VECTORIZER_PATH):
     # connect to mongodb
     print('abrindo conexão com mongodb...')
     client = pymongo.MongoClient(f"mongodb://localhost:27017/")
     db_bugs = client[database_name]["bug"]
 
+    download_nltk_data()
+
     # find all bug reports
     print('buscando todos os bug reports...')
-    all_bugs = [b for b in retrieve_bugs_without_vectors(db_bugs)]
+    with stage('retrieve_bugs'):
+        all_bugs = [b for b in retrieve_bugs_without_vectors(db_bugs)]
 
     # preprocess all bug reports and puts on dict
     print('aplicando preprocessamentos nas descrições de todos os bug reports...')
-    all_preprocessed_bugs = {}
-    for b in all_bugs:
-        pp_bug = {
-            "id": b["bg_number"],
-            "pp_description": pre_process(b["description"])
-        }
-        all_preprocessed_bugs[b["bg_number"]] = pp_bug
+    with stage('pre_process'):
+        all_preprocessed_bugs = pre_process_corpus(all_bugs, cache_path=cache_path, workers=workers)
 
     # instanciate vectorizers
-    tfidf_vectorizer = TfidfVectorizer([all_preprocessed_bugs[key]["pp_description"] for key in all_preprocessed_bugs.keys()])
-    bert_vectorizer  = BertVectorizer()
+    with stage('tfidf_fit'):
+        tfidf_vectorizer = fit_or_load_tfidf_vectorizer(lambda: list(all_preprocessed_bugs.values()), path=tfidf_vectorizer_path)
+    bert_vectorizer  = BertVectorizer(batch_size=bert_batch_size)
+
+    # escritas saem em lotes por uma thread enquanto os próximos vetores são gerados
+    bugs_writer = BulkWriter(db_bugs, batch_size=write_batch_size)
 
     all_bugs = all_bugs[:batch_size]
     while (len(all_bugs) > 0):
 
-        print('baixando stopwords e pontuação...')
-        nltk.download('stopwords')
-        nltk.download('punkt')
-
         # generate vectors
-        print('gerando vetores tfidf e embeddings para todos os bug reports...')
-        bugs_context_vectors = []
-        for i, b in enumerate(tqdm(all_bugs)):
-            print(f'gerando vetores para id={b["bg_number"]}...')
-            b_vectors = {
-                "id"        : b["bg_number"],
-                "embeddings": generate_embeddings(b["description"], bert_vectorizer),
-                "tfidf"     : generate_tfidf(all_preprocessed_bugs[ b["bg_number"] ]["pp_description"], tfidf_vectorizer)
-            }
-            bugs_context_vectors.append(b_vectors)
-
-            # a cada 50 bugs com vetores gerados, salva no BD e limpa memória
-            if (len(bugs_context_vectors) == 50):
-                #print('salvando em bd com vetores...')
-                for b in bugs_context_vectors:
-                    tfidf_vector = convert_to_mongo_acceptable(vector=b["tfidf"], vectorization="tfidf")
-                    embeddings_vector = convert_to_mongo_acceptable(vector=b["embeddings"], vectorization="bert")
-                    
-                    save_vectors_on_mongo(
-                        db=db_bugs,
-                        bug_id=b["id"],
-                        tfidf_vector=tfidf_vector,
-                        bert_vector=embeddings_vector
-                    )
-                print(f"salvou +50... {i+1} de {len(all_bugs)}")
-                # limpa bugs_context_vectors de 50 em 50 para não ocupar tanta memória
-                bugs_context_vectors = []
-    
-        # 
-        all_bugs = [b for b in retrieve_bugs_without_vectors(db_bugs)]
+        print('gerando embeddings em lotes para todos os bug reports...')
+        with stage('bert_encode'):
+            all_embeddings = generate_embeddings_batch([b["description"] for b in all_bugs], bert_vectorizer)
+
+        print('gerando vetores tfidf para todos os bug reports...')
+        with stage('tfidf_transform'):
+            all_tfidf = tfidf_vectorizer.transform_batch([all_preprocessed_bugs[ b["bg_number"] ] for b in all_bugs])
+
+        with stage('save_vectors'):
+            for i, b in enumerate(tqdm(all_bugs)):
+                save_vectors_on_mongo(
+                    db=bugs_writer,
+                    bug_id=b["bg_number"],
+                    tfidf_vector=convert_to_mongo_acceptable(vector=all_tfidf[i], vectorization="tfidf"),
+                    bert_vector=convert_to_mongo_acceptable(vector=all_embeddings[i], vectorization="bert")
+                )
+
+            # garante que o lote foi escrito antes de buscar os bugs que ainda faltam
+            bugs_writer.flush()
+        count('docs_vectorized', len(all_bugs))
+        print(f"salvou {bugs_writer.written} bugs com vetores...")
+
+        with stage('retrieve_bugs'):
+            all_bugs = [b for b in retrieve_bugs_without_vectors(db_bugs)]
         all_bugs = all_bugs[:batch_size]
 
+    bugs_writer.close()
+    count('mongo_bulk_round_trips', bugs_writer.round_trips)
+
+
+# VETORIZAÇÃO EM STREAMING
+# pipeline de geradores preprocess -> encode -> write sobre chunks de chunk_size bugs,
+# com memória constante independente do tamanho do corpus. O checkpoint guarda o
+# último _id já escrito, então uma execução interrompida continua de onde parou.
+
+def preprocess_chunks(chunks, pool):
+    for chunk in chunks:
+        # sem cache em disco aqui: ele carrega o corpus todo e o checkpoint já evita retrabalho
+        with stage('pre_process'):
+            preprocessed = pre_process_corpus(chunk, cache_path=None, pool=pool)
+        yield chunk, preprocessed
+
+def encode_chunks(preprocessed_chunks, tfidf_vectorizer, bert_vectorizer):
+    for chunk, preprocessed in preprocessed_chunks:
+        with stage('tfidf_transform'):
+            tfidf_matrix = tfidf_vectorizer.transform_batch([preprocessed[b["bg_number"]] for b in chunk])
+        with stage('bert_encode'):
+            embeddings   = generate_embeddings_batch([b["description"] for b in chunk], bert_vectorizer)
+        yield chunk, tfidf_matrix, embeddings
+
+def stream_vectorizations(database_name, chunk_size=1000, checkpoint_path=STREAMING_CHECKPOINT_PATH, bert_batch_size=BERT_BATCH_SIZE, workers=None, write_batch_size=WRITE_BATCH_SIZE, tfidf_vectorizer_path=TFIDF_VECTORIZER_PATH, tfidf_dtype=np.float64, tfidf_max_features=None):
+    # connect to mongodb
+    print('abrindo conexão com mongodb...')
+    client = pymongo.MongoClient(f"mongodb://localhost:27017/")
+    db_bugs = client[database_name]["bug"]
+
+    download_nltk_data()
+
+    start_after_id = load_checkpoint(checkpoint_path)
+    if start_after_id is not None:
+        print(f'retomando a partir do checkpoint _id={start_after_id}...')
+
+    with multiprocessing.Pool(processes=workers or os.cpu_count()) as pool:
+        # sem vetorizador salvo, o vocabulário é ajustado sobre todas as descrições,
+        # lidas do cursor sem materializar a lista
+        tfidf_vectorizer = fit_or_load_tfidf_vectorizer(
+            lambda: pool.imap(pre_process, (b["description"] for b in db_bugs.find({}, {"description": True}).batch_size(chunk_size)), chunksize=256),
+            path=tfidf_vectorizer_path,
+            dtype=tfidf_dtype,
+            max_features=tfidf_max_features
+        )
+        bert_vectorizer  = BertVectorizer(batch_size=bert_batch_size)
+
+        chunks = stream_bugs_without_vectors(db_bugs, chunk_size, start_after_id)
+        encoded_chunks = encode_chunks(preprocess_chunks(chunks, pool), tfidf_vectorizer, bert_vectorizer)
+
+        total = 0
+        pending_last_id = None
+        with BulkWriter(db_bugs, batch_size=write_batch_size) as bugs_writer:
+            for chunk, tfidf_matrix, embeddings in encoded_chunks:
+                # o chunk anterior foi escrito em background enquanto este era codificado;
+                # só depois de confirmado vira checkpoint
+                with stage('save_vectors'):
+                    bugs_writer.flush()
+                    if pending_last_id is not None:
+                        save_checkpoint(checkpoint_path, pending_last_id)
+
+                    for i, b in enumerate(chunk):
+                        save_vectors_on_mongo(
+                            db=bugs_writer,
+                            bug_id=b["bg_number"],
+                            tfidf_vector=convert_to_mongo_acceptable(vector=tfidf_matrix[i], vectorization="tfidf"),
+                            bert_vector=convert_to_mongo_acceptable(vector=embeddings[i], vectorization="bert")
+                        )
+
+                pending_last_id = chunk[-1]["_id"]
+                total += len(chunk)
+                count('docs_vectorized', len(chunk))
+                print(f'{total} bugs vetorizados...')
+        count('mongo_bulk_round_trips', bugs_writer.round_trips)
+
+        if pending_last_id is not None:
+            save_checkpoint(checkpoint_path, pending_last_id)
+
+    print(f'vetorização em streaming concluída: {total} bugs')
+
+def populate_vector_store(database_name, vector_store_path, embeddings_dtype='float32', bert_batch_size=BERT_BATCH_SIZE, cache_path=PREPROCESSING_CACHE_PATH, workers=None, tfidf_dtype=np.float64, tfidf_max_features=None):
+    # connect to mongodb
+    print('abrindo conexão com mongodb...')
+    client = pymongo.MongoClient(f"mongodb://localhost:27017/")
+    db_bugs = client[database_name]["bug"]
+
+    download_nltk_data()
+
+    # find all bug reports
+    print('buscando todos os bug reports...')
+    all_bugs = [b for b in db_bugs.find({}, {"bg_number": True, "description": True})]
+
+    print('aplicando preprocessamentos nas descrições de todos os bug reports...')
+    all_preprocessed_bugs = pre_process_corpus(all_bugs, cache_path=cache_path, workers=workers)
+    pp_descriptions = [all_preprocessed_bugs[b["bg_number"]] for b in all_bugs]
+
+    # instanciate vectorizers
+    tfidf_vectorizer = TfidfVectorizer(pp_descriptions, dtype=tfidf_dtype, max_features=tfidf_max_features)
+    os.makedirs(vector_store_path, exist_ok=True)
+    tfidf_vectorizer.save(os.path.join(vector_store_path, TFIDF_VECTORIZER_PATH))
+    bert_vectorizer  = BertVectorizer(batch_size=bert_batch_size)
+
+    print('gerando vetores tfidf e embeddings para todos os bug reports...')
+    tfidf_matrix      = tfidf_vectorizer.transform_batch(pp_descriptions)
+    embeddings_matrix = generate_embeddings_batch([b["description"] for b in all_bugs], bert_vectorizer)
+
+    bg_numbers = [b["bg_number"] for b in all_bugs]
+    print(f'salvando vector store em {vector_store_path}...')
+    save_vector_store(vector_store_path, bg_numbers, tfidf_matrix, embeddings_matrix, embeddings_dtype=embeddings_dtype)
+
+    print('salvando referências no mongo...')
+    with BulkWriter(db_bugs, batch_size=WRITE_BATCH_SIZE) as bugs_writer:
+        for row, bug_id in enumerate(tqdm(bg_numbers)):
+            save_vector_reference_on_mongo(bugs_writer, bug_id, row)
+
+# migra os vetores em pickle já salvos no mongo para o vector store
+def export_vector_store_from_mongo(database_name, vector_store_path, embeddings_dtype='float32', drop_pickled=False):
+    # connect to mongodb
+    print('abrindo conexão com mongodb...')
+    client = pymongo.MongoClient(f"mongodb://localhost:27017/")
+    db_bugs = client[database_name]["bug"]
+
+    print('lendo vetores em pickle do mongo...')
+    bg_numbers, tfidf_vectors, embeddings_vectors = [], [], []
+    for b in tqdm(db_bugs.find({
+        "tfidf_vector":      { "$exists": True },
+        "embeddings_vector": { "$exists": True }
+    }, {"bg_number": True, "tfidf_vector": True, "embeddings_vector": True})):
+        bg_numbers.append(b["bg_number"])
+        tfidf_vectors.append(deconvert_from_mongo(b["tfidf_vector"]))
+        embeddings_vectors.append(deconvert_from_mongo(b["embeddings_vector"]))
+
+    print(f'salvando vector store em {vector_store_path}...')
+    save_vector_store(vector_store_path, bg_numbers, vstack(tfidf_vectors, format='csr'), np.vstack(embeddings_vectors), embeddings_dtype=embeddings_dtype)
+
+    print('salvando referências no mongo...')
+    with BulkWriter(db_bugs, batch_size=WRITE_BATCH_SIZE) as bugs_writer:
+        for row, bug_id in enumerate(tqdm(bg_numbers)):
+            save_vector_reference_on_mongo(bugs_writer, bug_id, row, drop_pickled=drop_pickled)
 
 # testa desconversão de binário para tipos específicos
 def testing_vectors_retrieval():
@@ -225,8 +515,17 @@ def test_retrieve_vectors_tfidf():
 
     print(f"total reports with tfidf: {len(x)}")
 
+# mede docs/s do encode em lotes para escolher o batch_size da máquina
 if __name__ == '__main__':
+    configure_logging(logging.INFO) # logging.DEBUG mostra as mensagens por bug
+    configure_instrumentation(profile=PROFILE, profile_stages=PROFILE_STAGES, profile_dir=PROFILE_DIR)
     populate_vectorizations("bug_report_colab")
     #fix_tfidf_vectors_on_dataset("bug_report_colab")
     #testing_vectors_retrieval()
     #test_retrieve_vectors_tfidf()
+    #stream_vectorizations("bug_report_colab")
+    #populate_vector_store("bug_report_colab", "vector_store/")
+    #export_vector_store_from_mongo("bug_report_colab", "vector_store/")
+
+    print_summary()
+    write_summary(RUN_SUMMARY_PATH)
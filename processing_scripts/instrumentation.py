@@ -0,0 +1,225 @@
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import datetime
+import threading
+import functools
+import contextlib
+
+# INSTRUMENTAÇÃO DO PIPELINE
+# timers por estágio (context manager stage() ou decorator timed()), contadores
+# (documentos processados, idas ao mongo, bytes desserializados...), log com níveis
+# e profiling opcional (cProfile ou pyinstrument) de estágios escolhidos.
+# Cada processo tem o seu próprio registro; o resumo da execução sai com
+# print_summary() e write_summary(path). Workers de um pool devolvem pop_stats()
+# junto com cada resultado e o processo pai soma com merge_stats(), então os tempos
+# dos estágios dos workers somam o tempo de todos os processos.
+#
+# Mensagens de dentro de loops usam log_debug(), que não formata nada quando o
+# nível DEBUG está desligado.
+
+LOGGER_NAME = 'similar_bugs'
+PROFILERS = ['cprofile', 'pyinstrument']
+
+logger = logging.getLogger(LOGGER_NAME)
+
+def configure_logging(level=logging.INFO):
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logger.setLevel(level)
+
+def debug_enabled():
+    return logger.isEnabledFor(logging.DEBUG)
+
+# message_fn só é chamada com DEBUG ligado, então nem a f-string é montada no caminho normal
+def log_debug(message_fn):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message_fn())
+
+class Instrumentation():
+    # profile: None, 'cprofile' ou 'pyinstrument'; profile_stages: nomes dos estágios a perfilar (None = todos)
+    def __init__(self, profile=None, profile_stages=None, profile_dir='profiles'):
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f'profile must be one of {PROFILERS}, got {profile}')
+        self.profile        = profile
+        self.profile_stages = set(profile_stages) if profile_stages is not None else None
+        self.profile_dir    = profile_dir
+
+        self.lock     = threading.Lock()
+        self.started  = time.time()
+        self.timers   = {}
+        self.counters = {}
+        self.profiles = {}
+        self.profiling = False
+
+    def reset(self):
+        with self.lock:
+            self.started  = time.time()
+            self.timers   = {}
+            self.counters = {}
+            self.profiles = {}
+
+    # CONTADORES
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # TIMERS
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, { "calls": 0, "seconds": 0.0, "max_seconds": 0.0 })
+            timer["calls"]      += 1
+            timer["seconds"]    += seconds
+            timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def should_profile(self, name):
+        return self.profile is not None and (self.profile_stages is None or name in self.profile_stages)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        profiler = self.start_profiler() if self.should_profile(name) else None
+        time_a = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - time_a)
+            if profiler is not None:
+                self.stop_profiler(name, profiler)
+
+    def timed(self, name=None):
+        return timed_stage(self.stage, name)
+
+    # REGISTROS DE OUTROS PROCESSOS
+
+    # timers e contadores acumulados desde a última chamada, zerados em seguida
+    def pop_stats(self):
+        with self.lock:
+            stats = { "stages": self.timers, "counters": self.counters }
+            self.timers   = {}
+            self.counters = {}
+        return stats
+
+    def merge_stats(self, stats):
+        with self.lock:
+            for name, timer in stats["stages"].items():
+                merged = self.timers.setdefault(name, { "calls": 0, "seconds": 0.0, "max_seconds": 0.0 })
+                merged["calls"]      += timer["calls"]
+                merged["seconds"]    += timer["seconds"]
+                merged["max_seconds"] = max(merged["max_seconds"], timer["max_seconds"])
+            for name, value in stats["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    # PROFILING
+
+    # só o estágio mais externo é perfilado, os profilers não podem ser aninhados
+    def start_profiler(self):
+        with self.lock:
+            if self.profiling:
+                return None
+            self.profiling = True
+        if self.profile == 'pyinstrument':
+            # dependência opcional, só importada quando pedida
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop_profiler(self, name, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        file_name = name.replace('/', '_').replace(' ', '_')
+        if self.profile == 'pyinstrument':
+            profiler.stop()
+            path = os.path.join(self.profile_dir, f'{file_name}.html')
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+            top = profiler.output_text()
+        else:
+            profiler.disable()
+            path = os.path.join(self.profile_dir, f'{file_name}.prof')
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+            top = out.getvalue()
+        with self.lock:
+            self.profiles[name] = path
+            self.profiling = False
+        log_debug(lambda: f'profile of {name}:\n{top}')
+
+    # RESUMO DA EXECUÇÃO
+
+    def summary(self):
+        with self.lock:
+            return {
+                "started_at": datetime.datetime.utcfromtimestamp(self.started).isoformat(),
+                "wall_seconds": time.time() - self.started,
+                "stages": { name: dict(timer) for name, timer in self.timers.items() },
+                "counters": dict(self.counters),
+                "profiles": dict(self.profiles)
+            }
+
+    def print_summary(self):
+        summary = self.summary()
+        print('-'*50)
+        print(f'run summary ({summary["wall_seconds"]:.2f}s):')
+        for name, timer in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            print(f'  {name}: {timer["seconds"]:.3f}s in {timer["calls"]} calls (max {timer["max_seconds"]:.3f}s)')
+        for name, value in sorted(summary["counters"].items()):
+            print(f'  {name}: {value}')
+        for name, path in summary["profiles"].items():
+            print(f'  profile of {name}: {path}')
+
+    def write_summary(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+# decorator que cronometra cada chamada de fn em stage_fn(nome), por padrão o __qualname__ de fn
+def timed_stage(stage_fn, name=None):
+    def decorator(fn):
+        stage_name = name or fn.__qualname__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_fn(stage_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# registro padrão do processo, usado pelos atalhos abaixo
+instrumentation = Instrumentation()
+
+def configure_instrumentation(profile=None, profile_stages=None, profile_dir='profiles'):
+    global instrumentation
+    instrumentation = Instrumentation(profile=profile, profile_stages=profile_stages, profile_dir=profile_dir)
+    return instrumentation
+
+def stage(name):
+    return instrumentation.stage(name)
+
+# usa o registro vigente na hora da chamada, mesmo depois de configure_instrumentation
+def timed(name=None):
+    return timed_stage(stage, name)
+
+def count(name, value=1):
+    instrumentation.count(name, value)
+
+def pop_stats():
+    return instrumentation.pop_stats()
+
+def merge_stats(stats):
+    instrumentation.merge_stats(stats)
+
+def summary():
+    return instrumentation.summary()
+
+def print_summary():
+    instrumentation.print_summary()
+
+def write_summary(path):
+    instrumentation.write_summary(path)
@@ -0,0 +1,54 @@
+import json
+import pymongo
+from time import time
+
+from bulk_writer import BulkWriter
+from bug_collection import ensure_bug_indexes, upsert_bugs, print_query_plans
+from preprocess_bug_reports_from_bugzilla_and_saves_json import iter_json_array
+
+# CARGA DOS BUG REPORTS TRATADOS NA COLLECTION BUG
+# lê a saída de preprocess_bug_reports_from_bugzilla_and_saves_json.py (array .json
+# ou .ndjson) em streaming, faz upsert em lote por bg_number, cria os índices usados
+# pelos outros scripts e imprime os planos de execução das consultas principais.
+
+LOAD_BATCH_SIZE = 1000
+
+def iter_bugs_from_file(input_path):
+    with open(input_path) as input_file:
+        if input_path.endswith('.ndjson'):
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(input_file)
+
+def load_bugs_into_mongo(db, input_paths, batch_size=LOAD_BATCH_SIZE):
+    # índices antes da carga: o unique em bg_number atende o filtro de cada upsert
+    print('criando índices da collection bug...')
+    ensure_bug_indexes(db)
+
+    total = 0
+    with BulkWriter(db["bug"], batch_size=batch_size) as bugs_writer:
+        for input_path in input_paths:
+            time_a = time()
+            loaded = upsert_bugs(bugs_writer, iter_bugs_from_file(input_path))
+            total += loaded
+            print(f'{input_path}: {loaded} bugs in {time() - time_a:.2f}s')
+    return total
+
+def main():
+    MONGO_URL = "mongodb://localhost:27017/"
+    MONGO_DATABASE = "bug_report_colab"
+    INPUT_PATHS = ["data/bug_reports_new_columns_no_history_field_2009_2012_nextbug.ndjson"]
+
+    db = pymongo.MongoClient(MONGO_URL)[MONGO_DATABASE]
+
+    total_time_a = time()
+    total = load_bugs_into_mongo(db, INPUT_PATHS)
+    print(f'Total time to upsert {total} bugs: {time() - total_time_a:.2f}s')
+
+    print('planos de execução das consultas:')
+    print_query_plans(db)
+
+if __name__ == '__main__':
+    main()
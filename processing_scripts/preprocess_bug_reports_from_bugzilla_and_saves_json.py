@@ -1,4 +1,11 @@
+import os
 import json
+import pymongo
+import multiprocessing
+from time import time
+
+from bulk_writer import BulkWriter
+from bug_collection import ensure_bug_indexes, upsert_bugs
 
 def is_change_to_bug_resolved(change):
   return (change["field_name"] == "status" and change["added"] == "RESOLVED")
@@ -47,24 +54,127 @@ def retrieve_when_assigned_to_final_dev(bug):
         return when_modified
   return creation_date
 
-# Bug reports crus baixados do Bugzilla
-with open('data/bug_reports_base_2009_2012_nextbug.json') as input:
-  raw_bugs = json.load(input)
-
-# atribui 2 colunas novas
-for bug in raw_bugs:
+# TRANSFORMAÇÕES DE UM BUG, EM UMA PASSADA
+# atribui 2 colunas novas, remove campo de histórico e cria campo bg_number
+def transform_bug(bug):
   bug["when_changed_to_resolved"] = retrieve_resolved_date(bug)
   bug["when_final_change_assigned_to"] = retrieve_when_assigned_to_final_dev(bug)
-
-# remove campo de histórico
-for bug in raw_bugs:
   bug.pop("history")
-
-# cria campo _id
-for bug in raw_bugs:
   bug["bg_number"] = bug["id"]
   bug.pop("id")
-
-# salva json tratado
-with open("data/bug_reports_new_columns_no_history_field_2009_2012_nextbug.json", "w") as outfile:
-  json.dump(raw_bugs, outfile)
+  return bug
+
+# LEITURA INCREMENTAL DO ARRAY JSON
+# lê o arquivo em blocos e decodifica um bug por vez com raw_decode, sem carregar o array inteiro
+def iter_json_array(input_file, read_size=1 << 20):
+  decoder = json.JSONDecoder()
+  buffer = ''
+  pos = 0
+  started = False
+  eof = False
+
+  while True:
+    while True:
+      while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ',')):
+        pos += 1
+      if pos >= len(buffer):
+        break
+
+      if not started:
+        if buffer[pos] != '[':
+          raise ValueError(f'expected a JSON array, found {buffer[pos]!r}')
+        started = True
+        pos += 1
+        continue
+
+      if buffer[pos] == ']':
+        return
+
+      try:
+        bug, end = decoder.raw_decode(buffer, pos)
+      except json.JSONDecodeError:
+        if eof:
+          raise
+        break # bug incompleto no buffer, lê mais um bloco
+      yield bug
+      pos = end
+
+    if eof:
+      raise ValueError('unexpected end of JSON array')
+    chunk = input_file.read(read_size)
+    eof = (chunk == '')
+    buffer = buffer[pos:] + chunk
+    pos = 0
+
+# SAÍDAS: NDJSON (um bug por linha) OU UPSERT DIRETO NO MONGO EM LOTES
+
+def process_file(input_path, output_path=None, mongo_url=None, mongo_database=None, batch_size=1000):
+  time_a = time()
+  total = 0
+
+  with open(input_path) as input_file:
+    bugs = (transform_bug(bug) for bug in iter_json_array(input_file))
+
+    if mongo_url is not None:
+      client = pymongo.MongoClient(mongo_url)
+      # upsert por bg_number, com o índice unique já criado; as datas viram datetime
+      # (parse_bug_dates) para casar com os filtros de data dos outros scripts.
+      # O NDJSON mantém as strings ISO e é convertido na carga (load_bug_reports_into_mongo)
+      ensure_bug_indexes(client[mongo_database])
+      with BulkWriter(client[mongo_database]["bug"], batch_size=batch_size) as bugs_writer:
+        total = upsert_bugs(bugs_writer, bugs)
+      client.close()
+    else:
+      with open(output_path, "w") as outfile:
+        for bug in bugs:
+          outfile.write(json.dumps(bug))
+          outfile.write("\n")
+          total += 1
+
+  print(f'{input_path}: {total} bugs in {time() - time_a:.2f}s')
+  return total
+
+def process_file_args(args):
+  return process_file(*args)
+
+# um processo por arquivo de entrada (dump dividido em shards)
+def process_shards(input_paths, output_dir=None, mongo_url=None, mongo_database=None, workers=None, batch_size=1000):
+  args = []
+  for input_path in input_paths:
+    output_path = None
+    if output_dir is not None:
+      output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(input_path))[0] + '.ndjson')
+    args.append((input_path, output_path, mongo_url, mongo_database, batch_size))
+
+  with multiprocessing.Pool(processes=workers or min(len(args), os.cpu_count())) as pool:
+    total = sum(pool.imap_unordered(process_file_args, args))
+
+  print(f'total: {total} bugs from {len(input_paths)} files')
+  return total
+
+# MODO ORIGINAL: carrega o array inteiro e salva um único json
+def process_whole_file(input_path, output_path):
+  # Bug reports crus baixados do Bugzilla
+  with open(input_path) as input:
+    raw_bugs = json.load(input)
+
+  for bug in raw_bugs:
+    transform_bug(bug)
+
+  # salva json tratado
+  with open(output_path, "w") as outfile:
+    json.dump(raw_bugs, outfile)
+
+if __name__ == '__main__':
+  INPUT_PATH = 'data/bug_reports_base_2009_2012_nextbug.json'
+  STREAMING = True
+  SHARDS = [] # ex: ['data/bugs_part_1.json', 'data/bugs_part_2.json'] processa em paralelo
+  MONGO_URL = None # ex: "mongodb://localhost:27017/" faz upsert direto na collection bug em vez de gerar arquivo
+  MONGO_DATABASE = "bug_report_colab"
+
+  if len(SHARDS) > 0:
+    process_shards(SHARDS, output_dir='data', mongo_url=MONGO_URL, mongo_database=MONGO_DATABASE)
+  elif STREAMING:
+    process_file(INPUT_PATH, "data/bug_reports_new_columns_no_history_field_2009_2012_nextbug.ndjson", mongo_url=MONGO_URL, mongo_database=MONGO_DATABASE)
+  else:
+    process_whole_file(INPUT_PATH, "data/bug_reports_new_columns_no_history_field_2009_2012_nextbug.json")
@@ -0,0 +1,95 @@
+import os
+import pickle
+import string
+import hashlib
+import multiprocessing
+import nltk
+from tqdm import tqdm
+from nltk import word_tokenize
+from nltk.corpus import stopwords
+
+from instrumentation import count, log_debug
+
+# PRÉ-PROCESSAMENTO DAS DESCRIÇÕES
+# módulo separado (sem sentence_transformers/pymongo) para ser leve de importar
+# nos processos do pool
+
+PREPROCESSING_CACHE_PATH = 'preprocessing_cache.pkl'
+
+stop_words = None
+
+# dados do nltk usados por pre_process; download só baixa na primeira vez
+def download_nltk_data():
+    print('baixando stopwords e pontuação...')
+    nltk.download('stopwords')
+    nltk.download('punkt')
+
+def get_stop_words():
+    # monta o conjunto de stopwords + pontuação só uma vez por processo
+    global stop_words
+    if stop_words is None:
+        stop_words = frozenset(stopwords.words('english') + list(string.punctuation))
+    return stop_words
+
+def pre_process(text):
+    # remove stopwords and punctuation
+    stop = get_stop_words()
+    return " ".join([w for w in word_tokenize((text or '').lower()) if w not in stop])
+
+def description_hash(text):
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+
+# CACHE EM DISCO: bg_number -> (hash da descrição, descrição pré-processada)
+
+def load_preprocessing_cache(cache_path):
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, 'rb') as f:
+        return pickle.load(f)
+
+def save_preprocessing_cache(cache, cache_path):
+    tmp_path = f'{cache_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+# devolve { bg_number: descrição pré-processada } para todos os bugs;
+# só passam pelo pool os bugs sem cache ou com descrição alterada.
+# pool permite reaproveitar o mesmo pool entre chamadas (ex: vetorização em streaming)
+def pre_process_corpus(bugs, cache_path=PREPROCESSING_CACHE_PATH, workers=None, chunksize=256, pool=None):
+    cache = load_preprocessing_cache(cache_path)
+
+    preprocessed = {}
+    pending_ids, pending_texts, pending_hashes = [], [], []
+    for b in bugs:
+        text_hash = description_hash(b["description"])
+        cached = cache.get(b["bg_number"])
+        if cached is not None and cached[0] == text_hash:
+            preprocessed[b["bg_number"]] = cached[1]
+        else:
+            pending_ids.append(b["bg_number"])
+            pending_texts.append(b["description"])
+            pending_hashes.append(text_hash)
+
+    log_debug(lambda: f'preprocessing: {len(preprocessed)} from cache, {len(pending_texts)} to process...')
+    count('preprocessing_cache_hits', len(preprocessed))
+    count('docs_preprocessed', len(pending_texts))
+
+    if len(pending_texts) > 0:
+        workers = workers or os.cpu_count()
+        if pool is not None:
+            pp_texts = pool.map(pre_process, pending_texts, chunksize=chunksize)
+        elif workers > 1:
+            with multiprocessing.Pool(processes=workers) as pool:
+                pp_texts = list(tqdm(pool.imap(pre_process, pending_texts, chunksize=chunksize), total=len(pending_texts)))
+        else:
+            pp_texts = [pre_process(text) for text in tqdm(pending_texts)]
+
+        for bug_id, text_hash, pp_text in zip(pending_ids, pending_hashes, pp_texts):
+            preprocessed[bug_id] = pp_text
+            cache[bug_id] = (text_hash, pp_text)
+
+        if cache_path is not None:
+            save_preprocessing_cache(cache, cache_path)
+
+    return preprocessed
@@ -0,0 +1,165 @@
+import sys
+import threading
+import collections
+import numpy as np
+from scipy.sparse import issparse
+
+# CACHE LRU DAS RECOMENDAÇÕES
+# limite por memória (bytes estimados) com despejo do menos usado recentemente.
+# CachedRecommender fica na frente de qualquer recomendador com get_recommendations:
+# guarda o ranking de maior K já pedido por (bg_number, versão) e responde um K
+# menor fatiando esse ranking. O OnlineRecommender do serviço também usa o cache
+# para os vetores das queries e os scores base dos candidatos.
+
+RECOMMENDATION_CACHE_BYTES = 256 * 1024 * 1024
+
+# tamanho aproximado em bytes; objetos compartilhados entre entradas são contados em cada uma
+def estimate_size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if issparse(value):
+        return sum(getattr(value, attr).nbytes for attr in ["data", "indices", "indptr"] if hasattr(value, attr)) + 112
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+class LRUCache():
+    def __init__(self, max_bytes=RECOMMENDATION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock      = threading.Lock()
+        self.entries   = collections.OrderedDict()
+        self.bytes     = 0
+
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        size = estimate_size(value) if size is None else size
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            # entrada maior que o cache inteiro não é guardada
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes
+            }
+
+def print_cache_stats(name, stats):
+    print(f'{name} cache: {stats["hits"]} hits, {stats["misses"]} misses (hit rate {stats["hit_rate"]:.2%}), '
+          f'{stats["evictions"]} evictions, {stats["entries"]} entries, {stats["bytes"] / 1024 / 1024:.1f}MB of {stats["max_bytes"] / 1024 / 1024:.1f}MB')
+
+class CachedRecommender():
+    # min_k: K mínimo pedido ao recomendador em um miss, para que Ks menores seguintes saiam do cache
+    def __init__(self, recommender, max_bytes=RECOMMENDATION_CACHE_BYTES, min_k=None):
+        self.recommender = recommender
+        self.min_k       = min_k
+        self.rankings    = LRUCache(max_bytes)
+        # um ranking guardado com K menor que o pedido conta como miss
+        self.lock   = threading.Lock()
+        self.hits   = 0
+        self.misses = 0
+
+    # ranking guardado para a chave, se servir para K; conta o hit ou o miss
+    def cached_ranking(self, key, K):
+        cached = self.rankings.get(key)
+        # o ranking guardado serve se foi pedido com K maior ou se já veio com menos itens que o pedido
+        if cached is not None:
+            cached_k, recommendations = cached
+            if K <= cached_k or len(recommendations) < cached_k:
+                with self.lock:
+                    self.hits += 1
+                return recommendations[:K]
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def get_recommendations(self, query, K, similarity_score_type):
+        bg_number = query.get("bg_number")
+        if bg_number is None:
+            return self.recommender.get_recommendations(query, K, similarity_score_type)
+
+        key = (bg_number, similarity_score_type)
+        recommendations = self.cached_ranking(key, K)
+        if recommendations is not None:
+            return recommendations
+
+        requested_k = max(K, self.min_k or K)
+        recommendations = self.recommender.get_recommendations(query=query, K=requested_k, similarity_score_type=similarity_score_type)
+        self.rankings.put(key, (requested_k, recommendations))
+        return recommendations[:K]
+
+    # as versões que faltam no cache saem de uma única chamada fundida, se o recomendador tiver;
+    # senão, uma chamada por versão
+    def get_recommendations_all_versions(self, query, K, similarity_score_types):
+        bg_number = query.get("bg_number")
+        if bg_number is None or not hasattr(self.recommender, 'get_recommendations_all_versions'):
+            return { version: self.get_recommendations(query, K, version) for version in similarity_score_types }
+
+        all_recommendations = {}
+        missing = []
+        for version in similarity_score_types:
+            recommendations = self.cached_ranking((bg_number, version), K)
+            if recommendations is None:
+                missing.append(version)
+            else:
+                all_recommendations[version] = recommendations
+
+        if len(missing) > 0:
+            requested_k = max(K, self.min_k or K)
+            computed = self.recommender.get_recommendations_all_versions(query=query, K=requested_k, similarity_score_types=missing)
+            for version in missing:
+                self.rankings.put((bg_number, version), (requested_k, computed[version]))
+                all_recommendations[version] = computed[version][:K]
+
+        return { version: all_recommendations[version] for version in similarity_score_types }
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            **self.rankings.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0.0
+        }
+
+    def print_stats(self):
+        print_cache_stats('recommendations', self.stats())
@@ -0,0 +1,362 @@
+import os
+import json
+import pymongo
+import time
+import logging
+import datetime
+import threading
+import collections
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from preprocessing import pre_process, description_hash, download_nltk_data
+from generate_vectorizations_and_update_db import TfidfVectorizer, BertVectorizer, TFIDF_VECTORIZER_PATH
+from candidate_index import CandidateIndex
+from vector_store import VectorStore
+from arc_graph import SCORE_VERSIONS, ITEM_FIELDS, ScoreFusion
+from instrumentation import configure_logging, log_debug
+from recommendation_cache import LRUCache, RECOMMENDATION_CACHE_BYTES, print_cache_stats
+from bug_collection import parse_bug_date
+
+# SERVIÇO DE RECOMENDAÇÃO
+# processo de longa duração: índice de candidatos (vetores + metadados) e os
+# vetorizadores tfidf/bert são carregados uma vez na subida; cada requisição só
+# codifica o texto do bug recebido e pontua os candidatos em memória.
+# Bug sem creation_time é um bug novo: os candidatos são todos os bugs do mesmo
+# produto/componente (live_candidate_rows); com creation_time vale o mesmo filtro
+# da avaliação offline (criados antes e ainda abertos naquele momento).
+# Com um índice ANN (ANN_TOP_K) só os ANN_TOP_K candidatos mais próximos por embeddings
+# são pontuados, em vez de todos; as versões só tfidf passam a ranquear essa lista curta.
+# Mesma interface get_recommendations(query, K, similarity_score_type) do recomendador.
+#
+#   POST /recommendations            {"bug": {...}, "K": 10, "similarity_score_type": "categoric_tfidf_we"}
+#                                    com "similarity_score_types": [...] devolve as recomendações de cada versão
+#   GET  /recommendations/<bg_number>?K=10&similarity_score_type=categoric_tfidf_we
+#   GET  /latency                    p50/p99 das últimas requisições
+#   GET  /cache                      hits/misses do cache de vetores e scores
+#   GET  /health
+
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8080
+DEFAULT_K = 10
+DEFAULT_SIMILARITY_SCORE_TYPE = 'categoric_tfidf_we'
+LATENCY_WINDOW = 10000
+
+# None para bug recém-aberto, sem data
+def parse_creation_time(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    return parse_bug_date(str(value))
+
+class LatencyTracker():
+    # janela das últimas `window` latências, em ms
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.total = 0
+
+    def add(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds * 1000)
+            self.total += 1
+
+    def percentiles(self):
+        with self.lock:
+            latencies = np.asarray(self.latencies, dtype=np.float64)
+            total = self.total
+        if len(latencies) == 0:
+            return { "requests": total, "window": 0, "p50_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None }
+        return {
+            "requests": total,
+            "window": int(len(latencies)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "mean_ms": float(latencies.mean()),
+            "max_ms": float(latencies.max())
+        }
+
+# campos devolvidos em "item" de cada recomendação, por bg_number (bg_numbers=None carrega todos)
+def load_items(db, bg_numbers=None):
+    bg_numbers = set(bg_numbers) if bg_numbers is not None else None
+    return { b["bg_number"]: b for b in db["bug"].find({}, ITEM_FIELDS) if bg_numbers is None or b["bg_number"] in bg_numbers }
+
+class OnlineRecommender():
+    # cache: LRUCache para os vetores e scores base de queries com bg_number (None = sem cache)
+    def __init__(self, candidate_index, items, tfidf_vectorizer, bert_vectorizer, versions=SCORE_VERSIONS, cache=None):
+        self.candidate_index  = candidate_index
+        self.items            = items
+        self.tfidf_vectorizer = tfidf_vectorizer
+        self.bert_vectorizer  = bert_vectorizer
+        self.versions         = versions
+        self.fusion           = ScoreFusion(versions)
+        self.cache            = cache
+        # o modelo bert é compartilhado entre as threads do servidor
+        self.encode_lock = threading.Lock()
+
+    # index_options: embeddings_precision/tfidf_dtype/rerank_k do CandidateIndex.
+    # ann_top_k: pontua só os ann_top_k vizinhos do índice IVF em ann_index_path (montado e salvo se não existir)
+    @classmethod
+    def load(cls, db, tfidf_vectorizer_path=TFIDF_VECTORIZER_PATH, vector_store=None, bert_vectorizer=None, cache_bytes=RECOMMENDATION_CACHE_BYTES,
+             ann_index_path=None, ann_top_k=None, **index_options):
+        print('loading candidate index...')
+        candidate_index = CandidateIndex.load_from_mongo(db, vector_store=vector_store, **index_options)
+        print(f'candidate index with {len(candidate_index)} bugs ({candidate_index.engine.memory_usage()})')
+
+        if ann_top_k is not None:
+            if ann_index_path is not None and os.path.exists(ann_index_path):
+                print(f'loading ann index from {ann_index_path}...')
+                ann_index = candidate_index.load_ann_index(ann_index_path)
+            else:
+                print('building ann index...')
+                ann_index = candidate_index.build_ann_index()
+                if ann_index_path is not None:
+                    ann_index.save(ann_index_path)
+            candidate_index.use_ann_index(ann_index, ann_top_k)
+
+        items = load_items(db, candidate_index.bg_numbers)
+
+        tfidf_vectorizer = TfidfVectorizer.load(tfidf_vectorizer_path)
+        bert_vectorizer  = bert_vectorizer or BertVectorizer()
+        cache = LRUCache(cache_bytes) if cache_bytes is not None else None
+        return cls(candidate_index, items, tfidf_vectorizer, bert_vectorizer, cache=cache)
+
+    # bugs que já estão no índice reaproveitam os vetores; os novos só têm o próprio texto codificado
+    def encode(self, bug):
+        if "tfidf_vector" in bug and "embeddings_vector" in bug:
+            return bug
+        tfidf_vector = self.tfidf_vectorizer.transform(pre_process(bug.get("description")))
+        with self.encode_lock:
+            embeddings_vector = self.bert_vectorizer.transform([bug.get("description") or ''])[0]
+        return { **bug, "tfidf_vector": tfidf_vector, "embeddings_vector": np.asarray(embeddings_vector, dtype=np.float32) }
+
+    def get_recommendations(self, query, K, similarity_score_type):
+        return self.get_recommendations_all_versions(query, K, [similarity_score_type])[similarity_score_type]
+
+    # scores base calculados uma vez e todas as versões pedidas (None = todas) fundidas na mesma passada
+    def get_recommendations_all_versions(self, query, K, similarity_score_types=None):
+        similarity_score_types = self.fusion.check_versions(similarity_score_types)
+
+        rows, tfidf_scores, we_scores, categoric_scores = self.base_scores(query)
+        ranked = self.fusion.top_n(tfidf_scores, we_scores, categoric_scores, K, similarity_score_types)
+
+        bg_numbers = self.candidate_index.bg_numbers
+        all_recommendations = {}
+        for version, (order, scores) in ranked.items():
+            recommendations = []
+            for i in order.tolist():
+                bg_number = int(bg_numbers[rows[i]])
+                if bg_number == query.get("bg_number") or bg_number not in self.items:
+                    continue
+                recommendations.append({
+                    "item": self.items[bg_number],
+                    "score": float(scores[i]),
+                    "cos_similarity_tfidf": float(tfidf_scores[i]),
+                    "cos_similarity_word_embeddings": float(we_scores[i])
+                })
+            all_recommendations[version] = recommendations
+        return all_recommendations
+
+    # chave de cache de uma query: bg_number mais os campos que mudam o resultado, então um bug
+    # enviado de novo com descrição/produto/componente/creation_time alterados não reaproveita
+    # a entrada antiga. A descrição entra pelo hash (preprocessing.description_hash)
+    def cache_key(self, kind, query):
+        if query.get("bg_number") is None:
+            return None
+        if kind == 'vectors':
+            return (kind, query["bg_number"], description_hash(query.get("description")))
+        return (
+            kind,
+            query["bg_number"],
+            description_hash(query.get("description")),
+            query.get("product"),
+            query.get("component"),
+            str(query.get("creation_time"))
+        )
+
+    # candidatos e os três scores base, que servem a todas as versões e a qualquer K.
+    # Com bg_number ficam no cache: o mesmo bug é consultado de novo com outros K/versões
+    def base_scores(self, query):
+        key = self.cache_key('scores', query)
+        if self.cache is not None and key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        query = self.resolve_known_bug(query)
+        query = self.query_vectors({ **query, "creation_time": parse_creation_time(query.get("creation_time")) })
+        if query["creation_time"] is None:
+            rows = self.candidate_index.live_candidate_rows(query)
+        else:
+            rows = self.candidate_index.candidate_rows(query)
+        rows = self.candidate_index.shortlist_rows(query, rows)
+        scored = (rows, *self.candidate_index.engine.score(query, rows))
+
+        if self.cache is not None and key is not None:
+            self.cache.put(key, scored)
+        return scored
+
+    def query_vectors(self, query):
+        key = self.cache_key('vectors', query)
+        if self.cache is None or key is None or ("tfidf_vector" in query and "embeddings_vector" in query):
+            return self.encode(query)
+
+        cached = self.cache.get(key)
+        if cached is None:
+            encoded = self.encode(query)
+            cached = (encoded["tfidf_vector"], encoded["embeddings_vector"])
+            self.cache.put(key, cached)
+        return { **query, "tfidf_vector": cached[0], "embeddings_vector": cached[1] }
+
+    # query de um bug já carregado no índice, pelo bg_number
+    def known_bug(self, bg_number):
+        return self.candidate_index.bug(bg_number)
+
+    # queries só com bg_number (ex: a amostra do evaluate.py traz bg_number/summary/assigned_to)
+    # completam metadados e vetores com os do índice
+    def resolve_known_bug(self, query):
+        bg_number = query.get("bg_number")
+        if bg_number is None or "description" in query or "embeddings_vector" in query:
+            return query
+        try:
+            return { **self.known_bug(bg_number), **query }
+        except KeyError:
+            return query
+
+# HTTP
+# parâmetros inválidos viram ValueError, respondido com 400
+
+def parse_k(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'K must be a positive integer, got {value!r}')
+    try:
+        K = int(value)
+    except ValueError:
+        raise ValueError(f'K must be a positive integer, got {value!r}')
+    if K < 1:
+        raise ValueError(f'K must be a positive integer, got {value!r}')
+    return K
+
+def parse_similarity_score_type(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list) and len(value) > 0 and all(isinstance(v, str) for v in value):
+        return value
+    raise ValueError(f'similarity_score_type must be a string or a non-empty list of strings, got {value!r}')
+# ThreadingHTTPServer atende cada requisição em uma thread; o estado carregado é somente leitura
+
+class RecommendationRequestHandler(BaseHTTPRequestHandler):
+    recommender = None
+    latency_tracker = None
+
+    def log_message(self, format, *args):
+        log_debug(lambda: format % args)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # similarity_score_type em lista: recomendações de cada versão, em uma única passada
+    def recommend(self, query, K, similarity_score_type):
+        time_a = time.perf_counter()
+        try:
+            if isinstance(similarity_score_type, list):
+                recommendations = self.recommender.get_recommendations_all_versions(query, K, similarity_score_type)
+            else:
+                recommendations = self.recommender.get_recommendations(query, K, similarity_score_type)
+        except (ValueError, KeyError) as e:
+            self.send_json(400, { "error": str(e) })
+            return
+        elapsed = time.perf_counter() - time_a
+        self.latency_tracker.add(elapsed)
+        self.send_json(200, { "recommendations": recommendations, "latency_ms": elapsed * 1000 })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/health':
+            self.send_json(200, { "status": "ok", "bugs": len(self.recommender.candidate_index) })
+        elif url.path == '/latency':
+            self.send_json(200, self.latency_tracker.percentiles())
+        elif url.path == '/cache':
+            self.send_json(200, self.recommender.cache.stats() if self.recommender.cache is not None else {})
+        elif url.path.startswith('/recommendations/'):
+            try:
+                query = self.recommender.known_bug(int(url.path.rsplit('/', 1)[1]))
+            except (ValueError, KeyError):
+                self.send_json(404, { "error": f'bug not found: {url.path}' })
+                return
+            try:
+                K = parse_k(params.get('K', [DEFAULT_K])[0])
+            except ValueError as e:
+                self.send_json(400, { "error": str(e) })
+                return
+            self.recommend(query, K, params.get('similarity_score_type', [DEFAULT_SIMILARITY_SCORE_TYPE])[0])
+        else:
+            self.send_json(404, { "error": f'unknown path {url.path}' })
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/recommendations':
+            self.send_json(404, { "error": f'unknown path {self.path}' })
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as e:
+            self.send_json(400, { "error": f'invalid json: {e}' })
+            return
+        try:
+            if not isinstance(body, dict) or not isinstance(body.get("bug"), dict):
+                raise ValueError('body must be a json object with a "bug" object')
+            K = parse_k(body.get("K", DEFAULT_K))
+            similarity_score_type = parse_similarity_score_type(body.get("similarity_score_types", body.get("similarity_score_type", DEFAULT_SIMILARITY_SCORE_TYPE)))
+        except ValueError as e:
+            self.send_json(400, { "error": str(e) })
+            return
+        self.recommend(body["bug"], K, similarity_score_type)
+
+def create_server(recommender, host=SERVICE_HOST, port=SERVICE_PORT, latency_window=LATENCY_WINDOW):
+    handler = type('Handler', (RecommendationRequestHandler,), {
+        "recommender": recommender,
+        "latency_tracker": LatencyTracker(latency_window)
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    MONGO_URL = "mongodb://localhost:27017/"
+    MONGO_DATABASE = "bug_report_colab"
+    VECTOR_STORE_PATH = None # ex: 'vector_store/' lê os vetores do store em vez dos pickles no mongo
+    EMBEDDINGS_PRECISION = 'float32' # 'float16' ou 'int8': embeddings compactos em memória
+    TFIDF_DTYPE = 'float64' # 'float32' corta pela metade os valores da matriz tfidf
+    RERANK_K = 200 # com precisão reduzida, re-ranking em float32 dos RERANK_K melhores (lidos do vector store)
+    ANN_TOP_K = None # ex: 1000 pontua só os 1000 candidatos mais próximos pelo índice IVF, em vez de todos
+    ANN_INDEX_PATH = 'ann_index.npz'
+
+    configure_logging(logging.INFO)
+    download_nltk_data()
+    db = pymongo.MongoClient(MONGO_URL)[MONGO_DATABASE]
+    vector_store = VectorStore(VECTOR_STORE_PATH) if VECTOR_STORE_PATH is not None else None
+
+    time_a = time.time()
+    recommender = OnlineRecommender.load(db, vector_store=vector_store, ann_index_path=ANN_INDEX_PATH, ann_top_k=ANN_TOP_K,
+                                         embeddings_precision=EMBEDDINGS_PRECISION, tfidf_dtype=TFIDF_DTYPE, rerank_k=RERANK_K)
+    print(f'recommender loaded in {time.time() - time_a:.2f}s')
+
+    server = create_server(recommender)
+    print(f'serving recommendations on http://{SERVICE_HOST}:{SERVICE_PORT}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if recommender.cache is not None:
+            print_cache_stats('vectors/scores', recommender.cache.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import collections
+import numpy as np
+
+from vector_store import vectors_filter, vectors_projection, load_bug_vectors, pickled_vectors_size
+from instrumentation import count
+
+# SELEÇÃO DA AMOSTRA SEM MATERIALIZAR OS VETORES
+# a amostra sai de uma única leitura só com os campos leves (projeção); os vetores
+# de cada query são carregados depois, no chunk em que ela é processada.
+# Com strata (ex: ['year', 'product']) a amostra é estratificada: o tamanho de cada
+# estrato vem de uma agregação no mongo, a cota é proporcional ao tamanho (maiores
+# restos) e a seleção é sequencial (algoritmo S de Knuth): cada documento entra com
+# probabilidade (cota que falta) / (documentos que faltam no estrato).
+
+STRATA_FIELDS = ['year', 'product', 'component']
+
+SAMPLE_FIELDS = {
+    "_id": False,
+    "bg_number": True,
+    "product": True,
+    "component": True,
+    "creation_time": True,
+    "when_changed_to_resolved": True
+}
+
+def sample_filter(time_scope, vector_store=None):
+    return {
+        **vectors_filter(vector_store),
+        "creation_time": {
+            "$lt": time_scope["creation_time_end"],
+            "$gt": time_scope["creation_time_start"]
+        },
+        "sample_set": {
+            "$exists": False
+        }
+    }
+
+def stratum_of(bug, strata):
+    return tuple(bug["creation_time"].year if field == 'year' else bug.get(field) for field in strata)
+
+# tamanho de cada estrato; sem strata, um único estrato () com o total
+def stratum_counts(db, match, strata):
+    if len(strata) == 0:
+        return { (): db["bug"].count_documents(match) }
+
+    group_id = { field: { "$year": "$creation_time" } if field == 'year' else f'${field}' for field in strata }
+    counts = {}
+    for row in db["bug"].aggregate([{ "$match": match }, { "$group": { "_id": group_id, "count": { "$sum": 1 } } }]):
+        counts[tuple(row["_id"].get(field) for field in strata)] = row["count"]
+    return counts
+
+# cota proporcional de cada estrato, somando qty (ou tudo, se a população for menor)
+def allocate_sample(counts, qty):
+    total = sum(counts.values())
+    if total <= qty:
+        return dict(counts)
+
+    quotas     = { stratum: qty * n / total for stratum, n in counts.items() }
+    allocation = { stratum: int(quota) for stratum, quota in quotas.items() }
+    remaining  = qty - sum(allocation.values())
+    by_remainder = sorted(quotas, key=lambda stratum: (allocation[stratum] - quotas[stratum], str(stratum)))
+    for stratum in by_remainder[:remaining]:
+        allocation[stratum] += 1
+    return allocation
+
+def select_sample(db, qty, time_scope, vector_store=None, strata=None, seed=None):
+    strata = list(strata or [])
+    unknown = [ field for field in strata if field not in STRATA_FIELDS ]
+    if len(unknown) > 0:
+        raise ValueError(f'strata must be in {STRATA_FIELDS}, got {unknown}')
+
+    match = sample_filter(time_scope, vector_store)
+    counts = stratum_counts(db, match, strata)
+    allocation = allocate_sample(counts, qty)
+
+    rng = np.random.default_rng(seed)
+    seen     = collections.Counter()
+    selected = collections.Counter()
+    sample   = []
+    for bug in db["bug"].find(match, SAMPLE_FIELDS):
+        stratum = stratum_of(bug, strata)
+        # documentos criados depois da contagem deixam remaining <= 0 e entram enquanto faltar cota
+        remaining = counts.get(stratum, 0) - seen[stratum]
+        seen[stratum] += 1
+        missing = allocation.get(stratum, 0) - selected[stratum]
+        if missing > 0 and rng.random() * remaining < missing:
+            sample.append(bug)
+            selected[stratum] += 1
+
+    count('sample_documents_scanned', sum(seen.values()))
+    # a leitura vem na ordem do mongo; embaralhada, qualquer prefixo/chunk da amostra é aleatório
+    return [ sample[i] for i in rng.permutation(len(sample)) ]
+
+def sample_distribution(sample_bugs):
+    return {
+        "years": dict(collections.Counter(b["creation_time"].year for b in sample_bugs)),
+        "products": dict(collections.Counter(b["product"] for b in sample_bugs)),
+        "components": dict(collections.Counter(b["component"] for b in sample_bugs))
+    }
+
+# VETORES DE UM CHUNK DA AMOSTRA
+# uma ida ao mongo por chunk (ou leitura do mmap com vector_store); a amostra leve não é alterada
+
+def load_sample_vectors(db, sample_bugs, vector_store=None):
+    if vector_store is not None:
+        return [ load_bug_vectors(dict(b), vector_store) for b in sample_bugs ]
+
+    vectors = {
+        v["bg_number"]: v for v in db["bug"].find(
+            { "bg_number": { "$in": [ b["bg_number"] for b in sample_bugs ] } },
+            { "_id": False, "bg_number": True, **vectors_projection() }
+        )
+    }
+    count('mongo_queries')
+    count('bytes_deserialized', sum(pickled_vectors_size(v) for v in vectors.values()))
+    return [ load_bug_vectors({ **b, **vectors[b["bg_number"]] }) for b in sample_bugs if b["bg_number"] in vectors ]
@@ -0,0 +1,295 @@
+import os
+import json
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.preprocessing import normalize
+
+from vector_store import quantize_int8, dequantize_int8
+
+# MOTOR DE SIMILARIDADE UM-PARA-MUITOS
+# empilha os vetores de todos os candidatos uma única vez e calcula os scores
+# de uma query contra todos eles em uma só passada, com vetores já normalizados
+
+def stack_tfidf_vectors(vectors):
+    if len(vectors) == 0:
+        return csr_matrix((0, 0), dtype=np.float64)
+    return csr_matrix(vstack(vectors, format='csr'), dtype=np.float64)
+
+def stack_embeddings_vectors(vectors):
+    if len(vectors) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+
+def normalize_tfidf_matrix(matrix, dtype=np.float64):
+    if matrix.shape[0] == 0:
+        return csr_matrix(matrix, dtype=dtype)
+    return normalize(csr_matrix(matrix, dtype=dtype), norm='l2', axis=1, copy=True)
+
+def normalize_embeddings_matrix(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.shape[0] == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+def categoric_similarity_vector(query, products, components):
+    scores = np.zeros(len(products), dtype=np.float64)
+    scores += (products == query["product"]) * 0.5
+    scores += (components == query["component"]) * 0.5
+    return scores
+
+# EMBEDDINGS EM PRECISÃO REDUZIDA
+# os embeddings normalizados ficam em float16 ou int8 (com escala por linha) e o
+# produto escalar é feito em blocos, convertendo só o bloco para float32
+
+EMBEDDINGS_PRECISIONS = ['float32', 'float16', 'int8']
+COMPACT_DOT_BLOCK_ROWS = 16384
+
+class CompactEmbeddings():
+    def __init__(self, normalized_matrix, precision):
+        if precision not in ['float16', 'int8']:
+            raise ValueError(f"precision must be 'float16' or 'int8', got {precision}")
+        self.precision = precision
+        if precision == 'int8':
+            self.codes, self.scales = quantize_int8(normalized_matrix)
+        else:
+            self.codes, self.scales = np.ascontiguousarray(normalized_matrix, dtype=np.float16), None
+
+    # a partir de códigos já calculados (ex: lidos com mmap de SimilarityEngine.save)
+    @classmethod
+    def from_codes(cls, codes, scales, precision):
+        compact = cls.__new__(cls)
+        compact.precision = precision
+        compact.codes     = codes
+        compact.scales    = scales
+        return compact
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def rows(self, rows=None):
+        codes  = self.codes if rows is None else self.codes[rows]
+        if self.scales is None:
+            return codes.astype(np.float32)
+        return dequantize_int8(codes, self.scales if rows is None else self.scales[rows])
+
+    def dot(self, query_vector, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], COMPACT_DOT_BLOCK_ROWS):
+            end = start + COMPACT_DOT_BLOCK_ROWS
+            scores[start:end] = codes[start:end].astype(np.float32) @ query_vector
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+ENGINE_TFIDF_DATA_FILE        = 'engine_tfidf_data.npy'
+ENGINE_TFIDF_INDICES_FILE     = 'engine_tfidf_indices.npy'
+ENGINE_TFIDF_INDPTR_FILE      = 'engine_tfidf_indptr.npy'
+ENGINE_EMBEDDINGS_FILE        = 'engine_embeddings.npy'
+ENGINE_EMBEDDINGS_SCALES_FILE = 'engine_embeddings_scales.npy'
+ENGINE_FULL_EMBEDDINGS_FILE   = 'engine_full_embeddings.npy'
+ENGINE_PRODUCTS_FILE          = 'engine_products.npy'
+ENGINE_COMPONENTS_FILE        = 'engine_components.npy'
+ENGINE_BG_NUMBERS_FILE        = 'engine_bg_numbers.npy'
+ENGINE_META_FILE              = 'engine_meta.json'
+
+class SimilarityEngine():
+    # embeddings_precision 'float16'/'int8': scores de embeddings calculados na forma compacta;
+    # com rerank_k, os rerank_k candidatos de maior score são recalculados em precisão total
+    # a partir de full_embeddings (qualquer objeto indexável por linhas: ndarray, memmap...,
+    # alinhado com as linhas do motor; None usa a matriz float32 recebida, que então continua
+    # inteira em RAM ao lado da forma compacta e aparece em memory_usage()["full_embeddings_bytes"])
+    def __init__(self, tfidf_matrix, embeddings_matrix, products, components, bg_numbers, normalized=False,
+                 embeddings_precision='float32', tfidf_dtype=np.float64, rerank_k=None, full_embeddings=None):
+        if embeddings_precision not in EMBEDDINGS_PRECISIONS:
+            raise ValueError(f'embeddings_precision must be one of {EMBEDDINGS_PRECISIONS}, got {embeddings_precision}')
+        if not normalized:
+            tfidf_matrix      = normalize_tfidf_matrix(tfidf_matrix, dtype=tfidf_dtype)
+            embeddings_matrix = normalize_embeddings_matrix(embeddings_matrix)
+
+        self.tfidf_matrix      = tfidf_matrix
+        self.tfidf_dtype       = tfidf_dtype
+        self.products          = np.asarray(products, dtype=object)
+        self.components        = np.asarray(components, dtype=object)
+        self.bg_numbers        = np.asarray(bg_numbers)
+
+        self.embeddings_precision = embeddings_precision
+        self.rerank_k             = rerank_k
+        self.full_embeddings      = None
+        if embeddings_precision == 'float32':
+            self.embeddings_matrix  = embeddings_matrix
+            self.compact_embeddings = None
+        else:
+            self.embeddings_matrix  = None
+            self.compact_embeddings = CompactEmbeddings(embeddings_matrix, embeddings_precision)
+            if rerank_k is not None:
+                self.full_embeddings = full_embeddings if full_embeddings is not None else embeddings_matrix
+
+    @classmethod
+    def from_bugs(cls, bugs, **options):
+        return cls(
+            tfidf_matrix=stack_tfidf_vectors([b["tfidf_vector"] for b in bugs]),
+            embeddings_matrix=stack_embeddings_vectors([b["embeddings_vector"] for b in bugs]),
+            products=[b["product"] for b in bugs],
+            components=[b["component"] for b in bugs],
+            bg_numbers=[b["bg_number"] for b in bugs],
+            **options
+        )
+
+    # SALVAR E REABRIR COM MMAP
+    # as matrizes já normalizadas (e na forma compacta) vão para .npy soltos em path;
+    # load() as abre com mmap, então processos que reabrem o mesmo diretório compartilham
+    # as páginas em vez de cada um ter sua cópia. full_embeddings só é salvo se for um
+    # ndarray; outro objeto (ex: linhas de um VectorStore) é passado de novo ao load()
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, ENGINE_TFIDF_DATA_FILE), self.tfidf_matrix.data)
+        np.save(os.path.join(path, ENGINE_TFIDF_INDICES_FILE), self.tfidf_matrix.indices)
+        np.save(os.path.join(path, ENGINE_TFIDF_INDPTR_FILE), self.tfidf_matrix.indptr)
+        np.save(os.path.join(path, ENGINE_PRODUCTS_FILE), np.asarray(self.products, dtype=str))
+        np.save(os.path.join(path, ENGINE_COMPONENTS_FILE), np.asarray(self.components, dtype=str))
+        np.save(os.path.join(path, ENGINE_BG_NUMBERS_FILE), self.bg_numbers)
+        if self.compact_embeddings is not None:
+            np.save(os.path.join(path, ENGINE_EMBEDDINGS_FILE), self.compact_embeddings.codes)
+            if self.compact_embeddings.scales is not None:
+                np.save(os.path.join(path, ENGINE_EMBEDDINGS_SCALES_FILE), self.compact_embeddings.scales)
+        else:
+            np.save(os.path.join(path, ENGINE_EMBEDDINGS_FILE), self.embeddings_matrix)
+        full_embeddings_saved = isinstance(self.full_embeddings, np.ndarray)
+        if full_embeddings_saved:
+            np.save(os.path.join(path, ENGINE_FULL_EMBEDDINGS_FILE), self.full_embeddings)
+
+        with open(os.path.join(path, ENGINE_META_FILE), 'w') as f:
+            json.dump({
+                "tfidf_shape": [int(d) for d in self.tfidf_matrix.shape],
+                "tfidf_dtype": np.dtype(self.tfidf_dtype).name,
+                "embeddings_precision": self.embeddings_precision,
+                "rerank_k": self.rerank_k,
+                "full_embeddings_saved": full_embeddings_saved
+            }, f)
+
+    @classmethod
+    def load(cls, path, mmap=True, full_embeddings=None):
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, ENGINE_META_FILE)) as f:
+            meta = json.load(f)
+
+        engine = cls.__new__(cls)
+        engine.tfidf_matrix = csr_matrix((
+            np.load(os.path.join(path, ENGINE_TFIDF_DATA_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, ENGINE_TFIDF_INDICES_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, ENGINE_TFIDF_INDPTR_FILE), mmap_mode=mmap_mode)
+        ), shape=tuple(meta["tfidf_shape"]), copy=False)
+        engine.tfidf_dtype = np.dtype(meta["tfidf_dtype"])
+        engine.products    = np.load(os.path.join(path, ENGINE_PRODUCTS_FILE), mmap_mode=mmap_mode)
+        engine.components  = np.load(os.path.join(path, ENGINE_COMPONENTS_FILE), mmap_mode=mmap_mode)
+        engine.bg_numbers  = np.load(os.path.join(path, ENGINE_BG_NUMBERS_FILE), mmap_mode=mmap_mode)
+
+        engine.embeddings_precision = meta["embeddings_precision"]
+        engine.rerank_k             = meta["rerank_k"]
+        embeddings = np.load(os.path.join(path, ENGINE_EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        if engine.embeddings_precision == 'float32':
+            engine.embeddings_matrix  = embeddings
+            engine.compact_embeddings = None
+        else:
+            scales = None
+            if engine.embeddings_precision == 'int8':
+                scales = np.load(os.path.join(path, ENGINE_EMBEDDINGS_SCALES_FILE), mmap_mode=mmap_mode)
+            engine.embeddings_matrix  = None
+            engine.compact_embeddings = CompactEmbeddings.from_codes(embeddings, scales, engine.embeddings_precision)
+
+        if meta["full_embeddings_saved"]:
+            full_embeddings = np.load(os.path.join(path, ENGINE_FULL_EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        engine.full_embeddings = full_embeddings if engine.compact_embeddings is not None and engine.rerank_k is not None else None
+        return engine
+
+    def __len__(self):
+        return len(self.bg_numbers)
+
+    def query_tfidf_dense(self, query):
+        q_tfidf = normalize_tfidf_matrix(query["tfidf_vector"], dtype=self.tfidf_dtype)
+        return np.asarray(q_tfidf.todense(), dtype=self.tfidf_dtype).ravel()
+
+    def query_embeddings(self, query):
+        return normalize_embeddings_matrix(query["embeddings_vector"]).ravel()
+
+    # embeddings normalizados em float32 das linhas pedidas (reconstruídos da forma compacta, se for o caso)
+    def embeddings_rows(self, rows=None):
+        if self.compact_embeddings is not None:
+            return self.compact_embeddings.rows(rows)
+        return self.embeddings_matrix if rows is None else self.embeddings_matrix[rows]
+
+    def embeddings_scores(self, q_embeddings, rows=None):
+        if self.compact_embeddings is None:
+            embeddings_matrix = self.embeddings_matrix if rows is None else self.embeddings_matrix[rows]
+            return embeddings_matrix @ q_embeddings
+
+        scores = self.compact_embeddings.dot(q_embeddings, rows)
+        if self.full_embeddings is None or len(scores) == 0:
+            return scores
+
+        # reordena os melhores candidatos com os vetores em precisão total
+        top = np.argpartition(-scores, self.rerank_k - 1)[:self.rerank_k] if len(scores) > self.rerank_k else np.arange(len(scores))
+        engine_rows = top if rows is None else np.asarray(rows)[top]
+        scores[top] = normalize_embeddings_matrix(self.full_embeddings[engine_rows]) @ q_embeddings
+        return scores
+
+    # full_embeddings_bytes: cópia float32 do re-ranking que fica em RAM (re-ranking sem VectorStore/memmap);
+    # lida de um mmap, ela não conta
+    def memory_usage(self):
+        tfidf_bytes = self.tfidf_matrix.data.nbytes + self.tfidf_matrix.indices.nbytes + self.tfidf_matrix.indptr.nbytes
+        embeddings_bytes = self.compact_embeddings.nbytes if self.compact_embeddings is not None else self.embeddings_matrix.nbytes
+        full_embeddings_bytes = 0
+        if isinstance(self.full_embeddings, np.ndarray) and not isinstance(self.full_embeddings, np.memmap):
+            full_embeddings_bytes = self.full_embeddings.nbytes
+        return { "tfidf_bytes": int(tfidf_bytes), "embeddings_bytes": int(embeddings_bytes), "full_embeddings_bytes": int(full_embeddings_bytes) }
+
+    # devolve os três scores (tfidf, word embeddings, categórico) para as linhas pedidas
+    # rows=None calcula contra todos os candidatos empilhados
+    def score(self, query, rows=None):
+        tfidf_matrix      = self.tfidf_matrix
+        products          = self.products
+        components        = self.components
+        if rows is not None:
+            tfidf_matrix      = tfidf_matrix[rows]
+            products          = products[rows]
+            components        = components[rows]
+
+        if tfidf_matrix.shape[0] == 0:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty.astype(np.float32), empty
+
+        tfidf_scores      = tfidf_matrix @ self.query_tfidf_dense(query)
+        embeddings_scores = self.embeddings_scores(self.query_embeddings(query), rows)
+        categoric_scores  = categoric_similarity_vector(query, products, components)
+
+        return tfidf_scores, embeddings_scores, categoric_scores
+
+    def arcs(self, query, rows=None):
+        tfidf_scores, embeddings_scores, categoric_scores = self.score(query, rows)
+        bg_numbers = self.bg_numbers if rows is None else self.bg_numbers[rows]
+
+        return [
+            {
+                "from": query["bg_number"],
+                "to": to,
+                "cos_similarity_tfidf": tfidf,
+                "cos_similarity_word_embeddings": we,
+                "categoric_similarity": categoric
+            } for to, tfidf, we, categoric in zip(
+                bg_numbers.tolist(),
+                tfidf_scores.tolist(),
+                embeddings_scores.tolist(),
+                categoric_scores.tolist()
+            )
+        ]
@@ -0,0 +1,166 @@
+import os
+import pymongo
+import datetime
+from bson import json_util
+from tqdm import tqdm
+from time import time
+
+from candidate_index import CandidateIndex, CANDIDATE_FIELDS
+from vector_store import VectorStore, VECTORS_UPDATED_AT_FIELD, vectors_filter, vectors_projection, load_bug_vectors
+from bulk_writer import BulkWriter
+from generate_sample_calculate_and_save_similarity_arcs import get_mongo_conn, ARCS_WRITE_BATCH_SIZE
+
+# ATUALIZAÇÃO INCREMENTAL DOS ARCOS
+# em vez de sortear uma nova amostra e recalcular tudo, processa só os bugs cujos
+# vetores foram gravados/alterados depois do watermark da última execução:
+#   - arcos de ida: o bug novo como query contra seus candidatos (NEW_BUGS_AS_QUERIES)
+#   - arcos reversos: o bug novo como candidato das queries que já têm arcos
+#   - queries existentes com vetores alterados têm seus arcos recalculados
+# antes, os arcos de e para os bugs alterados são apagados, então candidatos que deixaram
+# de se qualificar não ficam para trás e o resultado é o mesmo de um recálculo completo.
+# Só são lidos do mongo os bugs que podem ser afetados: queries existentes e candidatos
+# dos mesmos produtos/componentes, dentro da janela de tempo dos bugs alterados.
+# os arcos são gravados com upsert por (from, to), então reexecutar é idempotente.
+
+WATERMARK_PATH = 'arcs_watermark.json'
+
+def load_watermark(watermark_path):
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path) as f:
+        return json_util.loads(f.read())["watermark"]
+
+def save_watermark(watermark_path, watermark):
+    tmp_path = f'{watermark_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json_util.dumps({ "watermark": watermark }))
+    os.replace(tmp_path, watermark_path)
+
+# documentos antigos, sem o carimbo de atualização, entram pelo creation_time
+def retrieve_changed_bugs(db, watermark, vector_store=None):
+    return [ load_bug_vectors(b, vector_store) for b in db["bug"].find({
+        **vectors_filter(vector_store),
+        "$or": [{
+            VECTORS_UPDATED_AT_FIELD: { "$gt": watermark }
+        },
+        {
+            VECTORS_UPDATED_AT_FIELD: { "$exists": False },
+            "creation_time": { "$gt": watermark }
+        }]
+    }, { **CANDIDATE_FIELDS, **vectors_projection(vector_store) }) ]
+
+def creation_times(bugs):
+    return [ b["creation_time"] for b in bugs if isinstance(b["creation_time"], datetime.datetime) ]
+
+# mesmo produto ou componente de algum dos bugs
+def same_product_or_component(bugs):
+    return { "$or": [
+        { "product": { "$in": list({ b["product"] for b in bugs }) } },
+        { "component": { "$in": list({ b["component"] for b in bugs }) } }
+    ] }
+
+# queries que podem ter um dos bugs alterados como candidato: mesmo produto/componente e
+# criadas depois do bug alterado mais antigo (e antes da última resolução, se todos já resolvidos)
+def affected_queries_filter(changed_bugs):
+    creation_time = { "$gt": min(creation_times(changed_bugs)) }
+    resolved_times = [ b["when_changed_to_resolved"] for b in changed_bugs ]
+    if all(isinstance(t, datetime.datetime) for t in resolved_times):
+        creation_time["$lt"] = max(resolved_times)
+    return { **same_product_or_component(changed_bugs), "creation_time": creation_time }
+
+# candidatos possíveis de um conjunto de queries, o mesmo filtro de candidate_rows em volta delas
+def candidates_scope_filter(queries):
+    times = creation_times(queries)
+    return {
+        **same_product_or_component(queries),
+        "creation_time": { "$lt": max(times) },
+        "when_changed_to_resolved": { "$gt": min(times) }
+    }
+
+def retrieve_existing_queries(db, changed_bugs, vector_store=None):
+    if len(creation_times(changed_bugs)) == 0:
+        return []
+    from_bg_numbers = set(db["arc"].distinct("from"))
+    return [ load_bug_vectors(b, vector_store) for b in db["bug"].find({
+        **vectors_filter(vector_store),
+        **affected_queries_filter(changed_bugs)
+    }, { **CANDIDATE_FIELDS, **vectors_projection(vector_store) }) if b["bg_number"] in from_bg_numbers ]
+
+# arcos de e para os bugs alterados, recalculados em seguida
+def delete_changed_arcs(db, changed_bg_numbers):
+    changed_bg_numbers = list(changed_bg_numbers)
+    deleted = 0
+    for start in range(0, len(changed_bg_numbers), 10000):
+        chunk = changed_bg_numbers[start:start + 10000]
+        deleted += db["arc"].delete_many({ "$or": [{ "from": { "$in": chunk } }, { "to": { "$in": chunk } }] }).deleted_count
+    return deleted
+
+def upsert_arcs(arcs_writer, arcs):
+    for arc in arcs:
+        arcs_writer.update_one({ "from": arc["from"], "to": arc["to"] }, { "$set": arc }, upsert=True)
+
+def update_arcs_incrementally(db, watermark, new_bugs_as_queries=True, vector_store=None):
+    db["arc"].create_index([("from", pymongo.ASCENDING), ("to", pymongo.ASCENDING)])
+
+    changed_bugs = retrieve_changed_bugs(db, watermark, vector_store)
+    print(f'{len(changed_bugs)} bugs with new or changed vectors since {watermark}')
+    if len(changed_bugs) == 0:
+        return 0
+
+    changed_bg_numbers = { b["bg_number"] for b in changed_bugs }
+    existing_bg_numbers = set(db["arc"].distinct("from", { "from": { "$in": list(changed_bg_numbers) } }))
+    existing_queries = retrieve_existing_queries(db, changed_bugs, vector_store)
+
+    print(f'deleted {delete_changed_arcs(db, changed_bg_numbers)} arcs from/to the changed bugs')
+
+    total_arcs = 0
+    with BulkWriter(db["arc"], batch_size=ARCS_WRITE_BATCH_SIZE) as arcs_writer:
+        # índice só com os bugs alterados: responde quais deles são candidatos de cada query existente
+        changed_index = CandidateIndex(changed_bugs)
+        print('calculating reverse arcs for existing queries...')
+        for query in tqdm(existing_queries):
+            if query["bg_number"] in changed_bg_numbers:
+                continue
+            arcs = changed_index.arcs(query)
+            upsert_arcs(arcs_writer, arcs)
+            total_arcs += len(arcs)
+
+        # queries existentes alteradas e (opcionalmente) bugs novos contra os seus candidatos
+        new_queries = [ b for b in changed_bugs if b["bg_number"] in existing_bg_numbers or new_bugs_as_queries ]
+        new_queries = [ q for q in new_queries if isinstance(q["creation_time"], datetime.datetime) ]
+
+        if len(new_queries) > 0:
+            print('loading candidate index...')
+            candidate_index = CandidateIndex.load_from_mongo(db, vector_store=vector_store, match=candidates_scope_filter(new_queries))
+            print(f'calculating arcs for {len(new_queries)} new or changed queries...')
+            for query in tqdm(new_queries):
+                arcs = candidate_index.arcs(query)
+                upsert_arcs(arcs_writer, arcs)
+                total_arcs += len(arcs)
+
+    return total_arcs
+
+def main():
+    db = get_mongo_conn(MONGO_URL="mongodb://localhost:27017/",
+                        MONGO_DATABASE="bug_report_colab")
+
+    # na primeira execução, bugs alterados depois deste momento (ex: data da última geração completa)
+    INITIAL_WATERMARK = datetime.datetime(2013, 1, 1, 0, 0, 0, 0)
+    NEW_BUGS_AS_QUERIES = True
+    VECTOR_STORE_PATH = None
+
+    vector_store = VectorStore(VECTOR_STORE_PATH) if VECTOR_STORE_PATH is not None else None
+
+    watermark = load_watermark(WATERMARK_PATH) or INITIAL_WATERMARK
+    # o próximo watermark é o início desta execução, assim nada gravado durante ela é perdido
+    run_started_at = datetime.datetime.utcnow()
+
+    total_time_a = time()
+    total_arcs = update_arcs_incrementally(db, watermark, new_bugs_as_queries=NEW_BUGS_AS_QUERIES, vector_store=vector_store)
+    save_watermark(WATERMARK_PATH, run_started_at)
+
+    total_time_in_ms = int((time() - total_time_a) * 1000)
+    print(f"Total time to upsert {total_arcs} arcs: {total_time_in_ms}ms -> {total_time_in_ms/1000}s")
+
+if __name__ == '__main__':
+    main()
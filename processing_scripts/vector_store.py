@@ -0,0 +1,167 @@
+import os
+import json
+import pickle
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# VECTOR STORE COLUNAR
+# todos os embeddings em um único .npy (float32, float16 ou int8) e todos os tfidf em uma
+# única tripla CSR (data/indices/indptr), ambos lidos com mmap sem cópia.
+# bg_numbers.npy guarda o bg_number de cada linha; no mongo fica só a referência
+# para a linha (VECTOR_STORE_REF_FIELD) no lugar dos vetores em pickle.
+
+VECTOR_STORE_REF_FIELD = 'vector_store_row'
+# carimbo de quando os vetores do documento foram gravados/alterados (atualização incremental dos arcos)
+VECTORS_UPDATED_AT_FIELD = 'vectors_updated_at'
+
+EMBEDDINGS_FILE    = 'embeddings.npy'
+EMBEDDINGS_SCALES_FILE = 'embeddings_scales.npy'
+TFIDF_DATA_FILE    = 'tfidf_data.npy'
+TFIDF_INDICES_FILE = 'tfidf_indices.npy'
+TFIDF_INDPTR_FILE  = 'tfidf_indptr.npy'
+BG_NUMBERS_FILE    = 'bg_numbers.npy'
+META_FILE          = 'meta.json'
+
+EMBEDDINGS_DTYPES = ['float32', 'float16', 'int8']
+
+# QUANTIZAÇÃO ESCALAR INT8
+# cada vetor vira códigos int8 em [-127, 127] mais uma escala float32 própria
+# (max |x| / 127), então vetor ~= códigos * escala com erro <= escala / 2 por coordenada
+
+def quantize_int8(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.shape[1] > 0 else np.zeros(matrix.shape[0], dtype=np.float32)
+    scales = np.asarray(scales, dtype=np.float32)
+    safe_scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(matrix / safe_scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+def dequantize_int8(codes, scales):
+    return np.asarray(codes, dtype=np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+def encode_embeddings(matrix, embeddings_dtype):
+    if embeddings_dtype not in EMBEDDINGS_DTYPES:
+        raise ValueError(f'embeddings_dtype must be one of {EMBEDDINGS_DTYPES}, got {embeddings_dtype}')
+    if embeddings_dtype == 'int8':
+        return quantize_int8(matrix)
+    return np.ascontiguousarray(matrix, dtype=embeddings_dtype), None
+
+def save_vector_store(path, bg_numbers, tfidf_matrix, embeddings_matrix, embeddings_dtype='float32'):
+    if embeddings_dtype not in EMBEDDINGS_DTYPES:
+        raise ValueError(f'embeddings_dtype must be one of {EMBEDDINGS_DTYPES}, got {embeddings_dtype}')
+
+    bg_numbers        = np.asarray(bg_numbers, dtype=np.int64)
+    tfidf_matrix      = csr_matrix(tfidf_matrix)
+    embeddings_matrix, embeddings_scales = encode_embeddings(embeddings_matrix, embeddings_dtype)
+
+    if not (len(bg_numbers) == tfidf_matrix.shape[0] == embeddings_matrix.shape[0]):
+        raise ValueError(f'row count mismatch: bg_numbers={len(bg_numbers)}, tfidf={tfidf_matrix.shape[0]}, embeddings={embeddings_matrix.shape[0]}')
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, BG_NUMBERS_FILE), bg_numbers)
+    np.save(os.path.join(path, EMBEDDINGS_FILE), embeddings_matrix)
+    if embeddings_scales is not None:
+        np.save(os.path.join(path, EMBEDDINGS_SCALES_FILE), embeddings_scales)
+    np.save(os.path.join(path, TFIDF_DATA_FILE), tfidf_matrix.data)
+    np.save(os.path.join(path, TFIDF_INDICES_FILE), tfidf_matrix.indices)
+    np.save(os.path.join(path, TFIDF_INDPTR_FILE), tfidf_matrix.indptr)
+
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({
+            "rows": int(len(bg_numbers)),
+            "tfidf_shape": [int(d) for d in tfidf_matrix.shape],
+            "tfidf_dtype": str(tfidf_matrix.dtype),
+            "embeddings_dim": int(embeddings_matrix.shape[1]) if embeddings_matrix.ndim == 2 else 0,
+            "embeddings_dtype": embeddings_dtype
+        }, f)
+
+class VectorStore():
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        mmap_mode = 'r' if mmap else None
+
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.bg_numbers = np.load(os.path.join(path, BG_NUMBERS_FILE), mmap_mode=mmap_mode)
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        # só no store int8: escala de cada linha; embeddings_vector/embeddings_rows devolvem float32 reconstruído
+        self.embeddings_scales = None
+        if self.meta["embeddings_dtype"] == 'int8':
+            self.embeddings_scales = np.load(os.path.join(path, EMBEDDINGS_SCALES_FILE), mmap_mode=mmap_mode)
+        self.tfidf = csr_matrix((
+            np.load(os.path.join(path, TFIDF_DATA_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, TFIDF_INDICES_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, TFIDF_INDPTR_FILE), mmap_mode=mmap_mode)
+        ), shape=tuple(self.meta["tfidf_shape"]), copy=False)
+
+        self.row_by_bg_number = { bg_number: row for row, bg_number in enumerate(self.bg_numbers.tolist()) }
+
+    # enviado a outro processo (ex: dentro do CandidateIndex), o store é reaberto pelo caminho em vez de copiado
+    def __getstate__(self):
+        return { "path": self.path, "mmap": self.mmap }
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], mmap=state["mmap"])
+
+    def __len__(self):
+        return len(self.bg_numbers)
+
+    def __contains__(self, bg_number):
+        return bg_number in self.row_by_bg_number
+
+    def row_of(self, bg_number):
+        return self.row_by_bg_number[bg_number]
+
+    def rows_of(self, bg_numbers):
+        return np.asarray([ self.row_by_bg_number[bg_number] for bg_number in bg_numbers ], dtype=np.int64)
+
+    def tfidf_vector(self, bg_number):
+        row = self.row_of(bg_number)
+        return self.tfidf[row:row + 1]
+
+    def embeddings_vector(self, bg_number):
+        row = self.row_of(bg_number)
+        if self.embeddings_scales is not None:
+            return dequantize_int8(self.embeddings[row], self.embeddings_scales[row])
+        return self.embeddings[row]
+
+    def tfidf_rows(self, rows):
+        return self.tfidf[rows]
+
+    def embeddings_rows(self, rows):
+        if self.embeddings_scales is not None:
+            return dequantize_int8(self.embeddings[rows], self.embeddings_scales[rows])
+        return self.embeddings[rows]
+
+# HELPERS PARA QUEM LÊ DO MONGO
+# com vector_store=None continua lendo os vetores em pickle de cada documento
+
+def vectors_filter(vector_store=None):
+    if vector_store is not None:
+        return { VECTOR_STORE_REF_FIELD: { "$exists": True } }
+    return {
+        "tfidf_vector":      { "$exists": True },
+        "embeddings_vector": { "$exists": True }
+    }
+
+def vectors_projection(vector_store=None):
+    if vector_store is not None:
+        return { VECTOR_STORE_REF_FIELD: True }
+    return { "tfidf_vector": True, "embeddings_vector": True }
+
+# tamanho em bytes dos vetores em pickle do documento (0 no modo vector store)
+def pickled_vectors_size(bug):
+    return sum(len(bug[field]) for field in ["tfidf_vector", "embeddings_vector"] if isinstance(bug.get(field), bytes))
+
+def load_bug_vectors(bug, vector_store=None):
+    if vector_store is not None:
+        bug["tfidf_vector"]      = vector_store.tfidf_vector(bug["bg_number"])
+        bug["embeddings_vector"] = vector_store.embeddings_vector(bug["bg_number"])
+    else:
+        bug["tfidf_vector"]      = pickle.loads(bug["tfidf_vector"])
+        bug["embeddings_vector"] = pickle.loads(bug["embeddings_vector"])
+    return bug
@@ -0,0 +1,95 @@
+import os
+import sys
+import numpy as np
+
+# mesmo caminho de import dos scripts de processing_scripts (ver evaluate.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processing_scripts'))
+
+from bulk_writer import BulkWriter
+
+# DESTINO DOS RESULTADOS DA AVALIAÇÃO
+# as linhas guardam as recomendações só como arrays de bg_number/score/relevant,
+# que referenciam a collection bug, em vez de repetir summary/product/component.
+# MongoResultSink: insert em lote pela thread do BulkWriter na collection result.
+# NpzResultSink: acumula em memória e grava um .npz local no close().
+
+def compact_result_row(result):
+    return {
+        "version": result["version"],
+        "feedback": result["feedback"],
+        "precision": result["precision"],
+        "likelihood": result["likelihood"],
+        "query": result["query"],
+        "recommendations": {
+            "bg_number": [ rec["bg_number"] for rec in result["recommendations"] ],
+            "score": [ rec["score"] for rec in result["recommendations"] ],
+            "relevant": [ bool(rec["relevant"]) for rec in result["recommendations"] ]
+        },
+        "k": result["k"]
+    }
+
+class MongoResultSink():
+    def __init__(self, db, batch_size=1000):
+        self.writer = BulkWriter(db["result"], batch_size=batch_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, result):
+        self.writer.insert_one(compact_result_row(result))
+
+    def close(self):
+        self.writer.close()
+        print(f'saved {self.writer.written} result rows on mongo')
+
+class NpzResultSink():
+    def __init__(self, path):
+        self.path = path
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, result):
+        self.rows.append(compact_result_row(result))
+
+    # recomendações viram matrizes (linhas x maior K) preenchidas com -1/NaN/False
+    def close(self):
+        n_rows = len(self.rows)
+        max_k = max([ len(r["recommendations"]["bg_number"]) for r in self.rows ], default=0)
+
+        bg_numbers = np.full((n_rows, max_k), -1, dtype=np.int64)
+        scores     = np.full((n_rows, max_k), np.nan, dtype=np.float32)
+        relevant   = np.zeros((n_rows, max_k), dtype=bool)
+        for i, r in enumerate(self.rows):
+            n = len(r["recommendations"]["bg_number"])
+            bg_numbers[i, :n] = r["recommendations"]["bg_number"]
+            scores[i, :n]     = r["recommendations"]["score"]
+            relevant[i, :n]   = r["recommendations"]["relevant"]
+
+        np.savez_compressed(
+            self.path,
+            version=np.array([ r["version"] for r in self.rows ], dtype=str),
+            query=np.array([ r["query"] for r in self.rows ], dtype=np.int64),
+            k=np.array([ r["k"] for r in self.rows ], dtype=np.int64),
+            feedback=np.array([ r["feedback"] for r in self.rows ], dtype=np.float64),
+            precision=np.array([ r["precision"] for r in self.rows ], dtype=np.float64),
+            likelihood=np.array([ r["likelihood"] for r in self.rows ], dtype=np.float64),
+            recommendations_bg_number=bg_numbers,
+            recommendations_score=scores,
+            recommendations_relevant=relevant
+        )
+        print(f'saved {n_rows} result rows on {self.path}')
+        self.rows = []
+
+# output_path=None grava no mongo; senão em um .npz local
+def open_result_sink(db, output_path=None):
+    if output_path is not None:
+        return NpzResultSink(output_path)
+    return MongoResultSink(db)
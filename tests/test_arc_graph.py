@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+from arc_graph import SCORE_VERSIONS, ScoreFusion
+
+# referência: uma versão por vez, soma ponderada dos três scores e ordenação estável completa
+def reference_top_n(tfidf_scores, we_scores, categoric_scores, weights, top_n):
+    w_tfidf, w_we, w_categoric = weights
+    scores = w_tfidf * tfidf_scores + w_we * we_scores + w_categoric * categoric_scores
+    return np.argsort(-scores, kind='stable')[:top_n], scores
+
+def base_scores(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random(n), rng.random(n).astype(np.float32), rng.choice([0.0, 0.5, 1.0], n)
+
+def test_score_fusion_matches_per_version_scores_and_order():
+    tfidf_scores, we_scores, categoric_scores = base_scores(500)
+    ranked = ScoreFusion().top_n(tfidf_scores, we_scores, categoric_scores, 500)
+
+    for version, weights in SCORE_VERSIONS.items():
+        order, scores = ranked[version]
+        expected_order, expected_scores = reference_top_n(tfidf_scores, we_scores, categoric_scores, weights, 500)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-12, atol=1e-12)
+        np.testing.assert_array_equal(order, expected_order)
+
+def test_score_fusion_top_n_keeps_the_best_scores():
+    tfidf_scores, we_scores, categoric_scores = base_scores(1000, seed=1)
+    ranked = ScoreFusion().top_n(tfidf_scores, we_scores, categoric_scores, 20, ['categoric_tfidf_we', 'categoric'])
+
+    for version in ['categoric_tfidf_we', 'categoric']:
+        order, scores = ranked[version]
+        expected_order, expected_scores = reference_top_n(tfidf_scores, we_scores, categoric_scores, SCORE_VERSIONS[version], 20)
+        # empates (ex: só categórico) podem trocar quais linhas entram, mas não os scores do top-N
+        np.testing.assert_allclose(scores[order], expected_scores[expected_order])
+        assert len(set(order.tolist())) == 20
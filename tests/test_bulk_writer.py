@@ -0,0 +1,71 @@
+import os
+import sys
+
+import mongomock
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+from bulk_writer import BulkWriter, DUPLICATE_KEY_ERROR
+
+# collection que, no primeiro bulk_write, falha nas operações de índice failing_indexes
+# (e devolve chave duplicada para duplicate_indexes); as demais são escritas
+class FlakyCollection():
+    def __init__(self, collection, failing_indexes, duplicate_indexes=()):
+        self.collection        = collection
+        self.failing_indexes   = set(failing_indexes)
+        self.duplicate_indexes = set(duplicate_indexes)
+        self.batches           = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.batches.append(list(operations))
+        if len(self.batches) > 1:
+            return self.collection.bulk_write(operations, ordered=ordered)
+
+        errors = []
+        for index, operation in enumerate(operations):
+            if index in self.duplicate_indexes:
+                errors.append({ "index": index, "code": DUPLICATE_KEY_ERROR })
+            elif index in self.failing_indexes:
+                errors.append({ "index": index, "code": 91 })
+            else:
+                self.collection.bulk_write([operation])
+        raise BulkWriteError({ "writeErrors": errors })
+
+def documents(n):
+    return [ { "bg_number": i } for i in range(n) ]
+
+def test_write_batch_retries_only_the_failed_operations():
+    db = mongomock.MongoClient()['bugs']
+    collection = FlakyCollection(db["bug"], failing_indexes=[1, 4])
+
+    with BulkWriter(collection, batch_size=10, retry_delay=0, asynchronous=False) as writer:
+        writer.insert_many(documents(6))
+
+    assert len(collection.batches) == 2
+    assert [ op._doc["bg_number"] for op in collection.batches[1] ] == [1, 4]
+    assert writer.written == 6
+    assert writer.round_trips == 2
+    assert sorted(b["bg_number"] for b in db["bug"].find()) == list(range(6))
+
+def test_write_batch_does_not_retry_duplicate_keys():
+    db = mongomock.MongoClient()['bugs']
+    collection = FlakyCollection(db["bug"], failing_indexes=[], duplicate_indexes=[2])
+
+    with BulkWriter(collection, batch_size=10, retry_delay=0, asynchronous=False) as writer:
+        writer.insert_many(documents(4))
+
+    assert len(collection.batches) == 1
+    assert writer.written == 4
+
+def test_asynchronous_writer_writes_every_batch():
+    db = mongomock.MongoClient()['bugs']
+
+    with BulkWriter(db["bug"], batch_size=7) as writer:
+        for document in documents(50):
+            writer.add(InsertOne(document))
+
+    assert writer.written == 50
+    assert writer.round_trips == 8
+    assert db["bug"].count_documents({}) == 50
@@ -0,0 +1,59 @@
+import os
+import sys
+import pickle
+import datetime
+
+import numpy as np
+import mongomock
+from bson import Binary
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+from candidate_index import CandidateIndex
+from generate_sample_calculate_and_save_similarity_arcs import retrieve_candidates_query
+
+PRODUCTS   = ['Core', 'Firefox', 'Toolkit']
+COMPONENTS = ['DOM', 'Networking', 'General', 'Layout']
+
+def random_bugs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2010, 1, 1)
+    bugs = []
+    for bg_number in range(1, n + 1):
+        # horas inteiras para haver empates de creation_time e de resolução com a query
+        creation_time = start + datetime.timedelta(hours=int(rng.integers(0, 2000)))
+        if rng.random() < 0.2:
+            resolved = '' # nunca resolvido
+        else:
+            resolved = creation_time + datetime.timedelta(hours=int(rng.integers(0, 500)))
+        bugs.append({
+            "bg_number": bg_number,
+            "product": PRODUCTS[rng.integers(len(PRODUCTS))],
+            "component": COMPONENTS[rng.integers(len(COMPONENTS))],
+            "creation_time": creation_time,
+            "when_changed_to_resolved": resolved,
+            "tfidf_vector": Binary(pickle.dumps(csr_matrix(rng.random((1, 8))), protocol=2)),
+            "embeddings_vector": Binary(pickle.dumps(rng.random(4).astype(np.float32), protocol=2))
+        })
+    return bugs
+
+def test_candidate_rows_match_the_mongo_candidates_query():
+    db = mongomock.MongoClient()['bugs']
+    bugs = random_bugs(400)
+    db["bug"].insert_many(bugs)
+
+    index = CandidateIndex.load_from_mongo(db)
+    assert len(index) == len(bugs)
+
+    for query in bugs[:100]:
+        expected = sorted(b["bg_number"] for b in retrieve_candidates_query(db, query))
+        found = sorted(index.bg_numbers[index.candidate_rows(query)].tolist())
+        assert found == expected
+
+def test_candidate_rows_of_query_without_creation_time_is_empty():
+    db = mongomock.MongoClient()['bugs']
+    db["bug"].insert_many(random_bugs(50))
+
+    index = CandidateIndex.load_from_mongo(db)
+    assert len(index.candidate_rows({ "product": 'Core', "component": 'DOM', "creation_time": '' })) == 0
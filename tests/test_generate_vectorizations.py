@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+# o script importa SentenceTransformer no topo, mesmo que o vetorizador TF-IDF não o use
+pytest.importorskip('sentence_transformers')
+from generate_vectorizations_and_update_db import TfidfVectorizer, fit_or_load_tfidf_vectorizer
+
+CORPUS = [
+    'crash when opening the dom inspector',
+    'network timeout on https requests',
+    'layout breaks with flexbox and grid',
+    'dom event listener leaks memory',
+    'crash in network cache after timeout'
+]
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_tfidf_vectorizer_save_load_round_trip(tmp_path, dtype):
+    path = str(tmp_path / 'tfidf_vectorizer.npz')
+    fitted = TfidfVectorizer(CORPUS, dtype=dtype)
+    fitted.save(path)
+
+    loaded = TfidfVectorizer.load(path)
+    assert loaded.vectorizer.vocabulary_ == fitted.vectorizer.vocabulary_
+
+    # inclui termo fora do vocabulário e documento sem nenhum termo conhecido
+    texts = CORPUS + ['crash with unknown words', 'nothing known here']
+    expected = fitted.transform_batch(texts)
+    found = loaded.transform_batch(texts)
+    assert found.dtype == expected.dtype == dtype
+    np.testing.assert_array_equal(found.toarray(), expected.toarray())
+    np.testing.assert_array_equal(loaded.transform(CORPUS[0]).toarray(), expected[0].toarray())
+
+def test_fit_or_load_only_fits_when_nothing_is_saved(tmp_path):
+    path = str(tmp_path / 'tfidf_vectorizer.npz')
+    fitted = fit_or_load_tfidf_vectorizer(lambda: CORPUS, path=path)
+    assert os.path.exists(path)
+
+    def corpus_fn():
+        raise AssertionError('vetorizador salvo não deveria ser reajustado')
+
+    loaded = fit_or_load_tfidf_vectorizer(corpus_fn, path=path)
+    np.testing.assert_array_equal(loaded.transform_batch(CORPUS).toarray(), fitted.transform_batch(CORPUS).toarray())
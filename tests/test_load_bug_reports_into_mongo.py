@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import datetime
+
+import mongomock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+from load_bug_reports_into_mongo import iter_bugs_from_file, load_bugs_into_mongo
+
+def processed_bug(bg_number, creation_time, resolved=''):
+    return {
+        "bg_number": bg_number,
+        "product": 'Core',
+        "component": 'DOM',
+        "assigned_to": 'dev@example.com',
+        "creation_time": creation_time,
+        "when_changed_to_resolved": resolved
+    }
+
+def test_ndjson_and_json_array_yield_the_same_bugs(tmp_path):
+    bugs = [ processed_bug(i, f'2010-03-{i:02d}T10:00:00Z') for i in range(1, 6) ]
+    ndjson_path = tmp_path / 'bugs.ndjson'
+    json_path = tmp_path / 'bugs.json'
+    # linhas em branco (ex: newline final duplicado) são ignoradas
+    ndjson_path.write_text('\n'.join(json.dumps(b) for b in bugs) + '\n\n')
+    json_path.write_text(json.dumps(bugs))
+
+    assert list(iter_bugs_from_file(str(ndjson_path))) == bugs
+    assert list(iter_bugs_from_file(str(json_path))) == bugs
+
+def test_load_bugs_into_mongo_upserts_by_bg_number_with_datetimes(tmp_path):
+    ndjson_path = tmp_path / 'bugs.ndjson'
+    ndjson_path.write_text('\n'.join(json.dumps(b) for b in [
+        processed_bug(1, '2010-03-01T10:00:00Z', '2010-04-01T12:00:00Z'),
+        processed_bug(2, '2011-06-01T08:30:00Z')
+    ]) + '\n')
+
+    db = mongomock.MongoClient()['bugs']
+    # carregar duas vezes não duplica documentos
+    assert load_bugs_into_mongo(db, [str(ndjson_path)], batch_size=1) == 2
+    assert load_bugs_into_mongo(db, [str(ndjson_path)]) == 2
+
+    assert db["bug"].count_documents({}) == 2
+    bug = db["bug"].find_one({ "bg_number": 1 })
+    assert bug["creation_time"] == datetime.datetime(2010, 3, 1, 10, 0)
+    assert bug["when_changed_to_resolved"] == datetime.datetime(2010, 4, 1, 12, 0)
+    assert db["bug"].find_one({ "bg_number": 2 })["when_changed_to_resolved"] == ''
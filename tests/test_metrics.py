@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'processing_scripts'))
+sys.path.insert(0, ROOT)
+
+from metrics import AssigneeEncoder, build_relevance_matrix, calculate_metrics_all_k
+
+# evaluate.py importa recommender e data_loader, que vêm do projeto do recomendador e não deste repositório
+pytest.importorskip('recommender')
+pytest.importorskip('data_loader')
+import evaluate
+
+ASSIGNEES = ['ana@example.com', 'bruno@example.com', 'carla@example.com', 'davi@example.com']
+
+def random_evaluation(n_queries, max_k, seed=0):
+    rng = np.random.default_rng(seed)
+    queries, recommendations = [], []
+    for _ in range(n_queries):
+        queries.append({ "assigned_to": ASSIGNEES[rng.integers(len(ASSIGNEES))] })
+        # algumas queries devolvem menos que max_k recomendações (feedback < 1)
+        length = int(rng.integers(0, max_k + 1))
+        recommendations.append([ { "item": { "assigned_to": ASSIGNEES[i] } } for i in rng.integers(len(ASSIGNEES), size=length) ])
+    return queries, recommendations
+
+def scalar_metrics(queries, recommendations, k):
+    feedback, precision, likelihood = [], [], []
+    for query, results in zip(queries, recommendations):
+        results = results[:k]
+        feedback.append(evaluate.calculate_feedback(query, results, k))
+        precision.append(evaluate.calculate_precision(query, results))
+        likelihood.append(evaluate.calculate_likelihood(query, results))
+    return evaluate.calculate_avg_metric(feedback), evaluate.calculate_avg_metric(precision), evaluate.calculate_avg_metric(likelihood)
+
+def test_vectorized_metrics_match_scalar_metrics_for_every_k():
+    max_k = 20
+    queries, recommendations = random_evaluation(300, max_k)
+
+    encoder = AssigneeEncoder()
+    relevance, lengths = build_relevance_matrix(
+        encoder.encode_many([ q["assigned_to"] for q in queries ]),
+        [ encoder.encode_many([ r["item"]["assigned_to"] for r in results ]) for results in recommendations ],
+        max_k
+    )
+    metrics = calculate_metrics_all_k(relevance, lengths)
+
+    for k in range(1, max_k + 1):
+        feedback, precision, likelihood = scalar_metrics(queries, recommendations, k)
+        assert metrics["feedback"][k - 1] == pytest.approx(feedback, abs=1e-12)
+        assert metrics["precision"][k - 1] == pytest.approx(precision, abs=1e-12)
+        assert metrics["likelihood"][k - 1] == pytest.approx(likelihood, abs=1e-12)
@@ -0,0 +1,72 @@
+import os
+import sys
+import io
+import json
+import datetime
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+import preprocess_bug_reports_from_bugzilla_and_saves_json as preprocess
+
+def raw_bug(bug_id, creation_time, resolved_when=None):
+    history = [{ "when": creation_time, "changes": [{ "field_name": "assigned_to", "added": "dev@example.com" }] }]
+    if resolved_when is not None:
+        history.append({ "when": resolved_when, "changes": [{ "field_name": "status", "added": "RESOLVED" }] })
+    return {
+        "id": bug_id,
+        "creation_time": creation_time,
+        "assigned_to": "dev@example.com",
+        "product": "Core",
+        "component": "DOM",
+        "history": history
+    }
+
+def test_mongo_sink_stores_dates_matched_by_datetime_range(tmp_path, monkeypatch):
+    input_path = tmp_path / 'bugs.json'
+    input_path.write_text(json.dumps([
+        raw_bug(1, '2010-03-01T10:00:00Z', '2010-04-01T12:00:00Z'),
+        raw_bug(2, '2011-06-01T08:30:00Z')
+    ]))
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(preprocess.pymongo, 'MongoClient', lambda url: client)
+
+    assert preprocess.process_file(str(input_path), mongo_url='mongodb://test', mongo_database='bugs') == 2
+
+    db_bugs = client['bugs']['bug']
+    in_window = db_bugs.find({ "creation_time": { "$gt": datetime.datetime(2010, 1, 1), "$lt": datetime.datetime(2010, 12, 31) } })
+    assert [ b["bg_number"] for b in in_window ] == [1]
+
+    resolved = db_bugs.find_one({ "bg_number": 1 })
+    assert resolved["when_changed_to_resolved"] == datetime.datetime(2010, 4, 1, 12, 0)
+    assert resolved["when_final_change_assigned_to"] == datetime.datetime(2010, 3, 1, 10, 0)
+    assert db_bugs.find_one({ "bg_number": 2 })["when_changed_to_resolved"] == ''
+
+def test_ndjson_sink_keeps_iso_strings(tmp_path):
+    input_path = tmp_path / 'bugs.json'
+    output_path = tmp_path / 'bugs.ndjson'
+    input_path.write_text(json.dumps([ raw_bug(1, '2010-03-01T10:00:00Z') ]))
+
+    preprocess.process_file(str(input_path), str(output_path))
+
+    bug = json.loads(output_path.read_text().splitlines()[0])
+    assert bug["creation_time"] == '2010-03-01T10:00:00Z'
+    assert "history" not in bug and bug["bg_number"] == 1
+
+def test_iter_json_array_streams_bugs_split_across_reads():
+    bugs = [ { "id": i, "summary": 'crash em [DOM], "quoted", {braces}' * (i % 3) } for i in range(25) ]
+    text = ' [\n' + ',\n  '.join(json.dumps(b) for b in bugs) + '\n] \n'
+
+    # read_size pequeno: quase todo bug fica partido entre duas leituras
+    for read_size in [1, 7, 64]:
+        assert list(preprocess.iter_json_array(io.StringIO(text), read_size=read_size)) == bugs
+    assert list(preprocess.iter_json_array(io.StringIO('[]'), read_size=1)) == []
+
+def test_iter_json_array_rejects_truncated_input():
+    with pytest.raises(ValueError):
+        list(preprocess.iter_json_array(io.StringIO('[{"id": 1}, {"id": 2}'), read_size=4))
+    with pytest.raises(ValueError):
+        list(preprocess.iter_json_array(io.StringIO('{"id": 1}')))
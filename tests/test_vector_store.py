@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processing_scripts'))
+
+from vector_store import VectorStore, quantize_int8, dequantize_int8, save_vector_store
+from similarity_engine import SimilarityEngine, normalize_embeddings_matrix
+
+def random_embeddings(n, dim=64, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+def random_engine_inputs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "tfidf_matrix": csr_matrix(rng.random((n, 16))),
+        "embeddings_matrix": random_embeddings(n, seed=seed),
+        "products": rng.choice(['Core', 'Firefox'], n).tolist(),
+        "components": rng.choice(['DOM', 'General'], n).tolist(),
+        "bg_numbers": np.arange(1, n + 1)
+    }
+
+def test_quantize_int8_error_is_at_most_half_a_step():
+    matrix = random_embeddings(200)
+    matrix[3] = 0.0 # escala zero não pode gerar nan
+
+    codes, scales = quantize_int8(matrix)
+    assert codes.dtype == np.int8 and codes.shape == matrix.shape
+    np.testing.assert_allclose(scales, np.abs(matrix).max(axis=1) / 127.0, rtol=1e-6)
+
+    error = np.abs(dequantize_int8(codes, scales) - matrix)
+    assert np.all(error <= scales[:, None] / 2 + 1e-7)
+    assert np.all(dequantize_int8(codes, scales)[3] == 0.0)
+
+def test_int8_vector_store_round_trip(tmp_path):
+    embeddings = random_embeddings(30)
+    tfidf = csr_matrix(np.random.default_rng(1).random((30, 10)))
+    save_vector_store(str(tmp_path), np.arange(100, 130), tfidf, embeddings, embeddings_dtype='int8')
+
+    store = VectorStore(str(tmp_path))
+    _, scales = quantize_int8(embeddings)
+    error = np.abs(store.embeddings_rows(np.arange(30)) - embeddings)
+    assert np.all(error <= scales[:, None] / 2 + 1e-7)
+    np.testing.assert_allclose(store.tfidf_vector(105).toarray(), tfidf[5].toarray())
+
+def test_int8_scores_stay_within_the_quantization_bound():
+    inputs = random_engine_inputs(500)
+    exact = SimilarityEngine(**inputs)
+    compact = SimilarityEngine(**inputs, embeddings_precision='int8')
+
+    query = normalize_embeddings_matrix(random_embeddings(1, seed=7)).ravel()
+    normalized = normalize_embeddings_matrix(inputs["embeddings_matrix"])
+    _, scales = quantize_int8(normalized)
+    # |(x - x̂) . q| <= ||x - x̂||_1 * max|q| <= dim * escala / 2 * max|q|
+    bound = normalized.shape[1] * scales / 2 * np.abs(query).max()
+
+    error = np.abs(compact.embeddings_scores(query) - exact.embeddings_scores(query))
+    assert np.all(error <= bound + 1e-6)
+
+def test_rerank_recomputes_the_top_candidates_in_full_precision():
+    inputs = random_engine_inputs(500)
+    exact = SimilarityEngine(**inputs)
+    query = normalize_embeddings_matrix(random_embeddings(1, seed=7)).ravel()
+    exact_scores = exact.embeddings_scores(query)
+
+    reranked = SimilarityEngine(**inputs, embeddings_precision='int8', rerank_k=20)
+    scores = reranked.embeddings_scores(query)
+    top = np.argsort(-scores, kind='stable')[:20]
+    np.testing.assert_allclose(scores[top], exact_scores[top], rtol=1e-6, atol=1e-6)
+
+    # rerank_k >= número de linhas: todos os scores em precisão total
+    full = SimilarityEngine(**inputs, embeddings_precision='int8', rerank_k=500)
+    np.testing.assert_allclose(full.embeddings_scores(query), exact_scores, rtol=1e-6, atol=1e-6)
+    rows = np.arange(0, 500, 3)
+    np.testing.assert_allclose(full.embeddings_scores(query, rows), exact_scores[rows], rtol=1e-6, atol=1e-6)